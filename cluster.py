@@ -0,0 +1,96 @@
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import wait
+
+import discord
+from dotenv import load_dotenv
+
+
+def offset_metrics_port(offset: int) -> None:
+    """
+    同じポートは1つのプロセスしか使えないので、子プロセスごとにメトリクスのポートをずらす
+    取り込みプロセスは`METRICS_PORT`、i番目のシャードのプロセスは`METRICS_PORT`+1+iで公開する
+    :param offset:
+    :return:
+    """
+
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        os.environ["METRICS_PORT"] = str(int(port) + offset)
+
+
+def run_ingest() -> None:
+    offset_metrics_port(0)
+    import ingest
+
+    ingest.main()
+
+
+def run_shards(index: int, shard_ids: list[int]) -> None:
+    offset_metrics_port(1 + index)
+    os.environ["SHARD_IDS"] = ",".join(map(str, shard_ids))
+    import main
+
+    main.main()
+
+
+def main():
+    """
+    取り込みプロセス1つと、シャードを分担するBotのプロセスを`SHARD_WORKERS`個起動する
+    いずれかのプロセスが終了した場合はそのプロセスだけを起動し直す
+    """
+
+    discord.utils.setup_logging(level=logging.INFO, root=True)
+    logger = logging.getLogger("cluster")
+
+    # .envで空のまま残した項目は既定値にする
+    shard_count = int(os.environ.get("SHARD_COUNT") or 1)
+    workers = min(
+        int(os.environ.get("SHARD_WORKERS") or os.cpu_count() or 1), shard_count
+    )
+    os.environ["SHARD_COUNT"] = str(shard_count)
+    if not os.environ.get("INGEST_SOCKET"):
+        os.environ["INGEST_SOCKET"] = "data/ingest.sock"
+
+    # 子プロセスはこのプロセスの環境変数を引き継ぐ
+    context = multiprocessing.get_context("spawn")
+    targets = {"ingest": (run_ingest, ())}
+    for i in range(workers):
+        shard_ids = list(range(i, shard_count, workers))
+        targets[f"shards-{i}"] = (run_shards, (i, shard_ids))
+
+    processes = {}
+
+    def start(name: str) -> None:
+        target, args = targets[name]
+        process = context.Process(target=target, args=args, name=name)
+        process.start()
+        processes[process.sentinel] = process
+        logger.info(f"Started {name} (pid {process.pid})")
+
+    for name in targets:
+        start(name)
+
+    try:
+        while True:
+            for sentinel in wait(list(processes)):
+                process = processes.pop(sentinel)
+                logger.warning(
+                    f"{process.name} exited with code {process.exitcode}. Restarting..."
+                )
+                time.sleep(1)
+                start(process.name)
+    except KeyboardInterrupt:
+        logger.info("Stopping...")
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
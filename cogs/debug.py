@@ -1,9 +1,20 @@
+import asyncio
+import importlib
+import io
 import os
+import sys
+import threading
+import tracemalloc
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 from main import DiscordEEWBot
+from utils.profiler import format_memory, format_profile, sample_stacks
+
+
+def text_file(text: str, filename: str) -> discord.File:
+    return discord.File(io.BytesIO(text.encode()), filename)
 
 
 @app_commands.guild_only()
@@ -13,24 +24,35 @@ class DebugCommand(
     def __init__(self, bot: DiscordEEWBot):
         super().__init__()
         self.bot = bot
+        # 計測は同時に1つだけ行う
+        self.measuring = False
 
     @app_commands.command(name="reload", description="Cogをリロードします")
-    @app_commands.describe(resync="コマンドを再同期します")
-    async def reload(self, interaction: discord.Interaction, resync: bool = False):
+    @app_commands.describe(
+        resync="コマンドを再同期します（変更が無い場合は省きます）",
+        force="変更が無くてもコマンドを再同期します",
+    )
+    async def reload(
+        self,
+        interaction: discord.Interaction,
+        resync: bool = False,
+        force: bool = False,
+    ):
         await interaction.response.defer(ephemeral=True)
 
+        # 整形処理などを先に読み込み直しておき、リロードした拡張機能から使わせる
+        for name in self.bot.reload_modules:
+            if name in sys.modules:
+                importlib.reload(sys.modules[name])
+
+        # 受信はBotが持っているので、リロード中に受信した情報は新しいCogへ渡される
         for extension in self.bot.initial_extensions:
             await self.bot.reload_extension(extension)
 
-        if resync:
-            self.bot.tree.copy_global_to(
-                guild=discord.Object(id=os.environ.get("GUILD_ID"))
-            )
-            await self.bot.tree.sync(
-                guild=discord.Object(id=os.environ.get("GUILD_ID"))
-            )
+        if resync or force:
+            await self.bot.sync_commands(force=force)
         await interaction.followup.send(
-            f"Reloaded {'and Resync Command' if resync else ''}"
+            f"Reloaded {'and Resync Command' if resync or force else ''}"
         )
 
     @app_commands.command(name="ping", description="Botのレイテンシを表示します")
@@ -40,6 +62,86 @@ class DebugCommand(
             ephemeral=True,
         )
 
+    @app_commands.command(
+        name="profile", description="イベントループのCPUプロファイルを取得します"
+    )
+    @app_commands.describe(seconds="計測する秒数")
+    async def profile(
+        self,
+        interaction: discord.Interaction,
+        seconds: app_commands.Range[int, 1, 120] = 10,
+    ):
+        if self.measuring:
+            await interaction.response.send_message(
+                "他の計測が実行中です", ephemeral=True
+            )
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        self.measuring = True
+        try:
+            # 別スレッドからイベントループのスレッドのスタックを取得する（ループは止めない）
+            stacks = await asyncio.to_thread(
+                sample_stacks, threading.get_ident(), seconds
+            )
+            summary, folded = format_profile(stacks, seconds)
+        finally:
+            self.measuring = False
+
+        await interaction.followup.send(
+            f"Profiled {seconds}s ({sum(stacks.values())} samples)",
+            files=[
+                text_file(summary, "profile.txt"),
+                text_file(folded, "profile.folded"),
+            ],
+        )
+
+    @app_commands.command(
+        name="memory", description="確保されたままのメモリが多い行を表示します"
+    )
+    @app_commands.describe(
+        limit="表示する行数",
+        seconds="起動時から計測していない場合に計測する秒数",
+    )
+    async def memory(
+        self,
+        interaction: discord.Interaction,
+        limit: app_commands.Range[int, 1, 200] = 25,
+        seconds: app_commands.Range[int, 1, 600] = 30,
+    ):
+        if self.measuring:
+            await interaction.response.send_message(
+                "他の計測が実行中です", ephemeral=True
+            )
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        self.measuring = True
+        try:
+            if tracemalloc.is_tracing():
+                # PYTHONTRACEMALLOCで起動時から計測している
+                title = "Allocated since startup"
+                snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+            else:
+                # 計測は負荷がかかるので、指定した秒数だけ計測して止める
+                title = f"Allocated in the last {seconds}s"
+                tracemalloc.start()
+                try:
+                    await asyncio.sleep(seconds)
+                    snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+                finally:
+                    tracemalloc.stop()
+            report = await asyncio.to_thread(format_memory, snapshot, limit, title)
+        finally:
+            self.measuring = False
+
+        await interaction.followup.send(title, files=[text_file(report, "memory.txt")])
+
 
-async def setup(bot):
-    await bot.add_cog(DebugCommand(bot))
+async def setup(bot: DiscordEEWBot):
+    guild_id = os.environ.get("GUILD_ID")
+    if bot.is_sharded and guild_id:
+        # グローバルに同期する場合もデバッグ用のコマンドは管理用のサーバーにのみ登録する
+        await bot.add_cog(DebugCommand(bot), guild=discord.Object(id=guild_id))
+    else:
+        await bot.add_cog(DebugCommand(bot))
@@ -1,490 +1,612 @@
 import asyncio
+import copy
 import logging
 import os
-import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 
-import aiohttp
 import discord
 from discord import app_commands
 from discord.ext import commands
 from main import DiscordEEWBot
-
-
-def format_issue_type(issue_type: str) -> str:
+from utils.dedup import LatestEventStore
+from utils.digest import StormControl
+from utils.dispatcher import Dispatcher
+from utils.eew_estimate import EEWEstimator
+from utils.embed_cache import EmbedCache
+from utils.event_store import EventStore
+from utils.events import (
+    EEWEvent,
+    Event,
+    EventError,
+    QuakeEvent,
+    TunamiEvent,
+    decode_event,
+)
+from utils.fields import add_grouped_fields, group_by
+from utils.formatting import (
+    SCALES,
+    TUNAMI_GRADES,
+    format_earthquake_depth,
+    format_earthquake_magnitude,
+    format_earthquake_points,
+    format_earthquake_scale,
+    format_earthquake_tsunami,
+    format_issue_correct,
+    format_issue_type,
+    parse_time,
+)
+from utils.ingest import JST
+from utils.quake_map import MapRenderer
+from utils.scheduler import PRIORITY_URGENT, PriorityScheduler, get_priority
+
+
+def parse_date(value: str | None, next_day: bool = False) -> str | None:
     """
-    発表種類を変換する
-    :param issue_type:
+    コマンドで指定された日付を検索用の文字列に変換する
+    :param value: "YYYY/MM/DD" または "YYYY-MM-DD"
+    :param next_day: 翌日の0時にする（終了日を含めるため）
     :return:
     """
 
-    match issue_type:
-        case "ScalePrompt":
-            return "震度速報"
-        case "Destination":
-            return "震源に関する情報"
-        case "ScaleAndDestination":
-            return "震度・震源に関する情報"
-        case "DetailScale":
-            return "各地の震度に関する情報"
-        case "Foreign":
-            return "遠地地震に関する情報"
-        case "Other":
-            return "その他の情報"
-        case _:
-            return "不明"
-
-
-def format_issue_correct(correct: str) -> str:
+    if not value:
+        return None
+
+    date = datetime.strptime(value.replace("-", "/"), "%Y/%m/%d")
+    if next_day:
+        date += timedelta(days=1)
+    return date.strftime("%Y/%m/%d")
+
+
+def quake_event_key(event: QuakeEvent) -> str:
     """
-    訂正情報を変換する
-    :param correct:
+    同じ地震に対する複数の発表をまとめるためのキー
+    発生時刻は分単位なので、震源が分かっている報は震源も加えて同じ分の別の地震と区別する
+    :param event:
     :return:
     """
 
-    match correct:
-        case "None":
-            return ""
-        case "Unknown":
-            return "訂正情報不明"
-        case "ScaleOnly":
-            return "震度情報の訂正が含まれます"
-        case "DestinationOnly":
-            return "震源情報の訂正が含まれます"
-        case "ScaleAndDestination":
-            return "震度・震源情報の訂正が含まれます"
-        case _:
-            return "訂正情報不明"
-
-
-def format_earthquake_scale(scale: int) -> str:
+    hypocenter = event.hypocenter
+    if not hypocenter.name:
+        # 震度速報は震源が未定なので発生時刻だけで表す
+        return event.earthquake_time
+    if hypocenter.located:
+        return (
+            f"{event.earthquake_time}|{hypocenter.name}"
+            f"|{hypocenter.latitude:.1f},{hypocenter.longitude:.1f}"
+        )
+    return f"{event.earthquake_time}|{hypocenter.name}"
+
+
+def build_quake_embeds(event: QuakeEvent) -> list[discord.Embed]:
     """
-    震度を変換する
-    :param scale:
+    地震情報のEmbedを組み立てる
+    :param event:
     :return:
     """
 
-    match scale:
-        case -1:
-            return "調査中"
-        case 10:
-            return "1"
-        case 20:
-            return "2"
-        case 30:
-            return "3"
-        case 40:
-            return "4"
-        case 45:
-            return "5弱"
-        case 50:
-            return "5強"
-        case 55:
-            return "6弱"
-        case 60:
-            return "6強"
-        case 70:
-            return "7"
-        case _:
-            return "不明"
-
-
-def format_earthquake_depth(depth: int) -> str:
+    hypocenter = event.hypocenter
+    max_scale = format_earthquake_scale(event.max_scale)
+    embed = discord.Embed(
+        title=f"地震情報({format_issue_type(event.issue_type)})",
+        description=f"{event.earthquake_time}頃、{f'{hypocenter.name}で' if hypocenter.name else ''}最大震度"
+        f"{max_scale}の地震がありました\n{format_issue_correct(event.issue_correct)}",
+        timestamp=parse_time(event.time),
+    )
+    embed.add_field(
+        name="最大震度",
+        value=max_scale,
+        inline=False,
+    )
+    embed.add_field(
+        name="発生時刻",
+        value=f"{event.earthquake_time}頃",
+        inline=False,
+    )
+    embed.add_field(
+        name="震源地",
+        value=hypocenter.name or "調査中",
+        inline=False,
+    )
+    embed.add_field(
+        name="深さ",
+        value=format_earthquake_depth(hypocenter.depth),
+        inline=False,
+    )
+    embed.add_field(
+        name="マグニチュード",
+        value=format_earthquake_magnitude(hypocenter.magnitude),
+        inline=False,
+    )
+    embed.add_field(
+        name="津波の有無",
+        value=format_earthquake_tsunami(event.domestic_tsunami),
+        inline=False,
+    )
+    embed.set_footer(
+        text=f"P2P地震情報 | {event.issue_source}が{event.issue_time}に発表しました"
+    )
+
+    return [embed]
+
+
+def format_quake_summary(event: QuakeEvent) -> str:
     """
-    震源の深さを変換する
-    :param depth:
+    まとめて通知するときの地震情報の1行の要約
+    :param event:
     :return:
     """
 
-    match depth:
-        case -1:
-            return "調査中"
-        case 0:
-            return "ごく浅い"
-        case _:
-            return f"{depth}km"
+    hypocenter = event.hypocenter
+    return (
+        f"{event.earthquake_time[5:16]}頃 {hypocenter.name or '震源調査中'} "
+        f"M{format_earthquake_magnitude(hypocenter.magnitude)} "
+        f"最大震度{format_earthquake_scale(event.max_scale)}"
+    )
 
 
-def format_earthquake_magnitude(magnitude: int) -> str:
+def build_tunami_embeds(event: TunamiEvent) -> list[discord.Embed]:
     """
-    マグニチュードを変換する
-    :param magnitude:
+    津波予報のEmbedを組み立てる
+    :param event:
     :return:
     """
 
-    match magnitude:
-        case -1:
-            return "調査中"
-        case _:
-            return f"{magnitude}"
+    if event.cancelled:
+        embed = discord.Embed(
+            title="津波予報情報(解除)",
+            description="先ほどの津波予報情報は解除されました",
+            timestamp=parse_time(event.time),
+        )
+        embed.set_footer(
+            text=f"P2P地震情報 | {event.issue_source}が{event.issue_time}に発表しました"
+        )
+        embeds = [embed]
+    else:
+        embed = discord.Embed(
+            title="津波予報情報",
+            description="津波予報情報が発表されました",
+            timestamp=parse_time(event.time),
+        )
+        embeds = add_grouped_fields(
+            embed,
+            (
+                (TUNAMI_GRADES[grade], (area.name for area in filtered_areas))
+                for grade, filtered_areas in group_by(
+                    event.areas, lambda area: area.grade, TUNAMI_GRADES
+                )
+            ),
+        )
 
+        embed.set_footer(
+            text=f"P2P地震情報 | {event.issue_source}が{event.issue_time}に発表しました"
+        )
 
-def format_earthquake_tsunami(tsunami: str) -> str:
-    """
-    津波情報を変換する
-    :param tsunami:
-    :return:
-    """
+    return embeds
 
-    match tsunami:
-        case "None":
-            return "無し"
-        case "Unknown":
-            return "不明"
-        case "Checking":
-            return "調査中"
-        case "NonEffective":
-            return "若干の海面変動が予想されるが、被害の心配なし"
-        case "Watch":
-            return "津波注意報"
-        case "Warning":
-            return "津波予報(種類不明)"
-        case _:
-            return "不明"
-
-
-def format_earthquake_points(points: list) -> discord.Embed:
+
+def build_eew_embeds(event: EEWEvent) -> list[discord.Embed]:
     """
-    各地の震度情報を変換する
-    :param points:
+    緊急地震速報のEmbedを組み立てる
+    :param event:
     :return:
     """
 
-    scales = [
-        {"scale": 70, "name": "震度7"},
-        {"scale": 60, "name": "震度6強"},
-        {"scale": 55, "name": "震6弱"},
-        {"scale": 50, "name": "震度5強"},
-        {"scale": 46, "name": "震度5弱以上と推定されるが震度情報を入手していない"},
-        {"scale": 45, "name": "震度5弱"},
-        {"scale": 40, "name": "震度4"},
-        {"scale": 30, "name": "震度3"},
-    ]
-    embed = discord.Embed(title="各地の震度情報")
-
-    for scale in scales:
-        filtered_points = list(filter(lambda x: x["scale"] == scale["scale"], points))
-        if len(filtered_points) > 0:
+    if event.cancelled:
+        embed = discord.Embed(
+            title="緊急地震速報(取消)",
+            description="先ほどの緊急地震速報は取り消されました",
+            timestamp=parse_time(event.time),
+            color=discord.Color.blue(),
+        )
+    else:
+        embed = discord.Embed(
+            title="緊急地震速報(警報)",
+            description="緊急地震速報が発表されました",
+            timestamp=parse_time(event.time),
+            color=discord.Color.red(),
+        )
+        hypocenter = event.hypocenter
+        if hypocenter.name:
+            embed.add_field(
+                name="震源地",
+                value=hypocenter.name,
+                inline=False,
+            )
+            embed.add_field(
+                name="深さ",
+                value=format_earthquake_depth(hypocenter.depth),
+                inline=False,
+            )
+            embed.add_field(
+                name="マグニチュード",
+                value=format_earthquake_magnitude(int(hypocenter.magnitude)),
+                inline=False,
+            )
+        else:
             embed.add_field(
-                name=scale["name"],
-                value=", ".join(map(lambda point: point["addr"], filtered_points)),
+                name="震源地",
+                value="不明",
                 inline=False,
             )
 
-    return embed
+    embed.set_footer(text=f"P2P地震情報 | {event.issue_time}に発表しました")
 
+    return [embed]
 
-class P2PQuake(commands.Cog):
-    def __init__(self, bot: DiscordEEWBot):
-        self.bot = bot
-        self.ws = None
-        self.logger = logging.getLogger("p2pquake")
-        self.latest_quake_data = None
 
-        self.should_reconnect = True
-        self.retry_count = 0
-        self.max_retries = 5  # 5回までは即再接続
-        self.retry_interval = 5  # 失敗時の最低待機秒数
-        self.cooldown_wait = 300  # 5回連続失敗したら5分休む（300秒）
+def format_eew_estimate(seconds: int, scale: int) -> str:
+    """
+    登録地点での予想を変換する
+    :param seconds: S波の到達までの秒数
+    :param scale: 予想震度
+    :return:
+    """
 
-    async def cog_load(self) -> None:
-        self.bot.loop.create_task(self.listen_p2pquake())
+    scale_text = (
+        f"震度{format_earthquake_scale(scale)}程度" if scale > 0 else "震度1未満"
+    )
+    arrival_text = (
+        f"S波到達まで約{seconds}秒" if seconds > 0 else "S波は到達済みか間もなく到達"
+    )
+    return f"{scale_text}\n{arrival_text}"
 
-    async def cog_unload(self) -> None:
-        self.should_reconnect = False  # ユーザー操作による unload → 再接続しない
-        if self.ws is not None:
-            await self.ws.close()
-
-    async def connect_websocket(self, session):
-        """WebSocket接続処理（リトライ制御あり）"""
-
-        while self.should_reconnect:
-            try:
-                self.logger.info("Trying to connect to P2P WebSocket...")
-                # ws = await session.ws_connect(
-                #      "wss://api-realtime-sandbox.p2pquake.net/v2/ws",
-                #    proxy=os.environ.get("PROXY_URL"),
-                # )
-                ws = await session.ws_connect(
-                    "https://api.p2pquake.net/v2/ws",
-                    proxy=os.environ.get("PROXY_URL"),
-                )
-                self.logger.info("P2P WebSocket Connected")
-                self.retry_count = 0  # 成功したらリセット
-                return ws
-
-            except Exception:
-                self.retry_count += 1
-                self.logger.error("WebSocket connection failed:")
-                self.logger.error(traceback.format_exc())
-
-                # 最大リトライ回数を超えたら数分待機
-                if self.retry_count > self.max_retries:
-                    wait_time = self.cooldown_wait
-                    self.logger.warning(
-                        f"Too many retries. Waiting {wait_time} seconds before retrying..."
-                    )
-                else:
-                    wait_time = self.retry_interval
 
-                await asyncio.sleep(wait_time)
+def with_map(embeds: list[discord.Embed]) -> list[discord.Embed]:
+    """
+    最初のEmbedに添付した地図を表示する（送信済みのEmbedは書き換えない）
+    :param embeds:
+    :return:
+    """
 
-        return None  # should_reconnect が False の場合
+    embed = discord.Embed.from_dict(copy.deepcopy(embeds[0].to_dict()))
+    embed.set_image(url="attachment://map.png")
+    return [embed, *embeds[1:]]
 
-    async def listen_p2pquake(self):
-        await self.bot.wait_until_ready()
 
-        async with aiohttp.ClientSession() as session:
-            while self.should_reconnect:
-                ws = await self.connect_websocket(session)
-                if ws is None:
-                    break
-
-                self.ws = ws
-
-                try:
-                    async for msg in ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            data = msg.json()
-
-                            # 重複除外
-                            data_id = data.get("_id")
-                            if data_id == self.latest_quake_data:
-                                continue
-                            self.latest_quake_data = data_id
-
-                            match data["code"]:
-                                case 551:
-                                    await self.on_jma_quake(data)
-                                case 552:
-                                    await self.on_jma_tunami(data)
-                                case 556:
-                                    await self.on_jma_eew(data)
-                                case _:
-                                    pass
-
-                        elif msg.type in (
-                            aiohttp.WSMsgType.CLOSE,
-                            aiohttp.WSMsgType.ERROR,
-                        ):
-                            raise aiohttp.ClientConnectionError()
-
-                except asyncio.CancelledError:
-                    # cog_unload → Cancelled → 再接続しない
-                    self.logger.info("listen_p2pquake task cancelled.")
-                    break
-
-                except Exception:
-                    if self.should_reconnect:
-                        self.logger.error("Unexpected error. Reconnecting...")
-                        self.logger.error(traceback.format_exc())
-                        await asyncio.sleep(1)  # 少し待って再接続
-                        continue
-                    else:
-                        break
-
-            self.logger.info("P2P WebSocket Disconnected")
-
-    async def on_jma_quake(self, data) -> None:
-        self.latest_quake_data = data
-        embeds = []
-        embed = discord.Embed(
-            title=f"地震情報({format_issue_type(data['issue']['type'])})",
-            description=f"{data['earthquake']['time']}頃、{f'{data["earthquake"]["hypocenter"]["name"]}で' if data['earthquake']['hypocenter']['name'] else ''}最大震度"
-            f"{format_earthquake_scale(data['earthquake']['maxScale'])}の地震がありました\n{format_issue_correct(data['issue']['correct'])}",
-            timestamp=datetime.strptime(data["time"], "%Y/%m/%d %H:%M:%S.%f"),
-        )
-        embed.add_field(
-            name="最大震度",
-            value=format_earthquake_scale(data["earthquake"]["maxScale"]),
-            inline=False,
-        )
-        embed.add_field(
-            name="発生時刻",
-            value=f"{data['earthquake']['time']}頃",
-            inline=False,
-        )
-        embed.add_field(
-            name="震源地",
-            value=data["earthquake"]["hypocenter"]["name"] or "調査中",
-            inline=False,
+class P2PQuake(commands.Cog):
+    def __init__(self, bot: DiscordEEWBot):
+        self.bot = bot
+        self.logger = logging.getLogger("p2pquake")
+        # 再起動直後でも/quake-infoなどに答えられるように最新の情報を書き出しておく
+        self.latest_events = LatestEventStore(
+            os.environ.get("SNAPSHOT_PATH", "data/latest_events.json") or None
         )
-        embed.add_field(
-            name="深さ",
-            value=format_earthquake_depth(data["earthquake"]["hypocenter"]["depth"]),
-            inline=False,
+        self.embed_cache = EmbedCache()
+        self.event_store = EventStore(os.environ.get("EVENT_DB_PATH", "data/events.db"))
+        # Webhookの接続と送信済みのメッセージはBotが持ち、リロード後も続報で編集する
+        self.dispatcher = Dispatcher(
+            bot,
+            max_concurrency=int(os.environ.get("DELIVERY_CONCURRENCY", 50)),
+            coalesce_window=float(os.environ.get("COALESCE_WINDOW", 1.0)),
+            webhook_client=bot.webhook_client,
+            sent=bot.sent_messages,
         )
-        embed.add_field(
-            name="マグニチュード",
-            value=format_earthquake_magnitude(
-                data["earthquake"]["hypocenter"]["magnitude"]
-            ),
-            inline=False,
+        self.map_renderer = MapRenderer(
+            cache_path=os.environ.get("MAP_CACHE_PATH", "data/map_labels.npy"),
+            workers=int(os.environ.get("MAP_WORKERS", 1)),
+            timeout=float(os.environ.get("MAP_TIMEOUT", 5)),
         )
-        embed.add_field(
-            name="津波の有無",
-            value=format_earthquake_tsunami(data["earthquake"]["domesticTsunami"]),
-            inline=False,
+        self.eew_estimator = EEWEstimator()
+        # 地図を描画中の地震 → 報の`_id`（描画中に続報が来たら古い地図を付けない）
+        self.map_waiting: dict[str, str] = {}
+        # 地震が続いている間は小さな地震のメンションをまとめる
+        self.storm_control = StormControl(
+            self.dispatcher,
+            rate=float(os.environ.get("DIGEST_RATE", 6)),
+            burst=int(os.environ.get("DIGEST_BURST", 3)),
+            urgent_scale=int(os.environ.get("DIGEST_URGENT_SCALE", 45)),
+            interval=float(os.environ.get("DIGEST_INTERVAL", 600)),
         )
-        embed.set_footer(
-            text=f"P2P地震情報 | {data['issue']['source']}が{data['issue']['time']}に発表しました"
+        # 通知先の設定はBotが持ち、更新時は索引ごと差し替わる
+        self.subscriptions = bot.subscriptions
+        self.scheduler = PriorityScheduler(
+            self.handle_message, workers=int(os.environ.get("DELIVERY_WORKERS", 4))
         )
-        embeds.append(embed)
-        if len(data["points"]) > 0 and data["earthquake"]["maxScale"] >= 30:
-            embeds.append(format_earthquake_points(data["points"]))
-
-        channel_id = int(os.environ.get("QUAKE_NOTICE_CHANNEL_ID"))
-        role_id = int(os.environ.get("QUAKE_NOTICE_ROLE_ID"))
-        await self.bot.get_channel(channel_id).send(
-            content=f"<@&{role_id}>", embeds=embeds
+
+        # 受信はBotが持ち、リロードしても接続を切らない
+        self.feed = bot.feed
+        # 取り込みプロセスがある場合は保存もそちらで行う
+        self.persist_events = not self.feed.remote
+        self.ready_task = None
+        self.warm_up_task = None
+
+    async def cog_load(self) -> None:
+        # 地点ごとの配列は通知先が変わったときに作り直し、緊急地震速報の配信中には作らない
+        self.update_eew_estimator()
+        self.subscriptions.listeners.append(self.update_eew_estimator)
+        await asyncio.to_thread(self.latest_events.load)
+        await self.event_store.open()
+        self.map_renderer.start()
+        self.storm_control.start()
+        self.scheduler.start()
+        # Gatewayへの接続を待たずに配信を始める（準備完了前はREST APIで送信する）
+        self.feed.attach(self.on_data)
+        self.ready_task = asyncio.create_task(self.on_first_ready())
+
+    async def cog_unload(self) -> None:
+        self.subscriptions.listeners.remove(self.update_eew_estimator)
+        if self.ready_task is not None:
+            self.ready_task.cancel()
+        if self.warm_up_task is not None:
+            self.warm_up_task.cancel()
+        # 以降に受信した情報と配信しきれなかった情報は次に読み込まれたCogへ渡す
+        self.feed.detach()
+        self.feed.requeue(
+            (event.to_dict(), received_at)
+            for event, received_at in await self.scheduler.shutdown()
         )
+        await self.storm_control.stop()
+        # まとめて編集する予定の続報を送り終えてから閉じる
+        await self.dispatcher.drain()
+        await self.map_renderer.close()
+        await self.latest_events.close()
+        await self.event_store.close()
 
-    async def on_jma_tunami(self, data) -> None:
-        if data["cancelled"]:
-            embed = discord.Embed(
-                title="津波予報情報(解除)",
-                description="先ほどの津波予報情報は解除されました",
-                timestamp=datetime.strptime(data["time"], "%Y/%m/%d %H:%M:%S.%f"),
-            )
-            embed.set_footer(
-                text=f"P2P地震情報 | {data['issue']['source']}が{data['issue']['time']}に発表しました"
-            )
-        else:
-            grades = [
-                {"grade": "MajorWarning", "name": "大津波警報"},
-                {"grade": "Warning", "name": "津波警報"},
-                {"grade": "Watch", "name": "津波注意報"},
-                {"grade": "Unknown", "name": "不明"},
-            ]
-            embed = discord.Embed(
-                title="津波予報情報",
-                description="津波予報情報が発表されました",
-                timestamp=datetime.strptime(data["time"], "%Y/%m/%d %H:%M:%S.%f"),
-            )
+    def update_eew_estimator(self) -> None:
+        self.eew_estimator.update(self.subscriptions.eew.subscriptions)
 
-            for grade in grades:
-                filtered_areas = list(
-                    filter(lambda x: x["grade"] == grade["grade"], data["areas"])
-                )
-                if len(filtered_areas) > 0:
-                    embed.add_field(
-                        name=grade["name"],
-                        value=", ".join(map(lambda area: area["name"], filtered_areas)),
-                        inline=False,
+    async def on_first_ready(self) -> None:
+        await self.bot.wait_until_ready()
+        await self.warm_up_channels()
+
+    async def warm_up_channels(self) -> None:
+        # 起動直後は on_ready と on_first_ready の両方から呼ばれるので1回にまとめる
+        if self.warm_up_task is None or self.warm_up_task.done():
+            subscriptions = self.subscriptions
+            self.warm_up_task = asyncio.create_task(
+                self.dispatcher.channels.warm_up(
+                    subscription
+                    for index in (
+                        subscriptions.quake,
+                        subscriptions.tunami,
+                        subscriptions.eew,
                     )
-
-            embed.set_footer(
-                text=f"P2P地震情報 | {data['issue']['source']}が{data['issue']['time']}に発表しました"
+                    for subscription in index.subscriptions
+                    if self.dispatcher.is_local(subscription)
+                )
             )
+        await self.warm_up_task
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        if self.warm_up_task is not None and self.warm_up_task.done():
+            # 再接続でキャッシュが作り直された → 解決し直す
+            self.dispatcher.channels.channels.clear()
+        await self.warm_up_channels()
+
+    def on_data(self, data: dict, received_at: float, raw: str | None) -> None:
+        if self.persist_events:
+            self.event_store.append(data)
+
+        # 形式の確認は受信時に一度だけ行い、以降は変換したものだけを扱う
+        try:
+            event = decode_event(data)
+        except EventError as e:
+            self.logger.warning(f"Dropped invalid event {data.get('_id')}: {e}")
+            return
+        self.latest_events.update(event)
+        self.scheduler.enqueue(event, received_at)
+
+    async def handle_message(self, event: Event) -> None:
+        match event:
+            case QuakeEvent():
+                await self.on_jma_quake(event)
+            case TunamiEvent():
+                await self.on_jma_tunami(event)
+            case EEWEvent():
+                await self.on_jma_eew(event)
+            case _:
+                pass
+
+    async def on_jma_quake(self, event: QuakeEvent) -> None:
+        # 観測点は使う直前に変換し、不正な場合は観測点を除いて配信する
+        if not event.points.load():
+            self.logger.warning(f"Dropped invalid points of {event.id}")
+
+        event_key = quake_event_key(event)
+        if event.issue_correct != "None":
+            # 訂正情報が来たら同じ地震の組み立て済みEmbedを破棄する
+            self.embed_cache.invalidate(event_key)
+
+        embeds = self.embed_cache.get_or_build(event, build_quake_embeds, event_key)
+        if event.max_scale >= 30 and event.points:
+            embeds.extend(format_earthquake_points(event.points))
+
+        key = f"551:{event_key}"
+        if event_key != event.earthquake_time:
+            # 震度速報で送ったメッセージ・まとめは、震源が分かった最初の報で引き継ぐ
+            prompt_key = f"551:{event.earthquake_time}"
+            self.dispatcher.rename(prompt_key, key)
+            self.storm_control.rename(prompt_key, key)
+        subscriptions = self.storm_control.filter(
+            self.subscriptions.quake.match(event.max_scale, event.points),
+            event.max_scale,
+            key,
+            format_quake_summary(event),
+        )
+        # 同じ地震の続報は送信済みのメッセージを編集する
+        send = asyncio.create_task(
+            self.dispatcher.fan_out(subscriptions, embeds=embeds, key=key)
+        )
+        if not (
+            event.issue_type == "DetailScale"
+            and event.points
+            and self.map_renderer.enabled
+        ):
+            # 震度速報などには地図を付けない
+            self.map_waiting.pop(key, None)
+            await send
+            return
 
-        channel_id = int(os.environ.get("TUNAMI_NOTICE_CHANNEL_ID"))
-        role_id = int(os.environ.get("TUNAMI_NOTICE_ROLE_ID"))
-        await self.bot.get_channel(channel_id).send(
-            content=f"<@&{role_id}>", embed=embed
+        # 地図は送信を待たせずに描画し、描画できたら送信済みのメッセージに付ける
+        self.map_waiting[key] = event.id
+        try:
+            image = await self.map_renderer.render_quake(event)
+            await send
+            if image is not None and self.map_waiting.get(key) == event.id:
+                await self.dispatcher.fan_out(
+                    subscriptions, embeds=with_map(embeds), key=key, image=image
+                )
+        finally:
+            if self.map_waiting.get(key) == event.id:
+                del self.map_waiting[key]
+
+    async def on_jma_tunami(self, event: TunamiEvent) -> None:
+        embeds = build_tunami_embeds(event)
+        subscriptions = self.subscriptions.tunami.subscriptions
+        key = f"552:{event.id}"
+        # 大津波警報はチャンネルのレートリミットの待ちで地震情報を追い越す
+        urgent = get_priority(event) == PRIORITY_URGENT
+
+        # 大津波警報などは地図を待たずに送り、描画できたら送信済みのメッセージに付ける
+        send = asyncio.create_task(
+            self.dispatcher.fan_out(
+                subscriptions, embeds=embeds, key=key, urgent=urgent
+            )
         )
+        image = None
+        if not event.cancelled and self.map_renderer.enabled:
+            image = await self.map_renderer.render_tunami(event)
+        await send
+        if image is not None:
+            await self.dispatcher.fan_out(
+                subscriptions,
+                embeds=with_map(embeds),
+                key=key,
+                image=image,
+                urgent=urgent,
+            )
 
-    async def on_jma_eew(self, data) -> None:
-        if data.get("test", False):
+    async def on_jma_eew(self, event: EEWEvent) -> None:
+        if event.test:
             return
 
-        if data["cancelled"]:
-            embed = discord.Embed(
-                title="緊急地震速報(取消)",
-                description="先ほどの緊急地震速報は取り消されました",
-                timestamp=datetime.strptime(data["time"], "%Y/%m/%d %H:%M:%S.%f"),
-                color=discord.Color.blue(),
-            )
+        embeds = build_eew_embeds(event)
+
+        variants = None
+        if event.cancelled:
+            # 取消は絞り込まずに全ての通知先へ送る
+            subscriptions = self.subscriptions.eew.subscriptions
         else:
-            embed = discord.Embed(
-                title="緊急地震速報(警報)",
-                description="緊急地震速報が発表されました",
-                timestamp=datetime.strptime(data["time"], "%Y/%m/%d %H:%M:%S.%f"),
-                color=discord.Color.red(),
+            subscriptions = self.subscriptions.eew.match(
+                max((area.scale_from for area in event.areas), default=-1),
+                ((area.pref, area.name, area.scale_from) for area in event.areas),
             )
-            if data["earthquake"]["hypocenter"]["name"]:
-                embed.add_field(
-                    name="震源地",
-                    value=data["earthquake"]["hypocenter"]["name"],
-                    inline=False,
-                )
-                embed.add_field(
-                    name="深さ",
-                    value=format_earthquake_depth(
-                        int(data["earthquake"]["hypocenter"]["depth"])
-                    ),
-                    inline=False,
-                )
-                embed.add_field(
-                    name="マグニチュード",
-                    value=format_earthquake_magnitude(
-                        int(data["earthquake"]["hypocenter"]["magnitude"])
-                    ),
-                    inline=False,
-                )
-            else:
+            variants = self.build_estimate_variants(event, subscriptions, embeds)
+        await self.dispatcher.fan_out(
+            subscriptions,
+            embeds=embeds,
+            key=f"556:{event.event_id}",
+            variants=variants,
+            urgent=True,
+        )
+
+    def build_estimate_variants(
+        self, event: EEWEvent, subscriptions: list, embeds: list[discord.Embed]
+    ) -> dict[int, list[discord.Embed]]:
+        """
+        位置を登録した通知先ごとに予想震度・S波の到達までの秒数を加えたEmbedを作る
+        同じ予想になった通知先では同じEmbedを使う
+        :param event:
+        :param subscriptions:
+        :param embeds:
+        :return: channel_id → Embed
+        """
+
+        try:
+            elapsed = (
+                datetime.now(JST).replace(tzinfo=None) - parse_time(event.origin_time)
+            ).total_seconds()
+        except (TypeError, ValueError):
+            elapsed = 0.0
+        result = self.eew_estimator.estimate(event.hypocenter, elapsed)
+        if result is None:
+            return {}
+
+        arrivals, scales = result
+        rows = self.eew_estimator.rows
+        variants = {}
+        built: dict[tuple[int, int], list[discord.Embed]] = {}
+        for subscription in subscriptions:
+            row = rows.get(subscription.channel_id)
+            if row is None:
+                continue
+            estimate = (max(0, int(arrivals[row])), int(scales[row]))
+            variant = built.get(estimate)
+            if variant is None:
+                # Embed.copy()はフィールドの一覧を共有するので辞書から作り直す
+                embed = discord.Embed.from_dict(copy.deepcopy(embeds[0].to_dict()))
                 embed.add_field(
-                    name="震源地",
-                    value="不明",
+                    name="登録地点の予想（推定）",
+                    value=format_eew_estimate(*estimate),
                     inline=False,
                 )
-
-        embed.set_footer(text=f"P2P地震情報 | {data['issue']['time']}に発表しました")
-
-        channel_id = int(os.environ.get("EEW_NOTICE_CHANNEL_ID"))
-        role_id = int(os.environ.get("EEW_NOTICE_ROLE_ID"))
-        await self.bot.get_channel(channel_id).send(
-            content=f"<@&{role_id}>", embed=embed
-        )
+                variant = built[estimate] = [embed, *embeds[1:]]
+            variants[subscription.channel_id] = variant
+        return variants
 
     @app_commands.command(name="quake-info", description="最新の地震情報を表示します")
     async def quake_info(self, interaction: discord.Interaction):
-        data = self.latest_quake_data
-        if data is None:
+        event = self.latest_events.quake
+        if event is None:
             await interaction.response.send_message("No Data")
             return
 
-        embed = discord.Embed(
-            title=f"地震情報({format_issue_type(data['issue']['type'])})",
-            description=f"{data['earthquake']['time']}頃、{f'{data["earthquake"]["hypocenter"]["name"]}で' if data['earthquake']['hypocenter']['name'] else ''}最大震度"
-            f"{format_earthquake_scale(data['earthquake']['maxScale'])}の地震がありました\n{format_issue_correct(data['issue']['correct'])}",
-            timestamp=datetime.strptime(data["time"], "%Y/%m/%d %H:%M:%S.%f"),
-        )
-        embed.add_field(
-            name="最大震度",
-            value=format_earthquake_scale(data["earthquake"]["maxScale"]),
-            inline=False,
-        )
-        embed.add_field(
-            name="発生時刻",
-            value=f"{data['earthquake']['time']}頃",
-            inline=False,
-        )
-        embed.add_field(
-            name="震源地",
-            value=data["earthquake"]["hypocenter"]["name"] or "調査中",
-            inline=False,
+        embeds = self.embed_cache.get_or_build(
+            event, build_quake_embeds, quake_event_key(event)
         )
-        embed.add_field(
-            name="深さ",
-            value=format_earthquake_depth(data["earthquake"]["hypocenter"]["depth"]),
-            inline=False,
-        )
-        embed.add_field(
-            name="マグニチュード",
-            value=format_earthquake_magnitude(
-                data["earthquake"]["hypocenter"]["magnitude"]
-            ),
-            inline=False,
-        )
-        embed.add_field(
-            name="津波の有無",
-            value=format_earthquake_tsunami(data["earthquake"]["domesticTsunami"]),
-            inline=False,
-        )
-        embed.set_footer(
-            text=f"P2P地震情報 | {data['issue']['source']}が{data['issue']['time']}に発表しました"
+        await interaction.response.send_message(embeds=embeds)
+
+    @app_commands.command(
+        name="quake-history", description="過去の地震情報を検索します"
+    )
+    @app_commands.describe(
+        start="この日以降（例: 2024/01/01）",
+        end="この日まで（例: 2024/01/31）",
+        min_scale="最大震度の下限",
+        region="震源地または都道府県",
+    )
+    @app_commands.choices(
+        min_scale=[
+            app_commands.Choice(
+                name=f"震度{format_earthquake_scale(scale)}", value=scale
+            )
+            for scale in SCALES
+        ]
+    )
+    async def quake_history(
+        self,
+        interaction: discord.Interaction,
+        start: str | None = None,
+        end: str | None = None,
+        min_scale: int | None = None,
+        region: str | None = None,
+    ):
+        try:
+            start = parse_date(start)
+            end = parse_date(end, next_day=True)
+        except ValueError:
+            await interaction.response.send_message(
+                "日付は`2024/01/01`の形式で指定してください", ephemeral=True
+            )
+            return
+
+        events = await self.event_store.query(
+            code=551, start=start, end=end, min_scale=min_scale, region=region
         )
+        if not events:
+            await interaction.response.send_message("No Data")
+            return
 
+        embed = discord.Embed(title="地震情報の履歴")
+        for event in events:
+            magnitude = event.magnitude if event.magnitude is not None else -1
+            embed.add_field(
+                name=f"{event.time[:16]} {event.hypocenter or '調査中'}",
+                value=f"最大震度{format_earthquake_scale(event.max_scale)} / "
+                f"M{format_earthquake_magnitude(magnitude)}",
+                inline=False,
+            )
         await interaction.response.send_message(embed=embed)
 
 
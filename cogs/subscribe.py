@@ -0,0 +1,194 @@
+import logging
+import traceback
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+from main import DiscordEEWBot
+from utils.formatting import SCALES, format_earthquake_scale
+from utils.subscription import Subscription, expand_regions
+
+KIND_NAMES = {
+    "quake": "地震情報",
+    "tunami": "津波予報",
+    "eew": "緊急地震速報",
+}
+
+KIND_CHOICES = [
+    app_commands.Choice(name=name, value=kind) for kind, name in KIND_NAMES.items()
+]
+
+
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+class SubscribeCommand(
+    commands.GroupCog, name="subscribe", description="通知先を設定するコマンド"
+):
+    def __init__(self, bot: DiscordEEWBot):
+        super().__init__()
+        self.bot = bot
+        self.logger = logging.getLogger("subscribe")
+
+    async def get_webhook_url(self, channel: discord.TextChannel) -> str:
+        """
+        Botが作成したWebhookがあれば使い回し、無ければ作成する
+        1つのチャンネルに作成できるWebhookの数には上限があるので、通知する情報の種類が違っても同じWebhookで送る
+        :param channel:
+        :return:
+        """
+
+        for webhook in await channel.webhooks():
+            if (
+                webhook.user is not None
+                and webhook.user.id == self.bot.user.id
+                and webhook.token
+            ):
+                return webhook.url
+        created = await channel.create_webhook(name=self.bot.user.name)
+        return created.url
+
+    async def delete_unused_webhook(self, webhook_url: str | None) -> None:
+        """
+        どの通知先も使わなくなったWebhookを削除する
+        :param webhook_url:
+        :return:
+        """
+
+        if webhook_url is None or self.bot.subscriptions.uses_webhook(webhook_url):
+            return
+        try:
+            await discord.Webhook.from_url(webhook_url, client=self.bot).delete()
+        except discord.NotFound:
+            # 既に削除されている
+            pass
+        except discord.HTTPException:
+            self.logger.error(f"Failed to delete webhook {webhook_url}:")
+            self.logger.error(traceback.format_exc())
+
+    @app_commands.command(name="add", description="通知先を追加します")
+    @app_commands.describe(
+        kind="通知する情報",
+        channel="通知するチャンネル",
+        role="通知するときにメンションするロール",
+        min_scale="この震度以上の場合のみ通知します（地震情報・緊急地震速報）",
+        regions="この地域の場合のみ通知します（地方名・都道府県名・観測点名をカンマ区切り）",
+        webhook="Webhookを作成して送信します（Botのキャッシュに依存せず送信できます）",
+        latitude="緊急地震速報で予想震度・S波の到達までの秒数を表示する地点の緯度",
+        longitude="緊急地震速報で予想震度・S波の到達までの秒数を表示する地点の経度",
+    )
+    @app_commands.choices(
+        kind=KIND_CHOICES,
+        min_scale=[
+            app_commands.Choice(
+                name=f"震度{format_earthquake_scale(scale)}", value=scale
+            )
+            for scale in SCALES
+        ],
+    )
+    async def add(
+        self,
+        interaction: discord.Interaction,
+        kind: str,
+        channel: discord.TextChannel,
+        role: discord.Role | None = None,
+        min_scale: int | None = None,
+        regions: str | None = None,
+        webhook: bool = False,
+        latitude: app_commands.Range[float, -90, 90] | None = None,
+        longitude: app_commands.Range[float, -180, 180] | None = None,
+    ):
+        if (latitude is None) != (longitude is None):
+            await interaction.response.send_message(
+                "緯度と経度は両方指定してください", ephemeral=True
+            )
+            return
+
+        # Webhookの作成やファイルへの書き込みに時間がかかっても応答の期限を切らさない
+        await interaction.response.defer(ephemeral=True)
+
+        webhook_url = None
+        if webhook:
+            try:
+                webhook_url = await self.get_webhook_url(channel)
+            except discord.Forbidden:
+                await interaction.followup.send(
+                    "Webhookを作成するためにはBotに`ウェブフックの管理`権限が必要です",
+                    ephemeral=True,
+                )
+                return
+            except discord.HTTPException as e:
+                # チャンネルのWebhookが上限に達しているなど
+                await interaction.followup.send(
+                    f"Webhookを作成できませんでした（{e.text or e.status}）",
+                    ephemeral=True,
+                )
+                return
+
+        subscription = Subscription(
+            guild_id=interaction.guild_id,
+            channel_id=channel.id,
+            role_id=role.id if role else None,
+            min_scale=min_scale,
+            regions=expand_regions(regions.split(",")) if regions else frozenset(),
+            webhook_url=webhook_url,
+            latitude=latitude,
+            longitude=longitude,
+        )
+        replaced = await self.bot.subscriptions.add(kind, subscription)
+        if replaced is not None and replaced.webhook_url != webhook_url:
+            await self.delete_unused_webhook(replaced.webhook_url)
+        await interaction.followup.send(
+            f"{channel.mention}に{KIND_NAMES[kind]}を通知します", ephemeral=True
+        )
+
+    @app_commands.command(name="remove", description="通知先を削除します")
+    @app_commands.describe(kind="通知する情報", channel="通知しているチャンネル")
+    @app_commands.choices(kind=KIND_CHOICES)
+    async def remove(
+        self,
+        interaction: discord.Interaction,
+        kind: str,
+        channel: discord.TextChannel,
+    ):
+        await interaction.response.defer(ephemeral=True)
+
+        removed = await self.bot.subscriptions.remove(kind, channel.id)
+        if removed is not None:
+            await self.delete_unused_webhook(removed.webhook_url)
+            msg = f"{channel.mention}への{KIND_NAMES[kind]}の通知を削除しました"
+        else:
+            msg = f"{channel.mention}には{KIND_NAMES[kind]}を通知していません"
+        await interaction.followup.send(msg, ephemeral=True)
+
+    @app_commands.command(name="list", description="通知先の一覧を表示します")
+    async def list_subscriptions(self, interaction: discord.Interaction):
+        embed = discord.Embed(title="通知先の一覧")
+        for kind, subscriptions in self.bot.subscriptions.find(
+            interaction.guild_id
+        ).items():
+            lines = []
+            for subscription in subscriptions:
+                line = f"<#{subscription.channel_id}>"
+                if subscription.mention:
+                    line += f" {subscription.mention}"
+                if subscription.min_scale is not None:
+                    line += (
+                        f" 震度{format_earthquake_scale(subscription.min_scale)}以上"
+                    )
+                if subscription.regions:
+                    line += f" ({', '.join(sorted(subscription.regions))})"
+                if subscription.latitude is not None:
+                    line += f" 地点: {subscription.latitude:.2f}, {subscription.longitude:.2f}"
+                if subscription.webhook_url:
+                    line += " [Webhook]"
+                lines.append(line)
+            embed.add_field(
+                name=KIND_NAMES[kind],
+                value="\n".join(lines)[:1024] if lines else "なし",
+                inline=False,
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+async def setup(bot: DiscordEEWBot):
+    await bot.add_cog(SubscribeCommand(bot))
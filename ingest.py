@@ -0,0 +1,77 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import traceback
+
+import discord
+from dotenv import load_dotenv
+
+from utils import metrics
+from utils.event_store import EventStore
+from utils.ingest import P2PIngest
+from utils.ipc import EventServer
+
+
+async def run() -> None:
+    """
+    P2P地震情報から受信し、各シャードのプロセスへ配る
+    シャード構成ではP2P地震情報への接続と保存はこのプロセスだけが行う
+    """
+
+    logger = logging.getLogger("ingest")
+    event_store = EventStore(os.environ.get("EVENT_DB_PATH", "data/events.db"))
+    server = EventServer(os.environ.get("INGEST_SOCKET") or "data/ingest.sock")
+
+    def on_data(data: dict, received_at: float, raw: str | None) -> None:
+        if raw is None:
+            # 履歴APIから補完した情報
+            raw = json.dumps(data, ensure_ascii=False, default=list)
+        server.broadcast(raw)
+        event_store.append(data)
+
+    source = P2PIngest(on_data)
+    metrics_server = None
+    if os.environ.get("METRICS_PORT"):
+        metrics_server = metrics.MetricsServer(
+            host=os.environ.get("METRICS_HOST", "127.0.0.1"),
+            port=int(os.environ.get("METRICS_PORT")),
+        )
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+
+    await event_store.open()
+    await server.start()
+    if metrics_server is not None:
+        try:
+            await metrics_server.start()
+        except OSError:
+            # メトリクスを公開できなくても配信は止めない
+            logger.error(traceback.format_exc())
+            metrics_server = None
+    source.start()
+    logger.info("Ingest started")
+
+    try:
+        await stopped.wait()
+    finally:
+        logger.info("Ingest stopping...")
+        await source.stop()
+        await server.stop()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await event_store.close()
+
+
+def main():
+    discord.utils.setup_logging(level=logging.INFO, root=True)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
@@ -1,4 +1,5 @@
 import logging
+import math
 import os
 import traceback
 
@@ -7,29 +8,126 @@ from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 
+from utils import metrics
+from utils.command_sync import CommandSyncCache
+from utils.dispatcher import SentMessages
+from utils.feed import EventFeed
+from utils.profiler import LoopMonitor
+from utils.subscription_store import SubscriptionStore
+from utils.webhook import WebhookClient
+
 
 class DiscordEEWBot(commands.Bot):
-    def __init__(self):
+    def __init__(self, **options):
         super().__init__(
             command_prefix=(),
             help_command=None,
             intents=discord.Intents.default(),
             proxy=os.environ.get("PROXY_URL"),
+            **options,
         )
 
         self.logger = logging.getLogger("bot")
-        self.initial_extensions = ["cogs.debug", "cogs.p2pquake"]
+        self.initial_extensions = ["cogs.debug", "cogs.p2pquake", "cogs.subscribe"]
+        # /debug reload で拡張機能より先に読み込み直すモジュール（依存される順）
+        self.reload_modules = ["utils.fields", "utils.formatting"]
+        self.metrics_server = None
+        self.subscriptions = SubscriptionStore(
+            os.environ.get("SUBSCRIPTION_PATH", "data/subscriptions.json"),
+            reload_interval=float(os.environ.get("SUBSCRIPTION_RELOAD_INTERVAL", 5)),
+        )
+        self.command_sync = CommandSyncCache(
+            os.environ.get("COMMAND_HASH_PATH", "data/command_hash.json")
+        )
+        # 受信はBotが持ち、Cogをリロードしても接続を保つ
+        self.feed = EventFeed(os.environ.get("INGEST_SOCKET"))
+        # Webhookの接続と送信済みのメッセージもBotが持ち、リロード後も続報で同じメッセージを編集する
+        self.webhook_client = WebhookClient(
+            keepalive_interval=float(os.environ.get("WEBHOOK_KEEPALIVE_INTERVAL", 30))
+        )
+        self.sent_messages = SentMessages()
+        # イベントループが止まった場合にその場所をログに出す
+        self.loop_monitor = LoopMonitor(
+            threshold=float(os.environ.get("LOOP_LAG_THRESHOLD", 0.25))
+        )
 
     async def setup_hook(self) -> None:
+        self.loop_monitor.start()
+
+        if os.environ.get("METRICS_PORT"):
+            metrics.GATEWAY_LATENCY.set_function(
+                lambda: None if math.isnan(self.latency) else self.latency
+            )
+            self.metrics_server = metrics.MetricsServer(
+                host=os.environ.get("METRICS_HOST", "127.0.0.1"),
+                port=int(os.environ.get("METRICS_PORT")),
+            )
+            try:
+                await self.metrics_server.start()
+            except OSError:
+                # メトリクスを公開できなくても通知は止めない
+                self.logger.error(traceback.format_exc())
+                self.metrics_server = None
+
+        # 通知先は配信処理の前に一度だけ読み込む
+        await self.subscriptions.load()
+        self.subscriptions.start()
+
+        await self.webhook_client.start()
+
+        # Gatewayへの接続を待たずに受信を始める（Cogが読み込まれるまでは溜めておく）
+        self.feed.start()
+
         for extension in self.initial_extensions:
             await self.load_extension(extension)
 
-        # self.tree.clear_commands()
-        self.tree.copy_global_to(guild=discord.Object(id=os.environ.get("GUILD_ID")))
-        await self.tree.sync(guild=discord.Object(id=os.environ.get("GUILD_ID")))
+        await self.sync_commands()
 
         self.tree.on_error = self.on_tree_error
 
+    @property
+    def is_sharded(self) -> bool:
+        return self.shard_count is not None
+
+    async def sync_commands(self, force: bool = False) -> None:
+        """
+        コマンドを同期する
+        シャード構成または`GUILD_ID`が無い場合は全てのサーバーで使えるようにグローバルに同期する
+        前回の同期からコマンドが変わっていなければAPIを呼ばない
+        :param force: 変更が無くても同期する
+        :return:
+        """
+
+        guild_id = os.environ.get("GUILD_ID")
+        if not self.is_sharded and guild_id:
+            # self.tree.clear_commands()
+            self.tree.copy_global_to(guild=discord.Object(id=guild_id))
+            await self.command_sync.sync(
+                self.tree, discord.Object(id=guild_id), force=force
+            )
+            return
+
+        # 同期は1つのプロセス(シャード0を持つプロセス)だけが行う
+        shard_ids = getattr(self, "shard_ids", None)
+        if shard_ids is not None and 0 not in shard_ids:
+            return
+        await self.command_sync.sync(self.tree, force=force)
+        if guild_id:
+            # デバッグ用のコマンドは管理用のサーバーにのみ登録している
+            await self.command_sync.sync(
+                self.tree, discord.Object(id=guild_id), force=force
+            )
+
+    async def close(self) -> None:
+        await self.feed.stop()
+        await self.subscriptions.stop()
+        await self.loop_monitor.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        # 拡張機能を外して配信を終えてから閉じる
+        await super().close()
+        await self.webhook_client.close()
+
     async def on_ready(self):
         self.logger.info(f"Logged in as {self.user}")
 
@@ -85,8 +183,27 @@ class DiscordEEWBot(commands.Bot):
                 await interaction.response.send_message(msg, ephemeral=True)
 
 
+class ShardedDiscordEEWBot(DiscordEEWBot, commands.AutoShardedBot):
+    """
+    シャード構成で動かすBot
+    `SHARD_IDS`を指定すると一部のシャードだけを担当する（複数プロセスで分担する場合）
+    """
+
+
+def create_bot() -> DiscordEEWBot:
+    shard_count = os.environ.get("SHARD_COUNT")
+    if not shard_count:
+        return DiscordEEWBot()
+
+    shard_ids = os.environ.get("SHARD_IDS")
+    return ShardedDiscordEEWBot(
+        shard_count=int(shard_count),
+        shard_ids=[int(v) for v in shard_ids.split(",")] if shard_ids else None,
+    )
+
+
 def main():
-    bot = DiscordEEWBot()
+    bot = create_bot()
     bot.run(os.environ.get("DISCORD_TOKEN"), root_logger=True, log_level=logging.INFO)
 
 
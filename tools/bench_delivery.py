@@ -0,0 +1,214 @@
+"""
+リプレイサーバーと擬似的なDiscordチャンネルを使って受信→送信のレイテンシとスループットを計測する
+
+    python -m tools.bench_delivery --rate 50 --count 500 --subscribers 100
+
+Discordには接続しない
+"""
+
+import argparse
+import asyncio
+import contextvars
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from tools.replay_server import ReplayServer, load_events
+
+# 配信中のイベントの_id（送信先で受信時刻と突き合わせる）
+current_id: contextvars.ContextVar[str] = contextvars.ContextVar("current_id")
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel"):
+        self.channel = channel
+
+    async def edit(self, content=None, embeds=None, **kwargs):
+        await asyncio.sleep(self.channel.send_delay)
+        self.channel.sink.record(current_id.get(None))
+        return self
+
+    async def delete(self):
+        await asyncio.sleep(self.channel.send_delay)
+
+
+class FakeChannel:
+    """
+    送信した時刻を記録するだけのチャンネル
+    """
+
+    def __init__(self, channel_id: int, sink: "Sink", send_delay: float):
+        self.id = channel_id
+        self.sink = sink
+        self.send_delay = send_delay
+
+    async def send(self, content=None, embeds=None, **kwargs):
+        # Discord APIの往復時間の代わり
+        await asyncio.sleep(self.send_delay)
+        self.sink.record(current_id.get(None))
+        return FakeMessage(self)
+
+
+class Sink:
+    def __init__(self):
+        # _id → 送信完了時刻の一覧
+        self.sent: dict[str, list[float]] = {}
+
+    def record(self, data_id: str | None) -> None:
+        self.sent.setdefault(data_id, []).append(time.perf_counter())
+
+
+class FakeBot:
+    """
+    P2PQuakeが使う範囲だけを実装したBot
+    """
+
+    def __init__(
+        self,
+        channels: dict[int, FakeChannel],
+        subscriptions,
+        feed,
+        webhook_client,
+        sent_messages,
+    ):
+        self.channels = channels
+        self.subscriptions = subscriptions
+        self.feed = feed
+        self.webhook_client = webhook_client
+        self.sent_messages = sent_messages
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_running_loop()
+
+    async def wait_until_ready(self) -> None:
+        return None
+
+    def get_channel(self, channel_id: int) -> FakeChannel | None:
+        return self.channels.get(channel_id)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(args: argparse.Namespace) -> None:
+    server = ReplayServer(
+        load_events(args.events), rate=args.rate, count=args.count, port=args.port
+    )
+    await server.start()
+
+    channel_ids = list(range(1, args.subscribers + 1))
+    for prefix in ("QUAKE_NOTICE", "TUNAMI_NOTICE", "EEW_NOTICE"):
+        os.environ[f"{prefix}_CHANNEL_ID"] = ",".join(map(str, channel_ids))
+        os.environ[f"{prefix}_ROLE_ID"] = ",".join(map(str, channel_ids))
+    os.environ["P2PQUAKE_WS_URL"] = server.url
+    os.environ.setdefault("MAP_WORKERS", "0")
+    os.environ.setdefault("DIGEST_INTERVAL", "0")
+    os.environ.setdefault("SNAPSHOT_PATH", "")
+
+    # 受信した情報は実際のデータベースではなく一時ディレクトリに保存する
+    tmpdir = tempfile.TemporaryDirectory()
+    os.environ["EVENT_DB_PATH"] = os.path.join(tmpdir.name, "events.db")
+
+    # 環境変数を設定してから読み込む
+    from cogs.p2pquake import P2PQuake
+    from utils.dispatcher import SentMessages
+    from utils.feed import EventFeed
+    from utils.subscription_store import SubscriptionStore
+    from utils.webhook import WebhookClient
+
+    # 通知先は環境変数から新しいファイルに引き継がせる
+    subscriptions = SubscriptionStore(
+        os.path.join(tmpdir.name, "subscriptions.json"), reload_interval=0
+    )
+    await subscriptions.load()
+
+    sink = Sink()
+    bot = FakeBot(
+        {i: FakeChannel(i, sink, args.send_delay) for i in channel_ids},
+        subscriptions,
+        EventFeed(),
+        WebhookClient(keepalive_interval=0),
+        SentMessages(),
+    )
+    cog = P2PQuake(bot)
+    if not args.rate_limit:
+        # Bot側の処理時間だけを計測するためにチャンネルごとの送信制限を外す
+        cog.dispatcher.route_limit = args.count * 10
+
+    handle_message = cog.handle_message
+
+    async def traced_handle_message(data):
+        current_id.set(data.id)
+        await handle_message(data)
+
+    cog.scheduler.handler = traced_handle_message
+    bot.feed.start()
+    await bot.webhook_client.start()
+    await cog.cog_load()
+
+    started = time.perf_counter()
+    await server.replay()
+    await asyncio.sleep(0.1)
+    await cog.scheduler.queue.join()
+    # まとめて編集する更新が終わるまで待つ
+    await cog.dispatcher.drain()
+    elapsed = time.perf_counter() - started
+
+    await cog.cog_unload()
+    await bot.feed.stop()
+    await bot.webhook_client.close()
+    await server.stop()
+    tmpdir.cleanup()
+
+    latencies: dict[int, list[float]] = {}
+    delivered = 0
+    for data_id, sent_at in server.sent_at.items():
+        times = sink.sent.get(data_id)
+        if not times:
+            continue
+        delivered += 1
+        code = server.sent_codes[data_id]
+        # 全ての通知先に届くまでの時間
+        latencies.setdefault(code, []).append(max(times) - sent_at)
+
+    # 同じ地震の続報は1回の編集にまとめられるため送信数より少なくなる
+    print(f"frames sent: {len(server.sent_at)}, delivered: {delivered}")
+    print(f"elapsed: {elapsed:.2f}s, throughput: {delivered / elapsed:.1f} events/s")
+    for code, values in sorted(latencies.items()):
+        print(
+            f"code {code}: n={len(values)} "
+            f"p50={statistics.median(values) * 1000:.1f}ms "
+            f"p95={percentile(values, 0.95) * 1000:.1f}ms "
+            f"p99={percentile(values, 0.99) * 1000:.1f}ms "
+            f"max={max(values) * 1000:.1f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="配信レイテンシのベンチマーク")
+    parser.add_argument("--events", default="tools/fixtures/noto.jsonl")
+    parser.add_argument("--rate", type=float, default=50, help="1秒あたりの送信数")
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument(
+        "--send-delay", type=float, default=0.05, help="1回の送信にかかる秒数"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        action="store_true",
+        help="チャンネルごとの送信制限(5秒に5回)を有効にする",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
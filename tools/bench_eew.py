@@ -0,0 +1,54 @@
+"""
+緊急地震速報の予想震度・S波の到達までの秒数を求める時間を計測する
+
+    python -m tools.bench_eew --points 30000
+
+Discordには接続しない
+"""
+
+import argparse
+import random
+import timeit
+
+from tools.replay_server import load_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="緊急地震速報の予想のベンチマーク")
+    parser.add_argument("--events", default="tools/fixtures/noto.jsonl")
+    parser.add_argument("--points", type=int, default=30000, help="登録地点の数")
+    parser.add_argument("--number", type=int, default=1000, help="繰り返す回数")
+    args = parser.parse_args()
+
+    from utils.eew_estimate import EEWEstimator
+    from utils.events import EEWEvent
+    from utils.subscription import Subscription
+
+    # 日本付近に地点をばらまく
+    rng = random.Random(0)
+    subscriptions = [
+        Subscription(
+            guild_id=None,
+            channel_id=i,
+            latitude=rng.uniform(31, 45),
+            longitude=rng.uniform(129, 145),
+        )
+        for i in range(args.points)
+    ]
+    estimator = EEWEstimator()
+    seconds = timeit.timeit(lambda: estimator.update(subscriptions), number=1)
+    print(f"{'update':<32} {seconds * 1000:10.2f}ms ({args.points} points)")
+
+    for data in load_events(args.events):
+        if data["code"] != 556 or data["cancelled"]:
+            continue
+        hypocenter = EEWEvent.from_dict(data).hypocenter
+        seconds = timeit.timeit(
+            lambda: estimator.estimate(hypocenter), number=args.number
+        )
+        name = f"estimate M{hypocenter.magnitude} {hypocenter.depth}km"
+        print(f"{name:<32} {seconds / args.number * 1000:10.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Embedの組み立てにかかる時間を計測する
+
+    python -m tools.bench_format --number 2000
+
+Discordには接続しない
+"""
+
+import argparse
+import timeit
+from datetime import datetime
+
+from tools.replay_server import load_events
+
+
+def report(name: str, seconds: float, number: int) -> None:
+    print(f"{name:<32} {seconds / number * 1_000_000:10.2f}µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed組み立てのベンチマーク")
+    parser.add_argument("--events", default="tools/fixtures/noto.jsonl")
+    parser.add_argument("--number", type=int, default=2000, help="繰り返す回数")
+    args = parser.parse_args()
+
+    from cogs.p2pquake import (
+        build_eew_embeds,
+        build_quake_embeds,
+        build_tunami_embeds,
+    )
+    from utils.events import (
+        EEWEvent,
+        EventError,
+        QuakeEvent,
+        TunamiEvent,
+        decode_event,
+    )
+    from utils.formatting import (
+        format_earthquake_points,
+        format_earthquake_scale,
+        format_earthquake_tsunami,
+        format_issue_type,
+        parse_time,
+    )
+
+    events = load_events(args.events)
+    number = args.number
+
+    print("[timestamp]")
+    value = events[0]["time"]
+    report(
+        "strptime",
+        timeit.timeit(
+            lambda: datetime.strptime(value, "%Y/%m/%d %H:%M:%S.%f"), number=number
+        ),
+        number,
+    )
+    report(
+        "parse_time", timeit.timeit(lambda: parse_time(value), number=number), number
+    )
+
+    print("[lookup]")
+    report(
+        "format_issue_type",
+        timeit.timeit(lambda: format_issue_type("DetailScale"), number=number),
+        number,
+    )
+    report(
+        "format_earthquake_scale",
+        timeit.timeit(lambda: format_earthquake_scale(55), number=number),
+        number,
+    )
+    report(
+        "format_earthquake_tsunami",
+        timeit.timeit(lambda: format_earthquake_tsunami("Checking"), number=number),
+        number,
+    )
+
+    # 1イベントあたりの組み立て時間
+    print("[render per event]")
+    for data in events:
+        try:
+            event = decode_event(data)
+        except EventError:
+            continue
+
+        match event:
+            case QuakeEvent():
+
+                def render(event=event):
+                    embeds = build_quake_embeds(event)
+                    if event.max_scale >= 30 and event.points:
+                        embeds.extend(format_earthquake_points(event.points))
+                    return embeds
+
+                name = f"551 ({len(event.points)} points)"
+            case TunamiEvent():
+                render, name = (lambda event=event: build_tunami_embeds(event)), "552"
+            case EEWEvent():
+                render, name = (lambda event=event: build_eew_embeds(event)), "556"
+
+        report(name, timeit.timeit(render, number=max(1, number // 10)), number // 10)
+
+
+if __name__ == "__main__":
+    main()
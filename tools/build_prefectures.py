@@ -0,0 +1,66 @@
+"""
+地図の下絵に使う都道府県の境界（utils/prefectures.json）を作る
+
+    pip download japanmap --no-deps && unzip japanmap-*.whl 'japanmap/japan.json'
+    python -m tools.build_prefectures japanmap/japan.json
+
+境界はjapanmap（Apache License 2.0）の都道府県ごとの領域（県庁所在地を含む陸地）を使う
+"""
+
+import argparse
+import json
+
+# japanmapの都道府県コード順
+PREFECTURE_NAMES = (
+    "北海道 青森県 岩手県 宮城県 秋田県 山形県 福島県 茨城県 栃木県 群馬県 "
+    "埼玉県 千葉県 東京都 神奈川県 新潟県 富山県 石川県 福井県 山梨県 長野県 "
+    "岐阜県 静岡県 愛知県 三重県 滋賀県 京都府 大阪府 兵庫県 奈良県 和歌山県 "
+    "鳥取県 島根県 岡山県 広島県 山口県 徳島県 香川県 愛媛県 高知県 福岡県 "
+    "佐賀県 長崎県 熊本県 大分県 宮崎県 鹿児島県 沖縄県"
+).split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="都道府県の境界を作る")
+    parser.add_argument("source", help="japanmapのjapan.json")
+    parser.add_argument("--output", default="utils/prefectures.json")
+    parser.add_argument(
+        "--digits", type=int, default=3, help="緯度・経度の小数点以下の桁数"
+    )
+    args = parser.parse_args()
+
+    with open(args.source, encoding="utf-8") as f:
+        # 境界点の一覧と、都道府県ごとの(隣接する都道府県, 境界点の番号)
+        points, outlines = json.load(f)
+
+    prefectures = {}
+    for name, outline in zip(PREFECTURE_NAMES, outlines, strict=True):
+        polygon = []
+        for _, indexes in outline:
+            for i in indexes:
+                lon, lat = points[i][0]
+                point = [round(lon, args.digits), round(lat, args.digits)]
+                # 丸めて重なった点は省く
+                if not polygon or polygon[-1] != point:
+                    polygon.append(point)
+        prefectures[name] = polygon
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "source": "japanmap (https://github.com/SaitoTsutomu/japanmap), "
+                "Apache License 2.0",
+                "prefectures": prefectures,
+            },
+            f,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+    print(
+        f"{args.output}: {len(prefectures)} prefectures, "
+        f"{sum(map(len, prefectures.values()))} points"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+記録したイベントをP2P地震情報 WebSocket API v2 と同じ形式で配信するリプレイサーバー
+
+    python -m tools.replay_server --events tools/fixtures/noto.jsonl --rate 50
+
+Botは`P2PQUAKE_WS_URL=ws://127.0.0.1:8765/v2/ws`を設定して接続する
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+
+from aiohttp import web
+
+
+def load_events(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayServer:
+    """
+    接続してきたクライアント全てに記録したイベントを一定のレートで送信する
+    """
+
+    def __init__(
+        self,
+        events: list[dict],
+        rate: float = 1.0,
+        count: int | None = None,
+        rewrite_ids: bool = True,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+    ):
+        self.events = events
+        self.rate = rate
+        self.count = count if count is not None else len(events)
+        self.rewrite_ids = rewrite_ids
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger("replay")
+        self.clients: set[web.WebSocketResponse] = set()
+        self.connected = asyncio.Event()
+        # _id → 送信した時刻(time.perf_counter)とcode
+        self.sent_at: dict[str, float] = {}
+        self.sent_codes: dict[str, int] = {}
+        self.runner = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/v2/ws"
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.clients.add(ws)
+        self.connected.set()
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self.clients.discard(ws)
+        return ws
+
+    async def handle_history(self, request: web.Request) -> web.Response:
+        codes = set(map(int, request.query.getall("codes", [])))
+        events = [e for e in self.events if not codes or e["code"] in codes]
+        return web.json_response(events[: int(request.query.get("limit", 10))])
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/v2/ws", self.handle_ws)
+        app.router.add_get("/v2/history", self.handle_history)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.logger.info(f"Replay server listening on {self.url}")
+
+    async def stop(self) -> None:
+        for ws in list(self.clients):
+            await ws.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def prepare(self, event: dict) -> dict:
+        event = dict(event)
+        if self.rewrite_ids:
+            # 同じイベントを繰り返し送っても重複除外されないようにする
+            event["_id"] = uuid.uuid4().hex
+        event["time"] = datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")[:-3]
+        return event
+
+    async def replay(self) -> None:
+        """
+        全イベントを送り終えるまで配信する
+        :return:
+        """
+
+        await self.connected.wait()
+        interval = 1 / self.rate if self.rate > 0 else 0
+        started = time.perf_counter()
+        for i, event in enumerate(
+            itertools.islice(itertools.cycle(self.events), self.count)
+        ):
+            # 送信時刻がずれても平均レートを保つ
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            event = self.prepare(event)
+            payload = json.dumps(event, ensure_ascii=False)
+            self.sent_codes[event["_id"]] = event["code"]
+            self.sent_at[event["_id"]] = time.perf_counter()
+            await asyncio.gather(
+                *(ws.send_str(payload) for ws in self.clients), return_exceptions=True
+            )
+
+
+async def run(args: argparse.Namespace) -> None:
+    server = ReplayServer(
+        load_events(args.events),
+        rate=args.rate,
+        count=args.count,
+        rewrite_ids=not args.keep_ids,
+        host=args.host,
+        port=args.port,
+    )
+    await server.start()
+    try:
+        await server.replay()
+        while args.loop:
+            await server.replay()
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="P2P地震情報のリプレイサーバー")
+    parser.add_argument("--events", default="tools/fixtures/noto.jsonl")
+    parser.add_argument("--rate", type=float, default=1.0, help="1秒あたりの送信数")
+    parser.add_argument("--count", type=int, default=None, help="送信する件数")
+    parser.add_argument("--loop", action="store_true", help="繰り返し送信する")
+    parser.add_argument(
+        "--keep-ids", action="store_true", help="記録された_idをそのまま送信する"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import random
+
+
+class Backoff:
+    """
+    指数バックオフ（Full Jitter）
+    """
+
+    def __init__(self, base: float = 1.0, cap: float = 300.0):
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """
+        次に待機する秒数を返す
+        同時に切断された複数のクライアントが一斉に再接続しないように0〜上限の範囲でばらつかせる
+        :return:
+        """
+
+        delay = min(self.cap, self.base * 2**self.attempts)
+        self.attempts += 1
+        return random.uniform(0, delay)
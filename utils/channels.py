@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from collections.abc import Iterable
+
+import discord
+from discord.ext import commands
+
+from utils.subscription import Subscription
+from utils.webhook import WebhookClient, WebhookTarget
+
+
+class ChannelResolver:
+    """
+    通知先のチャンネル・Webhookを解決する
+    起動時に一度だけ解決しておき、キャッシュに無い場合もGatewayのキャッシュを使わずに送信できるようにする
+    """
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        webhook_client: WebhookClient | None = None,
+        concurrency: int = 10,
+    ):
+        self.bot = bot
+        # 送信前に start() しておく
+        self.webhook_client = webhook_client or WebhookClient()
+        self.logger = logging.getLogger("channels")
+        self.concurrency = concurrency
+        # channel_id → 解決済みのチャンネル
+        self.channels: dict[int, discord.abc.Messageable] = {}
+        # Webhook URL → 送信に使うWebhook
+        self.webhooks: dict[str, WebhookTarget] = {}
+
+    def get_webhook(self, url: str) -> WebhookTarget:
+        target = self.webhooks.get(url)
+        if target is None:
+            # Webhook専用の接続プールを使って送信する
+            target = self.webhooks[url] = self.webhook_client.target(url)
+        return target
+
+    def resolve(self, subscription: Subscription):
+        """
+        送信先を返す
+        キャッシュに無いチャンネル（再接続直後など）はREST APIで直接送信する
+        :param subscription:
+        :return:
+        """
+
+        if subscription.webhook_url:
+            return self.get_webhook(subscription.webhook_url)
+
+        channel = self.channels.get(subscription.channel_id)
+        if channel is None:
+            channel = self.bot.get_channel(subscription.channel_id)
+            if channel is None:
+                return self.bot.get_partial_messageable(subscription.channel_id)
+            self.channels[subscription.channel_id] = channel
+        return channel
+
+    def discard(self, subscription: Subscription) -> None:
+        """
+        送信できなかった通知先を忘れる（次回は解決し直す）
+        :param subscription:
+        :return:
+        """
+
+        self.channels.pop(subscription.channel_id, None)
+        if subscription.webhook_url:
+            self.webhooks.pop(subscription.webhook_url, None)
+
+    async def fetch(self, semaphore: asyncio.Semaphore, channel_id: int) -> None:
+        async with semaphore:
+            try:
+                self.channels[channel_id] = await self.bot.fetch_channel(channel_id)
+            except discord.NotFound:
+                self.logger.warning(f"Channel {channel_id} not found")
+            except discord.Forbidden:
+                self.logger.warning(f"Channel {channel_id} is not accessible")
+            except discord.HTTPException:
+                self.logger.warning(f"Failed to fetch channel {channel_id}")
+
+    async def warm_up(self, subscriptions: Iterable[Subscription]) -> None:
+        """
+        通知先を事前に解決する
+        :param subscriptions:
+        :return:
+        """
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        for subscription in subscriptions:
+            if subscription.webhook_url:
+                self.get_webhook(subscription.webhook_url)
+                continue
+            if subscription.channel_id in self.channels:
+                continue
+
+            channel = self.bot.get_channel(subscription.channel_id)
+            if channel is not None:
+                self.channels[subscription.channel_id] = channel
+            else:
+                tasks.append(self.fetch(semaphore, subscription.channel_id))
+
+        await asyncio.gather(*tasks)
+        self.logger.info(
+            f"Resolved {len(self.channels)} channels and {len(self.webhooks)} webhooks"
+        )
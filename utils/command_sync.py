@@ -0,0 +1,82 @@
+import hashlib
+import json
+import logging
+import os
+
+import discord
+from discord import app_commands
+
+
+def tree_digest(
+    tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None = None
+) -> str:
+    """
+    同期する内容（コマンドの定義）のハッシュ
+    :param tree:
+    :param guild: Noneの場合はグローバルコマンド
+    :return:
+    """
+
+    payload = [command.to_dict(tree) for command in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+class CommandSyncCache:
+    """
+    最後に同期したコマンドのハッシュを保存し、変更が無ければ同期を省く
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.logger = logging.getLogger("command_sync")
+        # "global" またはサーバーID → ハッシュ
+        self.digests: dict[str, str] = {}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.digests = json.load(f)
+        except FileNotFoundError:
+            self.digests = {}
+        except (OSError, ValueError):
+            # 壊れている場合は同期し直せば良い
+            self.logger.warning(f"Failed to read {self.path}, commands will be synced")
+            self.digests = {}
+
+    def save(self) -> None:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.digests, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    async def sync(
+        self,
+        tree: app_commands.CommandTree,
+        guild: discord.abc.Snowflake | None = None,
+        force: bool = False,
+    ) -> bool:
+        """
+        前回から変更があった場合のみ同期する
+        :param tree:
+        :param guild: Noneの場合はグローバルに同期する
+        :param force: 変更が無くても同期する
+        :return: 同期したか
+        """
+
+        scope = "global" if guild is None else str(guild.id)
+        digest = tree_digest(tree, guild)
+        if not force and self.digests.get(scope) == digest:
+            self.logger.info(f"Commands are up to date ({scope}), skipped sync")
+            return False
+
+        await tree.sync(guild=guild)
+        self.digests[scope] = digest
+        self.save()
+        self.logger.info(f"Synced commands ({scope})")
+        return True
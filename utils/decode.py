@@ -0,0 +1,93 @@
+import json
+import re
+import time
+from collections.abc import Sequence
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:  # pragma: no cover
+    json_loads = json.loads
+
+CODE_PATTERN = re.compile(r'"code"\s*:\s*(\d+)')
+ID_PATTERN = re.compile(r'"_id"\s*:\s*"([^"]*)"')
+POINTS_PATTERN = re.compile(r'"points"\s*:\s*\[')
+
+
+class LazyPoints(Sequence):
+    """
+    `points`を必要になるまでパースしない
+    """
+
+    __slots__ = ("raw", "items")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.items = None
+
+    def load(self) -> list:
+        if self.items is None:
+            self.items = json_loads(self.raw)
+            self.raw = None
+        return self.items
+
+    def __bool__(self) -> bool:
+        if self.items is not None:
+            return len(self.items) > 0
+        return self.raw.strip() != "[]"
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+    def __getitem__(self, index):
+        return self.load()[index]
+
+    def __iter__(self):
+        return iter(self.load())
+
+
+class Frame:
+    """
+    WebSocketで受信した1メッセージ
+    `code`と`_id`だけを先に読み取り、本体のパースは必要になってから行う
+    """
+
+    __slots__ = ("raw", "code", "data_id", "parse_time")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.parse_time = 0.0
+
+        code = CODE_PATTERN.search(raw)
+        self.code = int(code.group(1)) if code else None
+        data_id = ID_PATTERN.search(raw)
+        self.data_id = data_id.group(1) if data_id else None
+
+    def parse(self) -> dict:
+        """
+        本体をパースする
+        `points`は切り出して遅延パースし、切り出せなかった場合は全体をパースする
+        :return:
+        """
+
+        start = time.perf_counter()
+        data = None
+        match = POINTS_PATTERN.search(self.raw)
+        if match is not None:
+            # 観測点は入れ子を持たないので最初の`]`が配列の終わりになる
+            end = self.raw.find("]", match.end())
+            if end != -1:
+                try:
+                    data = json_loads(
+                        self.raw[: match.end() - 1] + "[]" + self.raw[end + 1 :]
+                    )
+                    data["points"] = LazyPoints(self.raw[match.end() - 1 : end + 1])
+                except ValueError:
+                    data = None
+
+        if data is None:
+            data = json_loads(self.raw)
+
+        self.parse_time = time.perf_counter() - start
+        return data
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import traceback
+from collections import OrderedDict
+
+from utils.events import (
+    EEWEvent,
+    Event,
+    EventError,
+    QuakeEvent,
+    TunamiEvent,
+    decode_event,
+)
+
+
+class DedupIndex:
+    """
+    受信済みの`_id`を一定時間・一定件数だけ保持するLRU
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, data_id: str) -> bool:
+        expires_at = self.entries.get(data_id)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def expire(self, now: float) -> None:
+        # 古いものから順に並んでいるので期限切れの先頭だけを捨てる
+        while self.entries:
+            data_id, expires_at = next(iter(self.entries.items()))
+            if expires_at > now:
+                break
+            del self.entries[data_id]
+
+    def check_and_add(self, data_id: str | None) -> bool:
+        """
+        既に受信済みならTrueを返し、未受信なら記録してFalseを返す
+        :param data_id:
+        :return:
+        """
+
+        if data_id is None:
+            return False
+
+        now = time.monotonic()
+        self.expire(now)
+
+        if data_id in self.entries:
+            # 再送が続く間は保持期間を延ばす
+            self.entries[data_id] = now + self.ttl
+            self.entries.move_to_end(data_id)
+            return True
+
+        self.entries[data_id] = now + self.ttl
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return False
+
+
+class LatestEventStore:
+    """
+    コードごとの最新の情報
+    `path`を指定するとファイルに書き出し、再起動直後でも最新の情報を返せるようにする
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.logger = logging.getLogger("dedup")
+        self.events: dict[int, Event] = {}
+        self.dirty = False
+        self.save_task = None
+
+    def load(self) -> None:
+        """
+        書き出した最新の情報を読み込む
+        :return:
+        """
+
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                events = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            self.logger.warning(f"Failed to read snapshot {self.path}")
+            return
+
+        restored = 0
+        for data in events:
+            try:
+                event = decode_event(data)
+            except EventError:
+                self.logger.warning(f"Skipped an invalid event in {self.path}")
+                continue
+            # 読み込み中に受信した情報の方が新しい
+            self.events.setdefault(event.code, event)
+            restored += 1
+        self.logger.info(f"Restored {restored} events from {self.path}")
+
+    def _write(self, events: list[Event]) -> None:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # 複数のプロセスが同じファイルに書き出しても壊れないようにする
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([event.to_dict() for event in events], f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def save(self) -> None:
+        # 書き出している間に更新された分はまとめてもう一度書き出す
+        try:
+            while self.dirty:
+                self.dirty = False
+                await asyncio.to_thread(self._write, list(self.events.values()))
+        except Exception:
+            self.logger.error(f"Failed to write snapshot {self.path}:")
+            self.logger.error(traceback.format_exc())
+        finally:
+            self.save_task = None
+
+    async def close(self) -> None:
+        if self.save_task is not None:
+            await self.save_task
+
+    def update(self, event: Event) -> None:
+        self.events[event.code] = event
+        if self.path is None:
+            return
+
+        self.dirty = True
+        if self.save_task is None:
+            self.save_task = asyncio.create_task(self.save())
+
+    def get(self, code: int) -> Event | None:
+        return self.events.get(code)
+
+    @property
+    def quake(self) -> QuakeEvent | None:
+        return self.events.get(551)
+
+    @property
+    def tunami(self) -> TunamiEvent | None:
+        return self.events.get(552)
+
+    @property
+    def eew(self) -> EEWEvent | None:
+        return self.events.get(556)
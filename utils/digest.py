@@ -0,0 +1,223 @@
+import asyncio
+import dataclasses
+import logging
+import time
+import traceback
+from collections.abc import Iterable
+
+import discord
+
+from utils import metrics
+from utils.dispatcher import Dispatcher
+from utils.subscription import Subscription
+
+# 1つのまとめに載せる件数の上限（Embedの説明文は4096文字まで）
+MAX_DIGEST_LINES = 50
+
+
+class TokenBucket:
+    """
+    通知先ごとのメンション付き通知の残り回数
+    `per`秒あたり`rate`回ずつ回復し、最大`burst`回まで貯まる
+    """
+
+    __slots__ = ("rate", "per", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, per: float, burst: int):
+        self.rate = rate
+        self.per = per
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated_at) * self.rate / self.per
+        )
+        self.updated_at = now
+        return self.tokens
+
+    def take(self) -> bool:
+        if self.refill() >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class DigestEntry:
+    """
+    まとめて通知する予定の地震情報
+    """
+
+    __slots__ = ("subscription", "lines")
+
+    def __init__(self, subscription: Subscription):
+        # まとめはメンションせずに送る
+        self.subscription = dataclasses.replace(subscription, role_id=None)
+        # 地震のキー → 1行の要約（続報が来たら上書きする）
+        self.lines: dict[str, str] = {}
+
+
+class StormControl:
+    """
+    余震が続いてメンションが多すぎる通知先について、小さな地震をまとめて定期的に通知する
+    一定以上の震度の地震はトークンが無くてもすぐに通知する
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        rate: float = 6,
+        per: float = 3600,
+        burst: int = 3,
+        urgent_scale: int = 45,
+        interval: float = 600,
+    ):
+        self.dispatcher = dispatcher
+        self.rate = rate
+        self.per = per
+        self.burst = burst
+        self.urgent_scale = urgent_scale
+        self.interval = interval
+        self.logger = logging.getLogger("digest")
+        self.buckets: dict[int, TokenBucket] = {}
+        self.pending: dict[int, DigestEntry] = {}
+        self.task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self) -> None:
+        if self.enabled:
+            # 残り回数は時間で回復するので、メトリクスの取得時に計算する
+            metrics.DIGEST_TOKENS.set_function(self.collect_tokens)
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+            metrics.DIGEST_TOKENS.set_function(None)
+        # 溜まっている分は捨てずに送る
+        await self.flush()
+
+    def collect_tokens(self) -> dict[tuple, float]:
+        return {
+            (channel_id,): bucket.refill()
+            for channel_id, bucket in self.buckets.items()
+        }
+
+    def get_bucket(self, channel_id: int) -> TokenBucket:
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.buckets[channel_id] = TokenBucket(
+                self.rate, self.per, self.burst
+            )
+        return bucket
+
+    def filter(
+        self,
+        subscriptions: Iterable[Subscription],
+        max_scale: int,
+        key: str,
+        line: str,
+    ) -> list[Subscription]:
+        """
+        すぐに通知する通知先を返し、残りはまとめに回す
+        :param subscriptions:
+        :param max_scale: 最大震度
+        :param key: 同じ地震を表すキー（続報はまとめの行を上書きする）
+        :param line: まとめに載せる1行の要約
+        :return:
+        """
+
+        if not self.enabled:
+            return list(subscriptions)
+
+        immediate = []
+        for subscription in subscriptions:
+            channel_id = subscription.channel_id
+            bucket = self.get_bucket(channel_id)
+
+            pending = self.pending.get(channel_id)
+            digested = pending is not None and key in pending.lines
+            if digested and max_scale < self.urgent_scale:
+                # 既にまとめに回した地震の続報はまとめの方を更新する
+                pending.lines[key] = line
+            elif self.dispatcher.has_sent(key, subscription):
+                # 送信済みのメッセージの編集はメンションされないのでそのまま通知する
+                immediate.append(subscription)
+            elif max_scale >= self.urgent_scale:
+                if digested:
+                    # 続報で大きな地震と分かった場合はまとめから外してすぐに通知する
+                    del pending.lines[key]
+                    if not pending.lines:
+                        del self.pending[channel_id]
+                # 大きな地震はトークンを待たない（使った分は差し引く）
+                bucket.tokens = max(0.0, bucket.refill() - 1)
+                immediate.append(subscription)
+            elif bucket.take():
+                immediate.append(subscription)
+            else:
+                if pending is None:
+                    pending = self.pending[channel_id] = DigestEntry(subscription)
+                pending.lines[key] = line
+                metrics.DIGESTED_EVENTS.inc(channel=channel_id)
+
+        return immediate
+
+    def rename(self, old: str, new: str) -> None:
+        """
+        まとめに回した地震のキーを変える（続報で同じ地震だと分かった場合）
+        :param old:
+        :param new:
+        :return:
+        """
+
+        for entry in self.pending.values():
+            if old in entry.lines and new not in entry.lines:
+                entry.lines[new] = entry.lines.pop(old)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                self.logger.error(traceback.format_exc())
+
+    async def flush(self) -> None:
+        """
+        溜まっている地震情報をまとめて送信する
+        :return:
+        """
+
+        pending, self.pending = self.pending, {}
+        await asyncio.gather(
+            *(
+                self.dispatcher.fan_out(
+                    [entry.subscription], embeds=[self.build_embed(entry)]
+                )
+                for entry in pending.values()
+            )
+        )
+
+    @staticmethod
+    def build_embed(entry: DigestEntry) -> discord.Embed:
+        lines = list(entry.lines.values())
+        description = "\n".join(lines[:MAX_DIGEST_LINES])
+        if len(lines) > MAX_DIGEST_LINES:
+            description += f"\nほか{len(lines) - MAX_DIGEST_LINES}件"
+
+        embed = discord.Embed(
+            title="地震情報のまとめ",
+            description=description,
+            color=0x95A5A6,
+        )
+        embed.set_footer(
+            text="地震が続いているため、小さな地震はまとめて通知しています"
+        )
+        return embed
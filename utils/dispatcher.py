@@ -0,0 +1,413 @@
+import asyncio
+import io
+import logging
+import traceback
+from collections import OrderedDict
+from collections.abc import Iterable
+
+import discord
+from discord.ext import commands
+
+from utils import metrics
+from utils.channels import ChannelResolver
+from utils.fields import chunk_embeds
+from utils.ratelimit import RouteBucket, urgent_delivery
+from utils.subscription import Subscription
+from utils.webhook import WebhookClient
+
+
+class PendingUpdate:
+    """
+    まとめて反映する予定の更新
+    """
+
+    def __init__(self):
+        self.subscriptions: dict[int, Subscription] = {}
+        self.embeds: list[discord.Embed] = []
+        self.image: bytes | None = None
+        self.variants: dict[int, list[discord.Embed]] = {}
+        self.urgent = False
+
+    def merge(
+        self,
+        subscriptions: Iterable[Subscription],
+        embeds: list[discord.Embed],
+        image: bytes | None = None,
+        variants: dict[int, list[discord.Embed]] | None = None,
+        urgent: bool = False,
+    ) -> None:
+        # 通知先は合わせ、内容は最新の報で上書きする
+        for subscription in subscriptions:
+            self.subscriptions[subscription.channel_id] = subscription
+        self.embeds = embeds
+        self.image = image
+        self.variants = variants or {}
+        self.urgent = self.urgent or urgent
+
+
+class SentMessages:
+    """
+    地震ごとに送信したメッセージ（key → channel_id → メッセージ）
+    Botが持ち、Cogをリロードしても同じ地震の続報は送信済みのメッセージを編集する
+    """
+
+    def __init__(self, max_tracked: int = 256):
+        self.max_tracked = max_tracked
+        self.messages: OrderedDict[str, dict[int, list[discord.Message]]] = (
+            OrderedDict()
+        )
+        self.locks: dict[str, asyncio.Lock] = {}
+
+    def rename(self, old: str, new: str) -> bool:
+        if old not in self.messages or new in self.messages:
+            return False
+        self.messages[new] = self.messages.pop(old)
+        self.locks[new] = self.locks.pop(old)
+        return True
+
+    def track(self, key: str) -> None:
+        self.messages[key] = {}
+        self.locks[key] = asyncio.Lock()
+        while len(self.messages) > self.max_tracked:
+            old_key, _ = self.messages.popitem(last=False)
+            self.locks.pop(old_key, None)
+
+
+class Dispatcher:
+    """
+    1つのメッセージを複数の通知先へ並行して配信する
+    """
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        max_concurrency: int = 50,
+        route_limit: int = 5,
+        route_period: float = 5.0,
+        coalesce_window: float = 1.0,
+        webhook_client: WebhookClient | None = None,
+        sent: SentMessages | None = None,
+    ):
+        self.bot = bot
+        self.logger = logging.getLogger("dispatcher")
+        self.channels = ChannelResolver(bot, webhook_client)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.route_limit = route_limit
+        self.route_period = route_period
+        self.buckets: dict[int, RouteBucket] = {}
+        self.coalesce_window = coalesce_window
+        self.sent = sent if sent is not None else SentMessages()
+        self.messages = self.sent.messages
+        self.locks = self.sent.locks
+        self.pending: dict[str, PendingUpdate] = {}
+        self.tasks: set[asyncio.Task] = set()
+        # 続報で新しく対象になった通知先への最初の送信（(key, channel_id) → 送信中のタスク）
+        self.first_sends: dict[tuple[str, int], asyncio.Task] = {}
+
+    def get_bucket(self, channel_id: int) -> RouteBucket:
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.buckets[channel_id] = RouteBucket(
+                self.route_limit, self.route_period
+            )
+        return bucket
+
+    def is_local(self, subscription: Subscription) -> bool:
+        """
+        このプロセスが担当するシャードのサーバーか
+        :param subscription:
+        :return:
+        """
+
+        shard_ids = getattr(self.bot, "shard_ids", None)
+        if not shard_ids or subscription.guild_id is None:
+            return True
+        return (subscription.guild_id >> 22) % self.bot.shard_count in shard_ids
+
+    def has_sent(self, key: str, subscription: Subscription) -> bool:
+        """
+        同じ地震のメッセージを既にこの通知先へ送信したか
+        :param key:
+        :param subscription:
+        :return:
+        """
+
+        tracked = self.messages.get(key)
+        return tracked is not None and subscription.channel_id in tracked
+
+    async def fan_out(
+        self,
+        subscriptions: Iterable[Subscription],
+        *,
+        embeds: list[discord.Embed],
+        key: str | None = None,
+        image: bytes | None = None,
+        variants: dict[int, list[discord.Embed]] | None = None,
+        urgent: bool = False,
+    ) -> None:
+        """
+        全ての通知先へ同時に送信する
+        `key`を指定すると同じ地震の続報は送信済みのメッセージを編集し、短時間に続いた更新は1回にまとめる
+        続報で初めて対象になった通知先には第1報と同じくすぐに送信する
+        :param subscriptions:
+        :param embeds: 送信前に一度だけ組み立てたEmbed
+        :param key: 同じ地震を表すキー
+        :param image: 最初のメッセージに添付する画像（PNG、Embedからは`attachment://map.png`で参照する）
+        :param variants: 通知先(channel_id)ごとに内容を変える場合のEmbed
+        :param urgent: レートリミットの待ちで先に待っている急ぎでない送信を追い越す
+        :return:
+        """
+
+        # 他のプロセスが担当するサーバーには送信しない
+        subscriptions = [
+            subscription
+            for subscription in subscriptions
+            if self.is_local(subscription)
+        ]
+        if not subscriptions:
+            return
+
+        variants = variants or {}
+        if key is None:
+            results = await asyncio.gather(
+                *(
+                    self.deliver(
+                        subscription,
+                        variants.get(subscription.channel_id, embeds),
+                        image=image,
+                        urgent=urgent,
+                    )
+                    for subscription in subscriptions
+                ),
+                return_exceptions=True,
+            )
+            self.log_errors(results)
+            return
+
+        if key not in self.messages:
+            # 第1報はすぐに送信する
+            self.track(key)
+            tracked = self.messages[key]
+            for subscription in subscriptions:
+                # 送信中に届いた続報はまとめて編集に回す
+                tracked[subscription.channel_id] = []
+            async with self.locks[key]:
+                results = await asyncio.gather(
+                    *(
+                        self.deliver(
+                            subscription,
+                            variants.get(subscription.channel_id, embeds),
+                            key,
+                            image,
+                            urgent,
+                        )
+                        for subscription in subscriptions
+                    ),
+                    return_exceptions=True,
+                )
+                self.log_errors(results)
+            return
+
+        tracked = self.messages[key]
+        new = [
+            subscription
+            for subscription in subscriptions
+            if subscription.channel_id not in tracked
+        ]
+        if new:
+            # 続報で対象が広がった通知先にはまとめるのを待たずにメンション付きで送る
+            await self.send_first(new, embeds, key, image, variants, urgent)
+            subscriptions = [
+                subscription
+                for subscription in subscriptions
+                if subscription not in new
+            ]
+            if not subscriptions:
+                return
+
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = PendingUpdate()
+            task = asyncio.create_task(self.flush(key))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        pending.merge(subscriptions, embeds, image, variants, urgent)
+
+    async def send_first(
+        self,
+        subscriptions: list[Subscription],
+        embeds: list[discord.Embed],
+        key: str,
+        image: bytes | None,
+        variants: dict[int, list[discord.Embed]],
+        urgent: bool,
+    ) -> None:
+        """
+        送信済みの地震で、まだ送信していない通知先に最初のメッセージを送る
+        :param subscriptions:
+        :param embeds:
+        :param key:
+        :param image:
+        :param variants:
+        :param urgent:
+        :return:
+        """
+
+        tracked = self.messages[key]
+        tasks = []
+        for subscription in subscriptions:
+            tracked[subscription.channel_id] = []
+            first_key = (key, subscription.channel_id)
+            task = asyncio.create_task(
+                self.deliver(
+                    subscription,
+                    variants.get(subscription.channel_id, embeds),
+                    key,
+                    image,
+                    urgent,
+                )
+            )
+            self.first_sends[first_key] = task
+            task.add_done_callback(
+                lambda _, first_key=first_key: self.first_sends.pop(first_key, None)
+            )
+            tasks.append(task)
+        self.log_errors(await asyncio.gather(*tasks, return_exceptions=True))
+
+    def log_errors(self, results: list) -> None:
+        # 送信処理の外で起きた例外も他の通知先への送信を止めずに記録する
+        for result in results:
+            if isinstance(result, Exception):
+                metrics.SEND_FAILURES.inc()
+                self.logger.error(
+                    "Failed to deliver:\n" + "".join(traceback.format_exception(result))
+                )
+
+    def track(self, key: str) -> None:
+        self.sent.track(key)
+
+    def rename(self, old: str, new: str) -> bool:
+        """
+        送信済みのメッセージを別のキーで引き継ぐ
+        :param old:
+        :param new:
+        :return: 引き継いだか
+        """
+
+        if old in self.pending:
+            # まとめた更新がまだ古いキーで送られる
+            return False
+        return self.sent.rename(old, new)
+
+    async def drain(self) -> None:
+        """
+        まとめて反映する予定の更新が終わるまで待つ
+        :return:
+        """
+
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def flush(self, key: str) -> None:
+        """
+        まとめた更新を反映する
+        :param key:
+        :return:
+        """
+
+        await asyncio.sleep(self.coalesce_window)
+        pending = self.pending.pop(key)
+        lock = self.locks.get(key)
+        if lock is None:
+            # 追跡期間を過ぎた → 新しいメッセージとして送る
+            self.track(key)
+            lock = self.locks[key]
+
+        async with lock:
+            results = await asyncio.gather(
+                *(
+                    self.deliver(
+                        subscription,
+                        pending.variants.get(subscription.channel_id, pending.embeds),
+                        key,
+                        pending.image,
+                        pending.urgent,
+                    )
+                    for subscription in pending.subscriptions.values()
+                ),
+                return_exceptions=True,
+            )
+            self.log_errors(results)
+
+    async def deliver(
+        self,
+        subscription: Subscription,
+        embeds: list[discord.Embed],
+        key: str | None = None,
+        image: bytes | None = None,
+        urgent: bool = False,
+    ) -> None:
+        # Webhookの送信でもレートリミットの待ちで優先する（gatherで通知先ごとのタスクになる）
+        urgent_delivery.set(urgent)
+        if key is not None:
+            first = self.first_sends.get((key, subscription.channel_id))
+            if first is not None and first is not asyncio.current_task():
+                # 最初のメッセージを送り終えてから編集する
+                await asyncio.wait((first,))
+        channel = self.channels.resolve(subscription)
+        tracked = self.messages.get(key) if key is not None else None
+        sent = tracked.get(subscription.channel_id, []) if tracked is not None else []
+        messages = []
+
+        # 上限を超える場合は複数のメッセージに分け、最初のメッセージでのみメンションする
+        for i, message_embeds in enumerate(chunk_embeds(embeds)):
+            if not subscription.webhook_url:
+                # Webhookのレートリミットは送信時にヘッダーから追跡する
+                await self.get_bucket(subscription.channel_id).acquire(urgent)
+            async with self.semaphore:
+                try:
+                    content = subscription.mention if i == 0 else None
+                    # 送信のたびに新しいファイルとして添付する
+                    file = (
+                        discord.File(io.BytesIO(image), "map.png")
+                        if i == 0 and image is not None
+                        else None
+                    )
+                    message = None
+                    if i < len(sent):
+                        try:
+                            # 編集ではメンションの通知は飛ばない（添付ファイルは置き換える）
+                            message = await sent[i].edit(
+                                content=content,
+                                embeds=message_embeds,
+                                **({"attachments": [file]} if file else {}),
+                            )
+                        except discord.NotFound:
+                            # 削除済みの場合は新しく送信する
+                            if file is not None:
+                                file.reset()
+                    if message is None:
+                        message = await channel.send(
+                            content=content,
+                            embeds=message_embeds,
+                            **({"files": [file]} if file else {}),
+                        )
+                    messages.append(message)
+                except discord.HTTPException as e:
+                    if isinstance(e, (discord.NotFound, discord.Forbidden)):
+                        # チャンネル・Webhookが削除された → 次回は解決し直す
+                        self.channels.discard(subscription)
+                    metrics.SEND_FAILURES.inc()
+                    self.logger.error(f"Failed to send to {subscription.channel_id}:")
+                    self.logger.error(traceback.format_exc())
+                    break
+        else:
+            # 続報の方がメッセージ数が少なければ余ったメッセージを消す
+            for message in sent[len(messages) :]:
+                try:
+                    await message.delete()
+                except discord.HTTPException:
+                    pass
+
+        if tracked is not None:
+            tracked[subscription.channel_id] = messages
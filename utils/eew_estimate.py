@@ -0,0 +1,250 @@
+import logging
+import math
+import time
+from bisect import bisect_right
+from collections.abc import Sequence
+
+try:
+    import numpy as np
+
+    AVAILABLE = True
+except ImportError:  # pragma: no cover
+    AVAILABLE = False
+
+from utils.events import Hypocenter
+from utils.subscription import Subscription
+
+EARTH_RADIUS = 6371.0  # km
+
+# 走時表の範囲と間隔（km）
+MAX_DEPTH = 700
+DEPTH_STEP = 5
+MAX_DISTANCE = 2000
+DISTANCE_STEP = 2
+
+# S波速度の層構造（上端の深さkm, S波速度km/s）
+# JMA2001の走時表は同梱できないので、それを大まかに近似した水平成層構造から作る
+VS_LAYERS = (
+    (0, 3.0),
+    (5, 3.4),
+    (20, 3.8),
+    (40, 4.4),
+    (200, 4.7),
+    (410, 5.3),
+)
+
+# 平均的な地盤(AVS30=400m/s程度)の最大速度の増幅率
+SITE_AMPLIFICATION = 1.29
+
+# 計測震度 → 震度（この値以上で次の震度、全て0.5の倍数）
+INTENSITY_THRESHOLDS = (0.5, 1.5, 2.5, 3.5, 4.5, 5.0, 5.5, 6.0, 6.5)
+INTENSITY_SCALES = (0, 10, 20, 30, 40, 45, 50, 55, 60, 70)
+
+if AVAILABLE:
+    DISTANCES = np.arange(0, MAX_DISTANCE + DISTANCE_STEP, DISTANCE_STEP)
+    # 計測震度を0.5刻みにした添字 → 震度（searchsortedより速い）
+    SCALE_LOOKUP = np.array(
+        [
+            INTENSITY_SCALES[bisect_right(INTENSITY_THRESHOLDS, i / 2)]
+            for i in range(int(INTENSITY_THRESHOLDS[-1] * 2) + 1)
+        ],
+        dtype=np.int16,
+    )
+
+# 一度だけ作る
+_travel_times = None
+
+
+def unit_vectors(latitudes, longitudes) -> "np.ndarray":
+    """
+    緯度・経度（度）を地球中心からの単位ベクトルにする
+    :param latitudes:
+    :param longitudes:
+    :return:
+    """
+
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1
+    ).astype(np.float32)
+
+
+def build_travel_times() -> "np.ndarray":
+    """
+    震源の深さ × 震央距離 ごとのS波の走時（秒）を求める
+    震源から直接届く波と、各層の上面を伝わる屈折波のうち早い方とする
+    :return: (深さ, 距離) の配列
+    """
+
+    depths = np.arange(0, MAX_DEPTH + DEPTH_STEP, DEPTH_STEP, dtype=np.float64)
+    distances = DISTANCES.astype(np.float64)
+    tops = np.array([top for top, _ in VS_LAYERS], dtype=np.float64)
+    bottoms = np.append(tops[1:], np.inf)
+    slowness = 1 / np.array([vs for _, vs in VS_LAYERS], dtype=np.float64)
+
+    # 直接波: 経路上の点の深さ（中点則）ごとの遅さの平均
+    samples = (np.arange(16) + 0.5) / 16
+    depth_samples = depths[:, None] * samples[None, :]
+    mean_slowness = slowness[np.searchsorted(tops, depth_samples, side="right") - 1]
+    mean_slowness = mean_slowness.mean(axis=1)
+    times = np.hypot(depths[:, None], distances[None, :]) * mean_slowness[:, None]
+
+    # 屈折波: 震源より深い層の上面を伝わって地表に戻る
+    for n in range(1, len(VS_LAYERS)):
+        refractor = tops[n]
+        # 上の層ごとの厚さ（地表へ戻る経路 + 震源から屈折面へ下る経路）
+        upward = np.clip(np.minimum(bottoms[:n], refractor) - tops[:n], 0, None)
+        downward = np.clip(
+            np.minimum(bottoms[:n], refractor) - np.maximum(tops[:n], depths[:, None]),
+            0,
+            None,
+        )
+        thickness = upward[None, :] + downward
+        cosine = np.sqrt(np.clip(slowness[:n] ** 2 - slowness[n] ** 2, 0, None))
+        tangent = slowness[n] / cosine
+        intercept = (thickness * cosine).sum(axis=1)
+        # 臨界距離より近いところには屈折波は届かない
+        critical = (thickness * tangent).sum(axis=1)
+        head = distances[None, :] * slowness[n] + intercept[:, None]
+        head = np.where(distances[None, :] >= critical[:, None], head, np.inf)
+        # 屈折面より深い震源には使わない
+        head[depths >= refractor] = np.inf
+        times = np.minimum(times, head)
+
+    return times.astype(np.float32)
+
+
+def get_travel_times() -> "np.ndarray":
+    global _travel_times
+    if _travel_times is None:
+        _travel_times = build_travel_times()
+    return _travel_times
+
+
+def travel_times(depth: float, distances: "np.ndarray") -> "np.ndarray":
+    """
+    走時表を補間してS波の走時を求める
+    :param depth: 震源の深さ（km）
+    :param distances: 震央距離（km）
+    :return:
+    """
+
+    table = get_travel_times()
+    position = min(max(depth, 0), MAX_DEPTH) / DEPTH_STEP
+    lower = min(int(position), table.shape[0] - 2)
+    weight = position - lower
+    # 深さ方向は2行を混ぜ、距離方向は線形補間する
+    row = table[lower] * np.float32(1 - weight) + table[lower + 1] * np.float32(weight)
+    # 等間隔なので添字を直接求めて線形補間する（np.interpの二分探索より速い）
+    position = np.minimum(distances * np.float32(1 / DISTANCE_STEP), len(row) - 1)
+    index = np.minimum(position.astype(np.int32), len(row) - 2)
+    weight = position - index.astype(np.float32)
+    return row[index] + (row[index + 1] - row[index]) * weight
+
+
+def estimate_intensity(
+    magnitude: float, depth: float, hypocentral_distances: "np.ndarray"
+) -> "np.ndarray":
+    """
+    距離減衰式(司・翠川 1999)で最大速度を求め、計測震度に換算する(翠川ほか 1999)
+    :param magnitude: マグニチュード（モーメントマグニチュードとみなす）
+    :param depth: 震源の深さ（km）
+    :param hypocentral_distances: 震源距離（km）
+    :return: 計測震度
+    """
+
+    mw = min(magnitude, 8.3)
+    # 震源距離から断層の長さの半分を引いて断層最短距離の代わりにする
+    half_length = 10 ** (0.5 * mw - 1.85) / 2
+    distances = np.maximum(hypocentral_distances - np.float32(half_length), 3.0)
+    # 距離によらない項はまとめて先に計算する
+    constant = (
+        0.58 * mw + 0.0038 * min(depth, 100) - 1.29 + math.log10(SITE_AMPLIFICATION)
+    )
+    log_pgv = (
+        np.float32(constant)
+        - np.log10(distances + np.float32(0.0028 * 10 ** (0.5 * mw)))
+        - np.float32(0.002) * distances
+    )
+    return np.float32(2.68) + np.float32(1.72) * log_pgv
+
+
+class EEWEstimator:
+    """
+    緊急地震速報の震源から、位置を登録した通知先ごとのS波の到達までの秒数と予想震度を一度に求める
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("eew_estimate")
+        self.source: Sequence[Subscription] | None = None
+        # channel_id → 配列の添字
+        self.rows: dict[int, int] = {}
+        # 各地点の単位ベクトル (地点数, 3)
+        self.vectors = None
+        if AVAILABLE:
+            # 最初の緊急地震速報で走時表を作らないように先に作っておく
+            get_travel_times()
+
+    def update(self, subscriptions: Sequence[Subscription]) -> None:
+        """
+        通知先の位置を配列にする（通知先が変わった場合のみ）
+        :param subscriptions:
+        :return:
+        """
+
+        if subscriptions is self.source:
+            return
+
+        self.source = subscriptions
+        located = [
+            subscription
+            for subscription in subscriptions
+            if subscription.latitude is not None and subscription.longitude is not None
+        ]
+        self.rows = {
+            subscription.channel_id: i for i, subscription in enumerate(located)
+        }
+        if not AVAILABLE:
+            return
+
+        self.vectors = unit_vectors(
+            np.array([subscription.latitude for subscription in located]),
+            np.array([subscription.longitude for subscription in located]),
+        )
+
+    def estimate(
+        self, hypocenter: Hypocenter, elapsed: float = 0.0
+    ) -> tuple["np.ndarray", "np.ndarray"] | None:
+        """
+        全ての通知先の予想をまとめて求める
+        :param hypocenter: 緊急地震速報の震源
+        :param elapsed: 地震が発生してから経過した秒数
+        :return: (S波の到達までの秒数, 予想震度) の配列（行は`rows`の添字）、求められない場合はNone
+        """
+
+        if not AVAILABLE or not self.rows:
+            return None
+
+        latitude, longitude = hypocenter.latitude, hypocenter.longitude
+        depth, magnitude = hypocenter.depth, hypocenter.magnitude
+        if not hypocenter.located or depth < 0 or magnitude <= 0:
+            return None
+
+        started = time.perf_counter()
+        # 震央距離（単位ベクトルの内積から求めた中心角 × 地球の半径）
+        cosines = self.vectors @ unit_vectors(latitude, longitude)
+        distances = np.arccos(np.clip(cosines, -1, 1)) * np.float32(EARTH_RADIUS)
+
+        arrivals = travel_times(depth, distances) - np.float32(elapsed)
+        intensities = estimate_intensity(
+            magnitude, depth, np.sqrt(distances * distances + np.float32(depth**2))
+        )
+        scales = SCALE_LOOKUP[
+            np.clip(intensities * 2, 0, len(SCALE_LOOKUP) - 1).astype(np.intp)
+        ]
+
+        self.logger.debug(
+            f"Estimated {len(self.rows)} locations in {(time.perf_counter() - started) * 1000:.2f}ms"
+        )
+        return arrivals, scales
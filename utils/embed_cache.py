@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from collections.abc import Callable
+
+import discord
+
+from utils.events import Event
+
+
+class EmbedCache:
+    """
+    `_id`ごとに組み立て済みのEmbedを辞書形式で保持する
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[str, list[dict]] = OrderedDict()
+        # 同じ地震に対する`_id`の一覧（訂正が来たときにまとめて破棄する）
+        self.events: dict[str, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get_or_build(
+        self,
+        event: Event,
+        builder: Callable[[Event], list[discord.Embed]],
+        event_key: str | None = None,
+    ) -> list[discord.Embed]:
+        """
+        キャッシュがあればそれを、無ければ組み立ててキャッシュする
+        :param event:
+        :param builder:
+        :param event_key: 同じ地震を表すキー（訂正の判定に使う）
+        :return:
+        """
+
+        data_id = event.id
+        cached = self.entries.get(data_id)
+        if cached is not None:
+            self.entries.move_to_end(data_id)
+            return [discord.Embed.from_dict(embed) for embed in cached]
+
+        embeds = builder(event)
+        self.put(data_id, [embed.to_dict() for embed in embeds], event_key)
+        return embeds
+
+    def put(self, data_id: str, embeds: list[dict], event_key: str | None) -> None:
+        self.entries[data_id] = embeds
+        if event_key is not None:
+            self.events.setdefault(event_key, set()).add(data_id)
+
+        while len(self.entries) > self.maxsize:
+            old_id, _ = self.entries.popitem(last=False)
+            self.discard_event_id(old_id)
+
+    def discard_event_id(self, data_id: str) -> None:
+        for key, ids in list(self.events.items()):
+            ids.discard(data_id)
+            if not ids:
+                del self.events[key]
+
+    def invalidate(self, event_key: str) -> None:
+        """
+        訂正情報を受信したときに同じ地震のキャッシュを破棄する
+        :param event_key:
+        :return:
+        """
+
+        for data_id in self.events.pop(event_key, set()):
+            self.entries.pop(data_id, None)
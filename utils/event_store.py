@@ -0,0 +1,348 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    code INTEGER NOT NULL,
+    time TEXT NOT NULL, -- 地震の発生時刻（無ければ受信時刻）
+    max_scale INTEGER,
+    hypocenter TEXT,
+    magnitude REAL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE INDEX IF NOT EXISTS events_code_time ON events (code, time);
+CREATE INDEX IF NOT EXISTS events_max_scale_time ON events (max_scale, time);
+CREATE INDEX IF NOT EXISTS events_hypocenter_time ON events (hypocenter, time);
+-- 地震ごとに1行の概要（同じ地震の報は最後に受信したもので上書きする）
+-- 履歴の検索は(code, time)の索引を新しい順にたどってLIMIT件で止める
+CREATE TABLE IF NOT EXISTS quakes (
+    key TEXT PRIMARY KEY,
+    code INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    event_id TEXT NOT NULL, -- 最後に受信した報
+    max_scale INTEGER,
+    hypocenter TEXT,
+    magnitude REAL
+);
+CREATE INDEX IF NOT EXISTS quakes_time ON quakes (time);
+CREATE INDEX IF NOT EXISTS quakes_code_time ON quakes (code, time);
+-- 震源地名・観測点の都道府県から地震を引く索引
+CREATE TABLE IF NOT EXISTS quake_regions (
+    region TEXT NOT NULL,
+    time TEXT NOT NULL,
+    key TEXT NOT NULL,
+    code INTEGER NOT NULL,
+    PRIMARY KEY (region, time, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS quake_regions_key ON quake_regions (key);
+-- 地域名の一覧（部分一致検索をイベント数ではなく地域名の数で済ませる）
+CREATE TABLE IF NOT EXISTS regions (
+    name TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+
+@dataclass(frozen=True)
+class StoredEvent:
+    """
+    保存された地震情報の概要
+    """
+
+    id: str
+    code: int
+    time: str
+    max_scale: int | None
+    hypocenter: str | None
+    magnitude: float | None
+
+
+def to_row(data: dict) -> tuple:
+    earthquake = data.get("earthquake") or {}
+    hypocenter = earthquake.get("hypocenter") or {}
+    magnitude = hypocenter.get("magnitude")
+    return (
+        data["_id"],
+        data["code"],
+        # "YYYY/MM/DD HH:MM:SS" は文字列のまま時系列順に並ぶ
+        earthquake.get("time") or earthquake.get("originTime") or data["time"],
+        earthquake.get("maxScale"),
+        hypocenter.get("name") or None,
+        float(magnitude) if magnitude not in (None, -1) else None,
+        json.dumps(data, ensure_ascii=False, default=list),
+    )
+
+
+def to_key(data: dict, time: str) -> str:
+    """
+    同じ地震の報をまとめるキー
+    地震情報は発生時刻と震源（`cogs.p2pquake.quake_event_key`と同じ）、緊急地震速報は地震ID
+    :param data:
+    :param time: to_rowで決めた時刻
+    :return:
+    """
+
+    code = data["code"]
+    if code == 556:
+        return f"556|{(data.get('issue') or {}).get('eventId') or data['_id']}"
+    if code != 551:
+        return f"{code}|{data['_id']}"
+
+    hypocenter = (data.get("earthquake") or {}).get("hypocenter") or {}
+    name = hypocenter.get("name")
+    if not name:
+        # 震度速報は震源が未定なので発生時刻だけで表す
+        return f"551|{time}"
+    try:
+        latitude = float(hypocenter.get("latitude", -200))
+        longitude = float(hypocenter.get("longitude", -200))
+    except (TypeError, ValueError):
+        latitude = longitude = -200
+    if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        return f"551|{time}|{name}|{latitude:.1f},{longitude:.1f}"
+    return f"551|{time}|{name}"
+
+
+def to_regions(data: dict) -> set[str]:
+    """
+    震源地名と観測点・予報区の都道府県
+    :param data:
+    :return:
+    """
+
+    regions = {
+        point["pref"] for point in data.get("points") or () if point.get("pref")
+    } | {area["pref"] for area in data.get("areas") or () if area.get("pref")}
+
+    hypocenter = (data.get("earthquake") or {}).get("hypocenter") or {}
+    if hypocenter.get("name"):
+        regions.add(hypocenter["name"])
+    return regions
+
+
+class EventStore:
+    """
+    受信した情報をSQLiteに保存する
+    書き込みは受信処理を止めないようにキューに積み、専用のスレッドでまとめて行う
+    """
+
+    def __init__(self, path: str, batch_size: int = 100):
+        self.path = path
+        self.batch_size = batch_size
+        self.logger = logging.getLogger("event_store")
+        # sqlite3の接続は1つのスレッドからのみ使う
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.connection: sqlite3.Connection | None = None
+        self.queue: asyncio.Queue[dict] = asyncio.Queue()
+        self.writer = None
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    def _open(self) -> None:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        # 地震ごとの概要が無いデータベース → 保存済みの報から作る
+        if self.connection.execute("SELECT 1 FROM quakes LIMIT 1").fetchone():
+            return
+        cursor = self.connection.execute("SELECT payload FROM events ORDER BY rowid")
+        with self.connection:
+            while rows := cursor.fetchmany(1000):
+                for (payload,) in rows:
+                    data = json.loads(payload)
+                    self._summarize(data, to_row(data))
+
+    async def open(self) -> None:
+        await self.run(self._open)
+        self.writer = asyncio.create_task(self.write_loop())
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            # 残っている書き込みを終わらせてから閉じる
+            await self.queue.join()
+            self.writer.cancel()
+            self.writer = None
+        if self.connection is not None:
+            await self.run(self.connection.close)
+            self.connection = None
+        self.executor.shutdown(wait=False)
+
+    def append(self, data: dict) -> None:
+        self.queue.put_nowait(data)
+
+    def _summarize(self, data: dict, row: tuple) -> None:
+        """
+        地震ごとの概要と地域の索引を更新する
+        :param data:
+        :param row: to_rowで変換した行
+        :return:
+        """
+
+        event_id, code, time, max_scale, hypocenter, magnitude, _ = row
+        key = to_key(data, time)
+        connection = self.connection
+        update = True
+        if code == 551 and hypocenter is None:
+            # 震源が分かった報より後に届いた震度速報は、その地震に地域だけを加える
+            located = connection.execute(
+                "SELECT key FROM quakes WHERE code = 551 AND time = ? "
+                "AND hypocenter IS NOT NULL ORDER BY rowid DESC LIMIT 1",
+                (time,),
+            ).fetchone()
+            if located is not None:
+                key = located[0]
+                update = False
+        elif code == 551:
+            # 震度速報の行は震源が分かった最初の報で引き継ぐ
+            prompt_key = f"551|{time}"
+            if connection.execute(
+                "DELETE FROM quakes WHERE key = ?", (prompt_key,)
+            ).rowcount:
+                connection.execute(
+                    "UPDATE OR IGNORE quake_regions SET key = ? WHERE key = ?",
+                    (key, prompt_key),
+                )
+                connection.execute(
+                    "DELETE FROM quake_regions WHERE key = ?", (prompt_key,)
+                )
+
+        if update:
+            connection.execute(
+                "INSERT INTO quakes VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET event_id = excluded.event_id, "
+                "max_scale = excluded.max_scale, hypocenter = excluded.hypocenter, "
+                "magnitude = excluded.magnitude",
+                (key, code, time, event_id, max_scale, hypocenter, magnitude),
+            )
+
+        regions = to_regions(data)
+        connection.executemany(
+            "INSERT OR IGNORE INTO quake_regions VALUES (?, ?, ?, ?)",
+            [(region, time, key, code) for region in regions],
+        )
+        connection.executemany(
+            "INSERT OR IGNORE INTO regions VALUES (?)",
+            [(region,) for region in regions],
+        )
+
+    def _write(self, events: list[dict]) -> None:
+        rows = [to_row(data) for data in events]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            # 同じ地震の報は受信した順に概要へ反映する
+            for data, row in zip(events, rows):
+                self._summarize(data, row)
+
+    async def write_loop(self) -> None:
+        while True:
+            events = [await self.queue.get()]
+            while not self.queue.empty() and len(events) < self.batch_size:
+                events.append(self.queue.get_nowait())
+
+            try:
+                await self.run(self._write, events)
+            except Exception:
+                self.logger.error("Failed to write events:")
+                self.logger.error(traceback.format_exc())
+            finally:
+                for _ in events:
+                    self.queue.task_done()
+
+    def _query(
+        self,
+        code: int | None,
+        start: str | None,
+        end: str | None,
+        min_scale: int | None,
+        region: str | None,
+        limit: int,
+    ) -> list[StoredEvent]:
+        column = "r." if region else "q."
+        conditions = []
+        params = []
+        if code is not None:
+            conditions.append(f"{column}code = ?")
+            params.append(code)
+        if start:
+            conditions.append(f"{column}time >= ?")
+            params.append(start)
+        if end:
+            conditions.append(f"{column}time < ?")
+            params.append(end)
+        if min_scale is not None:
+            conditions.append("q.max_scale >= ?")
+            params.append(min_scale)
+        columns = "q.event_id, q.code, q.time, q.max_scale, q.hypocenter, q.magnitude"
+
+        if not region:
+            # (code, time)の索引を新しい順にたどってLIMIT件で止める
+            where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+            sql = (
+                f"SELECT {columns} FROM quakes AS q {where}ORDER BY q.time DESC LIMIT ?"
+            )
+            return [
+                StoredEvent(*row)
+                for row in self.connection.execute(sql, (*params, limit))
+            ]
+
+        # 一致する地域名を先に絞り込み、地域ごとに(region, time)の索引をLIMIT件だけたどる
+        names = [
+            name
+            for (name,) in self.connection.execute(
+                "SELECT name FROM regions WHERE name LIKE ?", (f"%{region}%",)
+            )
+        ]
+        sql = (
+            f"SELECT q.key, {columns} FROM quake_regions AS r "
+            "JOIN quakes AS q ON q.key = r.key "
+            f"WHERE {' AND '.join(['r.region = ?', *conditions])} "
+            "ORDER BY r.time DESC LIMIT ?"
+        )
+        found = {}
+        for name in names:
+            for key, *row in self.connection.execute(sql, (name, *params, limit)):
+                # 複数の地域に一致した地震は1件にまとめる
+                found[key] = StoredEvent(*row)
+        return sorted(found.values(), key=lambda event: event.time, reverse=True)[
+            :limit
+        ]
+
+    async def query(
+        self,
+        code: int | None = None,
+        start: str | None = None,
+        end: str | None = None,
+        min_scale: int | None = None,
+        region: str | None = None,
+        limit: int = 10,
+    ) -> list[StoredEvent]:
+        """
+        条件に合う情報を新しい順に取得する
+        :param code:
+        :param start: この時刻以降（"YYYY/MM/DD"形式）
+        :param end: この時刻より前（"YYYY/MM/DD"形式）
+        :param min_scale: 最大震度の下限
+        :param region: 震源地または観測点の都道府県
+        :param limit:
+        :return:
+        """
+
+        return await self.run(self._query, code, start, end, min_scale, region, limit)
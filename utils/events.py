@@ -0,0 +1,419 @@
+import sys
+from array import array
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass
+from typing import ClassVar
+
+from utils.formatting import parse_time
+
+
+class EventError(ValueError):
+    """
+    受信した情報の形式が正しくない
+    """
+
+
+def _intern(value) -> str:
+    # 観測点名・予報区名は同じ文字列が何度も届くので1つにまとめる
+    return sys.intern(str(value or ""))
+
+
+def _time(value, name: str) -> str:
+    # 書式は受信時に一度だけ確かめ、以降は文字列のまま扱う
+    try:
+        parse_time(value)
+    except (TypeError, ValueError) as e:
+        raise EventError(f"invalid {name}: {value!r}") from e
+    return value
+
+
+@dataclass(frozen=True, slots=True)
+class Hypocenter:
+    """
+    震源（不明な値は緯度・経度が-200、深さ・マグニチュードが-1）
+    """
+
+    name: str = ""
+    latitude: float = -200
+    longitude: float = -200
+    depth: int = -1
+    magnitude: float = -1
+
+    @property
+    def located(self) -> bool:
+        return -90 <= self.latitude <= 90 and -180 <= self.longitude <= 180
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> "Hypocenter":
+        if not data:
+            return UNKNOWN_HYPOCENTER
+        try:
+            return cls(
+                name=_intern(data.get("name")),
+                latitude=float(data.get("latitude", -200)),
+                longitude=float(data.get("longitude", -200)),
+                depth=int(data.get("depth", -1)),
+                magnitude=float(data.get("magnitude", -1)),
+            )
+        except (TypeError, ValueError) as e:
+            raise EventError(f"invalid hypocenter: {data!r}") from e
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "depth": self.depth,
+            "magnitude": self.magnitude,
+        }
+
+
+UNKNOWN_HYPOCENTER = Hypocenter()
+
+
+class Points(Sequence):
+    """
+    観測点の震度
+    数千件になるので辞書ではなく、名前は共有した文字列、震度は1バイトの配列で持つ
+    受信時には変換せず、最初に使われたときに変換する（`LazyPoints`のパースもそこまで遅らせる）
+    """
+
+    __slots__ = ("source", "valid", "_prefs", "_names", "_scales")
+
+    def __init__(self, source=()):
+        # 受信した観測点の一覧（変換したら手放す）
+        self.source = source
+        self.valid = True
+        self._prefs: tuple[str, ...] | None = None
+        self._names: tuple[str, ...] | None = None
+        self._scales: array | None = None
+
+    @classmethod
+    def from_list(cls, points) -> "Points":
+        return cls(points or ())
+
+    def load(self) -> bool:
+        """
+        受信した観測点の一覧を変換する
+        不正な観測点を含む場合は観測点が無いものとして扱う（地震情報そのものは配信する）
+        :return: 変換できたか
+        """
+
+        if self._scales is not None:
+            return self.valid
+
+        prefs = []
+        names = []
+        scales = array("b")
+        try:
+            for point in self.source:
+                prefs.append(_intern(point["pref"]))
+                names.append(_intern(point["addr"]))
+                scales.append(int(point["scale"]))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            self.valid = False
+            prefs, names, scales = [], [], array("b")
+        self._prefs = tuple(prefs)
+        self._names = tuple(names)
+        self._scales = scales
+        self.source = None
+        return self.valid
+
+    @property
+    def prefs(self) -> tuple[str, ...]:
+        self.load()
+        return self._prefs
+
+    @property
+    def names(self) -> tuple[str, ...]:
+        self.load()
+        return self._names
+
+    @property
+    def scales(self) -> array:
+        self.load()
+        return self._scales
+
+    def to_list(self) -> list[dict]:
+        return [
+            {"pref": pref, "addr": name, "scale": scale} for pref, name, scale in self
+        ]
+
+    def __bool__(self) -> bool:
+        # 空かどうかは変換せずに分かる
+        if self._scales is None:
+            return bool(self.source)
+        return len(self._scales) > 0
+
+    def __len__(self) -> int:
+        return len(self.scales)
+
+    def __getitem__(self, index) -> tuple[str, str, int]:
+        return self.prefs[index], self.names[index], self.scales[index]
+
+    def __iter__(self) -> Iterator[tuple[str, str, int]]:
+        """
+        (都道府県, 観測点名, 震度)
+        """
+
+        self.load()
+        return zip(self._prefs, self._names, self._scales)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Points):
+            return NotImplemented
+        return (
+            self.scales == other.scales
+            and self.names == other.names
+            and self.prefs == other.prefs
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.prefs, self.names, self.scales.tobytes()))
+
+    def __repr__(self) -> str:
+        if self._scales is None:
+            return "<Points (not loaded)>"
+        return f"<Points {len(self)}>"
+
+
+EMPTY_POINTS = Points()
+
+
+@dataclass(frozen=True, slots=True)
+class QuakeEvent:
+    """
+    地震情報
+    """
+
+    code: ClassVar[int] = 551
+
+    id: str
+    time: str
+    issue_type: str
+    issue_source: str
+    issue_time: str
+    issue_correct: str
+    # 地震の発生時刻（同じ地震の続報をまとめるキーにもなる）
+    earthquake_time: str
+    hypocenter: Hypocenter
+    max_scale: int
+    domestic_tsunami: str
+    points: Points = EMPTY_POINTS
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuakeEvent":
+        issue = data.get("issue") or {}
+        earthquake = data.get("earthquake")
+        if not earthquake:
+            raise EventError("earthquake is missing")
+        try:
+            max_scale = int(earthquake.get("maxScale", -1))
+        except (TypeError, ValueError) as e:
+            raise EventError(f"invalid maxScale: {earthquake.get('maxScale')!r}") from e
+        return cls(
+            id=str(data.get("_id") or data.get("id") or ""),
+            time=_time(data.get("time"), "time"),
+            issue_type=issue.get("type", "Other"),
+            issue_source=issue.get("source", ""),
+            issue_time=issue.get("time", ""),
+            issue_correct=issue.get("correct", "None"),
+            earthquake_time=earthquake.get("time") or "",
+            hypocenter=Hypocenter.from_dict(earthquake.get("hypocenter")),
+            max_scale=max_scale,
+            domestic_tsunami=earthquake.get("domesticTsunami", "Unknown"),
+            points=Points.from_list(data.get("points")),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "_id": self.id,
+            "code": self.code,
+            "time": self.time,
+            "issue": {
+                "type": self.issue_type,
+                "source": self.issue_source,
+                "time": self.issue_time,
+                "correct": self.issue_correct,
+            },
+            "earthquake": {
+                "time": self.earthquake_time,
+                "hypocenter": self.hypocenter.to_dict(),
+                "maxScale": self.max_scale,
+                "domesticTsunami": self.domestic_tsunami,
+            },
+            "points": self.points.to_list(),
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class TunamiArea:
+    grade: str
+    immediate: bool
+    name: str
+
+
+@dataclass(frozen=True, slots=True)
+class TunamiEvent:
+    """
+    津波予報
+    """
+
+    code: ClassVar[int] = 552
+
+    id: str
+    time: str
+    cancelled: bool
+    issue_source: str
+    issue_time: str
+    areas: tuple[TunamiArea, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TunamiEvent":
+        issue = data.get("issue") or {}
+        try:
+            areas = tuple(
+                TunamiArea(
+                    grade=area.get("grade", "Unknown"),
+                    immediate=bool(area.get("immediate", False)),
+                    name=_intern(area["name"]),
+                )
+                for area in data.get("areas") or ()
+            )
+        except (KeyError, AttributeError) as e:
+            raise EventError("invalid areas") from e
+        return cls(
+            id=str(data.get("_id") or data.get("id") or ""),
+            time=_time(data.get("time"), "time"),
+            cancelled=bool(data.get("cancelled", False)),
+            issue_source=issue.get("source", ""),
+            issue_time=issue.get("time", ""),
+            areas=areas,
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "_id": self.id,
+            "code": self.code,
+            "time": self.time,
+            "cancelled": self.cancelled,
+            "issue": {"source": self.issue_source, "time": self.issue_time},
+            "areas": [
+                {"grade": area.grade, "immediate": area.immediate, "name": area.name}
+                for area in self.areas
+            ],
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class EEWArea:
+    pref: str
+    name: str
+    scale_from: int
+    scale_to: int
+    kind_code: str
+    arrival_time: str | None
+
+
+@dataclass(frozen=True, slots=True)
+class EEWEvent:
+    """
+    緊急地震速報（警報）
+    取消の場合は震源・対象地域が無い
+    """
+
+    code: ClassVar[int] = 556
+
+    id: str
+    time: str
+    test: bool
+    cancelled: bool
+    issue_time: str
+    event_id: str
+    serial: str
+    origin_time: str | None
+    arrival_time: str | None
+    hypocenter: Hypocenter = UNKNOWN_HYPOCENTER
+    areas: tuple[EEWArea, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "EEWEvent":
+        issue = data.get("issue") or {}
+        earthquake = data.get("earthquake") or {}
+        try:
+            areas = tuple(
+                EEWArea(
+                    pref=_intern(area.get("pref")),
+                    name=_intern(area.get("name")),
+                    scale_from=int(area.get("scaleFrom", -1)),
+                    scale_to=int(area.get("scaleTo", -1)),
+                    kind_code=area.get("kindCode", ""),
+                    arrival_time=area.get("arrivalTime"),
+                )
+                for area in data.get("areas") or ()
+            )
+        except (AttributeError, TypeError, ValueError) as e:
+            raise EventError("invalid areas") from e
+        return cls(
+            id=str(data.get("_id") or data.get("id") or ""),
+            time=_time(data.get("time"), "time"),
+            test=bool(data.get("test", False)),
+            cancelled=bool(data.get("cancelled", False)),
+            issue_time=issue.get("time", ""),
+            event_id=str(issue.get("eventId", "")),
+            serial=str(issue.get("serial", "")),
+            origin_time=earthquake.get("originTime"),
+            arrival_time=earthquake.get("arrivalTime"),
+            hypocenter=Hypocenter.from_dict(earthquake.get("hypocenter")),
+            areas=areas,
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "_id": self.id,
+            "code": self.code,
+            "time": self.time,
+            "test": self.test,
+            "cancelled": self.cancelled,
+            "issue": {
+                "time": self.issue_time,
+                "eventId": self.event_id,
+                "serial": self.serial,
+            },
+            "earthquake": {
+                "originTime": self.origin_time,
+                "arrivalTime": self.arrival_time,
+                "hypocenter": self.hypocenter.to_dict(),
+            },
+            "areas": [
+                {
+                    "pref": area.pref,
+                    "name": area.name,
+                    "scaleFrom": area.scale_from,
+                    "scaleTo": area.scale_to,
+                    "kindCode": area.kind_code,
+                    "arrivalTime": area.arrival_time,
+                }
+                for area in self.areas
+            ],
+        }
+
+
+Event = QuakeEvent | TunamiEvent | EEWEvent
+
+EVENT_TYPES: dict[int, type] = {
+    event_type.code: event_type for event_type in (QuakeEvent, TunamiEvent, EEWEvent)
+}
+
+
+def decode_event(data: dict) -> Event:
+    """
+    受信した情報を検証して変換する
+    :param data:
+    :return:
+    """
+
+    event_type = EVENT_TYPES.get(data.get("code"))
+    if event_type is None:
+        raise EventError(f"unsupported code: {data.get('code')!r}")
+    return event_type.from_dict(data)
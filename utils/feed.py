@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import traceback
+from collections import deque
+from collections.abc import Iterable
+
+from utils.decode import Frame
+from utils.ingest import EventHandler, P2PIngest
+from utils.ipc import EventClient
+
+
+class EventFeed:
+    """
+    P2P地震情報の受信をBotが持ち続け、Cogをリロードしても接続を切らない
+    ハンドラが外れている間に受信した情報は溜めておき、次に付けたハンドラへ順番に渡す
+    """
+
+    def __init__(self, ingest_socket: str | None = None, buffer_size: int = 1000):
+        self.logger = logging.getLogger("feed")
+        self.handler: EventHandler | None = None
+        # (data, 受信した時刻, 受信したJSON文字列 or None)
+        self.buffer: deque[tuple[dict, float, str | None]] = deque(maxlen=buffer_size)
+        # 取り込みプロセスのソケットが指定されていれば、P2P地震情報へは接続せずにそこから受け取る
+        self.remote = bool(ingest_socket)
+        if ingest_socket:
+            self.source = EventClient(ingest_socket, self.on_ipc_message)
+        else:
+            self.source = P2PIngest(self.on_data)
+        self.started = False
+
+    def start(self) -> None:
+        if not self.started:
+            self.started = True
+            self.source.start()
+
+    async def stop(self) -> None:
+        if self.started:
+            self.started = False
+            await self.source.stop()
+
+    def attach(self, handler: EventHandler) -> None:
+        """
+        ハンドラを付け、外れている間に溜まった情報を渡す
+        :param handler:
+        :return:
+        """
+
+        self.handler = handler
+        if self.buffer:
+            self.logger.info(f"Replaying {len(self.buffer)} buffered events")
+        while self.buffer and self.handler is handler:
+            self.dispatch(handler, *self.buffer.popleft())
+
+    def detach(self) -> None:
+        """
+        ハンドラを外す（以降に受信した情報は溜めておく）
+        :return:
+        """
+
+        self.handler = None
+
+    def requeue(self, events: Iterable[tuple[dict, float]]) -> None:
+        """
+        配信しきれなかった情報を溜めている情報より先に戻す
+        :param events: (data, 受信した時刻)
+        :return:
+        """
+
+        self.buffer.extendleft(
+            (data, received_at, None) for data, received_at in reversed(list(events))
+        )
+
+    def dispatch(
+        self, handler: EventHandler, data: dict, received_at: float, raw: str | None
+    ) -> None:
+        try:
+            handler(data, received_at, raw)
+        except Exception:
+            self.logger.error("Failed to handle event:")
+            self.logger.error(traceback.format_exc())
+
+    def on_ipc_message(self, raw: str) -> None:
+        received_at = asyncio.get_running_loop().time()
+        frame = Frame(raw)
+        self.on_data(frame.parse(), received_at, raw)
+
+    def on_data(self, data: dict, received_at: float, raw: str | None) -> None:
+        if self.handler is not None:
+            self.dispatch(self.handler, data, received_at, raw)
+            return
+
+        if len(self.buffer) == self.buffer.maxlen:
+            self.logger.warning("Event buffer is full, dropping the oldest event")
+        self.buffer.append((data, received_at, raw))
@@ -0,0 +1,112 @@
+from collections.abc import Callable, Hashable, Iterable
+
+import discord
+
+# Discordの上限
+FIELD_VALUE_LIMIT = 1024
+FIELD_COUNT_LIMIT = 25
+EMBED_TOTAL_LIMIT = 6000
+MESSAGE_EMBED_LIMIT = 10
+
+
+def group_by(
+    items: Iterable, key: Callable[[dict], Hashable], order: Iterable[Hashable]
+) -> list[tuple[Hashable, list]]:
+    """
+    一度の走査で`order`の値ごとにまとめる
+    各グループ内の並び順は元のリストの順番を保つ
+    :param items:
+    :param key:
+    :param order: 出力するグループの順番（含まれない値は捨てる）
+    :return: 空でないグループのみ
+    """
+
+    groups = {value: [] for value in order}
+    for item in items:
+        group = groups.get(key(item))
+        if group is not None:
+            group.append(item)
+
+    return [(value, group) for value, group in groups.items() if group]
+
+
+def split_field_values(
+    values: Iterable[str], limit: int = FIELD_VALUE_LIMIT, separator: str = ", "
+) -> list[str]:
+    """
+    フィールドの値の上限を超えないように分割して連結する
+    :param values:
+    :param limit:
+    :param separator:
+    :return:
+    """
+
+    chunks = []
+    current = []
+    length = 0
+    for value in values:
+        added = len(value) + (len(separator) if current else 0)
+        if current and length + added > limit:
+            chunks.append(separator.join(current))
+            current = []
+            length = 0
+            added = len(value)
+        current.append(value)
+        length += added
+
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def add_grouped_fields(
+    embed: discord.Embed, groups: Iterable[tuple[str, Iterable[str]]]
+) -> list[discord.Embed]:
+    """
+    グループごとにフィールドを追加する
+    フィールド数やEmbed全体の文字数の上限を超える場合は続きのEmbedを作る
+    :param embed: 最初のEmbed
+    :param groups: (フィールド名, 値の一覧)
+    :return:
+    """
+
+    embeds = [embed]
+    for name, values in groups:
+        for i, value in enumerate(split_field_values(values)):
+            field_name = name if i == 0 else f"{name}(続き)"
+            current = embeds[-1]
+            if (
+                len(current.fields) >= FIELD_COUNT_LIMIT
+                or len(current) + len(field_name) + len(value) > EMBED_TOTAL_LIMIT
+            ):
+                current = discord.Embed(title=f"{embed.title}(続き)")
+                embeds.append(current)
+            current.add_field(name=field_name, value=value, inline=False)
+
+    return embeds
+
+
+def chunk_embeds(embeds: list[discord.Embed]) -> list[list[discord.Embed]]:
+    """
+    1メッセージあたりのEmbed数と合計文字数の上限を超えないように分ける
+    :param embeds:
+    :return:
+    """
+
+    messages = []
+    current = []
+    length = 0
+    for embed in embeds:
+        size = len(embed)
+        if current and (
+            len(current) >= MESSAGE_EMBED_LIMIT or length + size > EMBED_TOTAL_LIMIT
+        ):
+            messages.append(current)
+            current = []
+            length = 0
+        current.append(embed)
+        length += size
+
+    if current:
+        messages.append(current)
+    return messages
@@ -0,0 +1,183 @@
+from collections.abc import Iterable
+from datetime import datetime
+
+import discord
+
+from utils.fields import add_grouped_fields, group_by
+
+# 発表種類
+ISSUE_TYPES = {
+    "ScalePrompt": "震度速報",
+    "Destination": "震源に関する情報",
+    "ScaleAndDestination": "震度・震源に関する情報",
+    "DetailScale": "各地の震度に関する情報",
+    "Foreign": "遠地地震に関する情報",
+    "Other": "その他の情報",
+}
+
+# 訂正情報
+ISSUE_CORRECTS = {
+    "None": "",
+    "Unknown": "訂正情報不明",
+    "ScaleOnly": "震度情報の訂正が含まれます",
+    "DestinationOnly": "震源情報の訂正が含まれます",
+    "ScaleAndDestination": "震度・震源情報の訂正が含まれます",
+}
+
+# 震度
+EARTHQUAKE_SCALES = {
+    -1: "調査中",
+    10: "1",
+    20: "2",
+    30: "3",
+    40: "4",
+    45: "5弱",
+    46: "5弱以上(推定)",
+    50: "5強",
+    55: "6弱",
+    60: "6強",
+    70: "7",
+}
+
+# 選択肢などに使う観測される震度（-1と推定の46を除く）
+SCALES = (10, 20, 30, 40, 45, 50, 55, 60, 70)
+
+# 国内への津波の有無
+EARTHQUAKE_TSUNAMIS = {
+    "None": "無し",
+    "Unknown": "不明",
+    "Checking": "調査中",
+    "NonEffective": "若干の海面変動が予想されるが、被害の心配なし",
+    "Watch": "津波注意報",
+    "Warning": "津波予報(種類不明)",
+}
+
+# 各地の震度情報で表示する震度（大きい順）
+POINT_SCALES = {
+    70: "震度7",
+    60: "震度6強",
+    55: "震度6弱",
+    50: "震度5強",
+    46: "震度5弱以上と推定されるが震度情報を入手していない",
+    45: "震度5弱",
+    40: "震度4",
+    30: "震度3",
+}
+
+# 津波予報の種類（大きい順）
+TUNAMI_GRADES = {
+    "MajorWarning": "大津波警報",
+    "Warning": "津波警報",
+    "Watch": "津波注意報",
+    "Unknown": "不明",
+}
+
+
+def format_issue_type(issue_type: str) -> str:
+    """
+    発表種類を変換する
+    :param issue_type:
+    :return:
+    """
+
+    return ISSUE_TYPES.get(issue_type, "不明")
+
+
+def format_issue_correct(correct: str) -> str:
+    """
+    訂正情報を変換する
+    :param correct:
+    :return:
+    """
+
+    return ISSUE_CORRECTS.get(correct, "訂正情報不明")
+
+
+def format_earthquake_scale(scale: int) -> str:
+    """
+    震度を変換する
+    :param scale:
+    :return:
+    """
+
+    return EARTHQUAKE_SCALES.get(scale, "不明")
+
+
+def format_earthquake_depth(depth: int) -> str:
+    """
+    震源の深さを変換する
+    :param depth:
+    :return:
+    """
+
+    if depth == -1:
+        return "調査中"
+    if depth == 0:
+        return "ごく浅い"
+    return f"{depth}km"
+
+
+def format_earthquake_magnitude(magnitude: float) -> str:
+    """
+    マグニチュードを変換する
+    :param magnitude:
+    :return:
+    """
+
+    return "調査中" if magnitude == -1 else f"{magnitude}"
+
+
+def format_earthquake_tsunami(tsunami: str) -> str:
+    """
+    津波情報を変換する
+    :param tsunami:
+    :return:
+    """
+
+    return EARTHQUAKE_TSUNAMIS.get(tsunami, "不明")
+
+
+def format_earthquake_points(
+    points: Iterable[tuple[str, str, int]],
+) -> list[discord.Embed]:
+    """
+    各地の震度情報を変換する
+    :param points: (都道府県, 観測点名, 震度)
+    :return:
+    """
+
+    return add_grouped_fields(
+        discord.Embed(title="各地の震度情報"),
+        (
+            (POINT_SCALES[scale], (point[1] for point in filtered_points))
+            for scale, filtered_points in group_by(
+                points, lambda point: point[2], POINT_SCALES
+            )
+        ),
+    )
+
+
+def parse_time(value: str) -> datetime:
+    """
+    P2P地震情報の時刻を変換する
+    "YYYY/MM/DD HH:MM:SS" と "YYYY/MM/DD HH:MM:SS.fff" の固定の書式なので、strptimeを使わずに位置で切り出す
+    :param value:
+    :return:
+    """
+
+    if len(value) < 19 or value[4] != "/" or value[10] != " ":
+        raise ValueError(f"time data {value!r} does not match format")
+
+    microsecond = 0
+    if len(value) > 20:
+        # 小数部は桁数が変わっても良いように6桁に揃える
+        microsecond = int(value[20:26].ljust(6, "0"))
+    return datetime(
+        int(value[0:4]),
+        int(value[5:7]),
+        int(value[8:10]),
+        int(value[11:13]),
+        int(value[14:16]),
+        int(value[17:19]),
+        microsecond,
+    )
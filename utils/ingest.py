@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import os
+import traceback
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+
+from utils import metrics
+from utils.backoff import Backoff
+from utils.decode import Frame
+from utils.dedup import DedupIndex
+from utils.formatting import parse_time
+
+JST = timezone(timedelta(hours=9))
+
+# 配信する code
+CODES = (551, 552, 556)
+
+# (data, 受信した時刻(loop.time()), 受信したJSON文字列 or None)
+EventHandler = Callable[[dict, float, str | None], None]
+
+
+class P2PIngest:
+    """
+    P2P地震情報のWebSocket・履歴APIから情報を受信し、重複を除いてハンドラに渡す
+    """
+
+    def __init__(self, handler: EventHandler):
+        self.handler = handler
+        self.logger = logging.getLogger("p2pquake")
+        self.dedup = DedupIndex()
+
+        # サンドボックス: wss://api-realtime-sandbox.p2pquake.net/v2/ws
+        # カンマ区切りで複数指定すると全てに同時に接続し、先に届いたものを配信する
+        self.ws_urls = os.environ.get(
+            "P2PQUAKE_WS_URL", "https://api.p2pquake.net/v2/ws"
+        ).split(",")
+        self.history_url = os.environ.get(
+            "P2PQUAKE_HISTORY_URL", "https://api.p2pquake.net/v2/history"
+        )
+        self.poll_interval = float(os.environ.get("P2PQUAKE_POLL_INTERVAL", 0))
+        # 無通信がこの秒数続いたら半開きの接続とみなして再接続する
+        self.idle_timeout = float(os.environ.get("P2PQUAKE_IDLE_TIMEOUT", 600))
+        self.heartbeat = 30  # WebSocketのping間隔（秒）
+        self.websockets = set()
+        self.should_reconnect = True
+        self.backoff_base = 1  # 再接続の最初の待機秒数
+        self.backoff_cap = 300  # 再接続の最大待機秒数
+        # この秒数以上つながっていた接続が切れた場合は待機秒数を最初に戻す
+        self.stable_after = 60
+        self.task = None
+        # 履歴からの補完は同時に1つだけ行い、その間の切断は次の補完にまとめる
+        self.backfill_task = None
+        self.backfill_since: datetime | None = None
+
+    def start(self) -> None:
+        self.should_reconnect = True
+        self.task = asyncio.create_task(self.listen_p2pquake())
+
+    async def stop(self) -> None:
+        self.should_reconnect = False  # ユーザー操作による停止 → 再接続しない
+        for ws in list(self.websockets):
+            await ws.close()
+        for task in (self.task, self.backfill_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.task = None
+        self.backfill_task = None
+        self.backfill_since = None
+
+    async def connect_websocket(self, session, url, backoff: Backoff):
+        """WebSocket接続処理（リトライ制御あり）"""
+
+        while self.should_reconnect:
+            try:
+                self.logger.info(f"Trying to connect to P2P WebSocket {url}...")
+                ws = await session.ws_connect(
+                    url,
+                    proxy=os.environ.get("PROXY_URL"),
+                    heartbeat=self.heartbeat,
+                )
+                self.logger.info(f"P2P WebSocket Connected {url}")
+                return ws
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                self.logger.error(f"WebSocket connection failed {url}:")
+                self.logger.error(traceback.format_exc())
+
+                wait_time = backoff.next_delay()
+                self.logger.warning(f"Retrying in {wait_time:.1f} seconds...")
+                await asyncio.sleep(wait_time)
+
+        return None  # should_reconnect が False の場合
+
+    async def listen_p2pquake(self):
+        async with aiohttp.ClientSession() as session:
+            tasks = [self.listen_websocket(session, url) for url in self.ws_urls]
+            if self.poll_interval > 0:
+                tasks.append(self.poll_history(session))
+            await asyncio.gather(*tasks)
+
+    async def listen_websocket(self, session, url):
+        loop = asyncio.get_running_loop()
+        # 接続してすぐ切られる場合も待機秒数を伸ばしていくように、URLごとに1つを使い続ける
+        backoff = Backoff(self.backoff_base, self.backoff_cap)
+        disconnected_at = None
+        while self.should_reconnect:
+            ws = await self.connect_websocket(session, url, backoff)
+            if ws is None:
+                break
+
+            connected_at = loop.time()
+            received = False
+            self.websockets.add(ws)
+            metrics.CONNECTED.set(1, url=url)
+            if disconnected_at is not None:
+                metrics.RECONNECTS.inc(url=url)
+                # 切断中に発表された情報を履歴から補完する
+                self.schedule_backfill(session, disconnected_at)
+
+            try:
+                while True:
+                    msg = await ws.receive(timeout=self.idle_timeout)
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        if not received:
+                            # 受信できたので正常な接続とみなす
+                            received = True
+                            backoff.reset()
+                        # code と _id だけを先に読み取る
+                        self.on_frame(Frame(msg.data))
+
+                    elif msg.type in (
+                        aiohttp.WSMsgType.CLOSE,
+                        aiohttp.WSMsgType.CLOSING,
+                        aiohttp.WSMsgType.CLOSED,
+                        aiohttp.WSMsgType.ERROR,
+                    ):
+                        raise aiohttp.ClientConnectionError()
+
+            except asyncio.CancelledError:
+                # stop → Cancelled → 再接続しない
+                self.logger.info("listen_p2pquake task cancelled.")
+                break
+
+            except asyncio.TimeoutError:
+                # 無通信が続いた → 再接続する
+                self.logger.warning(
+                    f"No message for {self.idle_timeout} seconds {url}. Reconnecting..."
+                )
+
+            except Exception:
+                if not self.should_reconnect:
+                    break
+                self.logger.error(f"Unexpected error {url}. Reconnecting...")
+                self.logger.error(traceback.format_exc())
+
+            finally:
+                self.websockets.discard(ws)
+                metrics.CONNECTED.set(0, url=url)
+                await ws.close()
+
+            disconnected_at = datetime.now(JST).replace(tzinfo=None)
+            if loop.time() - connected_at >= self.stable_after:
+                backoff.reset()
+            if not self.should_reconnect:
+                break
+            wait_time = backoff.next_delay()
+            self.logger.warning(f"Reconnecting to {url} in {wait_time:.1f} seconds...")
+            await asyncio.sleep(wait_time)
+
+        self.logger.info(f"P2P WebSocket Disconnected {url}")
+
+    async def fetch_history(self, session, limit: int = 10) -> list[dict]:
+        params = [("codes", code) for code in CODES] + [("limit", limit)]
+        async with session.get(
+            self.history_url,
+            params=params,
+            proxy=os.environ.get("PROXY_URL"),
+        ) as response:
+            response.raise_for_status()
+            history = await response.json()
+
+        # 古いものから順に並べる
+        history.reverse()
+        for data in history:
+            data.setdefault("_id", data.get("id"))
+        return history
+
+    def schedule_backfill(self, session, since: datetime) -> None:
+        """
+        履歴からの補完を予約する（実行中の場合は終わってからまとめて補完する）
+        :param session:
+        :param since: 切断された時刻（日本時間）
+        :return:
+        """
+
+        if self.backfill_since is None or since < self.backfill_since:
+            self.backfill_since = since
+        if self.backfill_task is None or self.backfill_task.done():
+            self.backfill_task = asyncio.create_task(self.run_backfill(session))
+
+    async def run_backfill(self, session) -> None:
+        while self.backfill_since is not None:
+            since, self.backfill_since = self.backfill_since, None
+            await self.backfill(session, since)
+
+    async def backfill(self, session, since: datetime) -> None:
+        """
+        切断されていた間の情報を履歴APIから取得して配信する
+        :param session:
+        :param since: 切断された時刻（日本時間）
+        :return:
+        """
+
+        try:
+            history = await self.fetch_history(session, limit=50)
+        except Exception:
+            self.logger.error("Failed to backfill P2P history:")
+            self.logger.error(traceback.format_exc())
+            return
+
+        # 時計のずれを考慮して少し前から補完する
+        since -= timedelta(seconds=60)
+        for data in history:
+            if parse_time(data["time"]) >= since:
+                self.on_event(data)
+
+    async def poll_history(self, session):
+        """WebSocketが切断されている間の取りこぼしを防ぐためにHTTP APIを定期的に取得する"""
+
+        first = True
+        while self.should_reconnect:
+            try:
+                for data in await self.fetch_history(session):
+                    if first:
+                        # 起動前の情報は配信しない
+                        self.dedup.check_and_add(data["_id"])
+                    else:
+                        self.on_event(data)
+                first = False
+
+            except asyncio.CancelledError:
+                break
+
+            except Exception:
+                self.logger.error("Failed to poll P2P history:")
+                self.logger.error(traceback.format_exc())
+
+            await asyncio.sleep(self.poll_interval)
+
+    def on_frame(self, frame: Frame) -> None:
+        received_at = asyncio.get_running_loop().time()
+        metrics.FRAMES_RECEIVED.inc(code=frame.code)
+
+        # 配信しない code は本体をパースせずに捨てる
+        if frame.code not in CODES:
+            return
+
+        # 重複除外（複数の接続のうち先に届いたものだけを配信する）
+        if self.dedup.check_and_add(frame.data_id):
+            metrics.DEDUP_HITS.inc()
+            return
+
+        data = frame.parse()
+        metrics.PARSE_SECONDS.observe(frame.parse_time)
+        self.logger.debug(
+            f"Parsed code {frame.code} in {frame.parse_time * 1000:.2f}ms"
+        )
+        self.handler(data, received_at, frame.raw)
+
+    def on_event(self, data: dict) -> None:
+        if data.get("code") not in CODES:
+            return
+
+        if self.dedup.check_and_add(data.get("_id")):
+            metrics.DEDUP_HITS.inc()
+            return
+
+        self.handler(data, asyncio.get_running_loop().time(), None)
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import traceback
+from collections.abc import Callable
+
+from utils.backoff import Backoff
+
+# 4バイトの長さ + 本文(UTF-8のJSON)
+HEADER_SIZE = 4
+
+
+class EventServer:
+    """
+    受信した情報をUnixドメインソケットで各シャードのプロセスへ配る
+    """
+
+    def __init__(self, path: str, max_buffer: int = 4 * 1024 * 1024):
+        self.path = path
+        # 書き込みが溜まりすぎた（読み取りが止まっている）接続は切断する
+        self.max_buffer = max_buffer
+        self.logger = logging.getLogger("ipc")
+        self.server: asyncio.AbstractServer | None = None
+        self.clients: set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            # 前回異常終了した場合のソケットファイルが残っている
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self.on_connect, path=self.path)
+        self.logger.info(f"IPC server listening on {self.path}")
+
+    async def stop(self) -> None:
+        for writer in list(self.clients):
+            writer.close()
+        self.clients.clear()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def on_connect(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.clients.add(writer)
+        self.logger.info(f"IPC client connected ({len(self.clients)} clients)")
+        try:
+            # クライアントからは送信しないので切断されるまで待つ
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+            self.logger.info(f"IPC client disconnected ({len(self.clients)} clients)")
+
+    def broadcast(self, raw: str) -> None:
+        """
+        全てのクライアントへ送信する
+        :param raw: 受信したJSON文字列
+        :return:
+        """
+
+        payload = raw.encode()
+        message = len(payload).to_bytes(HEADER_SIZE, "big") + payload
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.logger.warning("IPC client is not reading. Disconnecting...")
+                self.clients.discard(writer)
+                writer.close()
+                continue
+            writer.write(message)
+
+
+class EventClient:
+    """
+    取り込みプロセスから配られた情報を受け取る
+    """
+
+    def __init__(self, path: str, handler: Callable[[str], None]):
+        self.path = path
+        self.handler = handler
+        self.logger = logging.getLogger("ipc")
+        self.backoff_base = 0.1  # 再接続の最初の待機秒数
+        self.backoff_cap = 5  # 再接続の最大待機秒数
+        self.task = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self) -> None:
+        backoff = Backoff(self.backoff_base, self.backoff_cap)
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (ConnectionError, FileNotFoundError):
+                wait_time = backoff.next_delay()
+                self.logger.warning(
+                    f"IPC server {self.path} is not available. Retrying in {wait_time:.1f} seconds..."
+                )
+                await asyncio.sleep(wait_time)
+                continue
+
+            self.logger.info(f"IPC Connected {self.path}")
+            backoff.reset()
+            try:
+                while True:
+                    header = await reader.readexactly(HEADER_SIZE)
+                    payload = await reader.readexactly(int.from_bytes(header, "big"))
+                    try:
+                        self.handler(payload.decode())
+                    except Exception:
+                        self.logger.error("Failed to handle IPC message:")
+                        self.logger.error(traceback.format_exc())
+
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.logger.warning(f"IPC Disconnected {self.path}. Reconnecting...")
+
+            finally:
+                writer.close()
@@ -0,0 +1,227 @@
+import logging
+import math
+from bisect import bisect_left
+from collections.abc import Callable
+
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PARSE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{escape_label(value)}"' for name, value in zip(names, values)
+        )
+        + "}"
+    )
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(
+        self, name: str, description: str, labels: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.description}",
+                f"# TYPE {self.name} {self.type}",
+                *self.samples(),
+            ]
+        )
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.values: dict[tuple, float] = {}
+        self.callback: Callable[[], float | dict[tuple, float] | None] | None = None
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set_function(
+        self, callback: Callable[[], float | dict[tuple, float] | None] | None
+    ) -> None:
+        """
+        取得時に値を計算する
+        :param callback: ラベル無しの場合は値、ラベル付きの場合は ラベルの値のタプル → 値 を返す（Noneで解除）
+        :return:
+        """
+
+        self.callback = callback
+
+    def samples(self) -> list[str]:
+        values = self.values
+        if self.callback is not None:
+            value = self.callback()
+            if not self.label_names:
+                return [] if value is None else [f"{self.name} {format_value(value)}"]
+            values = value or {}
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # ラベル → (各バケットの件数, 合計, 件数)
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            entry[0][index] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(
+                    (*self.label_names, "le"), (*key, format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels((*self.label_names, "le"), (*key, "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+FRAMES_RECEIVED = Counter(
+    "p2pquake_frames_received_total", "受信したメッセージ数", ("code",)
+)
+PARSE_SECONDS = Histogram(
+    "p2pquake_parse_seconds", "メッセージのパースにかかった秒数", buckets=PARSE_BUCKETS
+)
+DEDUP_HITS = Counter("p2pquake_dedup_hits_total", "重複として捨てたメッセージ数")
+DELIVERY_SECONDS = Histogram(
+    "p2pquake_delivery_seconds", "受信からDiscordへの送信完了までの秒数", ("handler",)
+)
+SEND_FAILURES = Counter("discord_send_failures_total", "Discordへの送信に失敗した回数")
+WEBHOOK_RATE_LIMITED = Counter(
+    "discord_webhook_rate_limited_total", "Webhookへの送信がレートリミットに達した回数"
+)
+DIGEST_TOKENS = Gauge(
+    "discord_digest_tokens",
+    "通知先ごとのすぐに通知できる残り回数（0の間は小さな地震をまとめる）",
+    ("channel",),
+)
+DIGESTED_EVENTS = Counter(
+    "discord_digested_events_total", "まとめて通知に回した地震情報の数", ("channel",)
+)
+RECONNECTS = Counter("p2pquake_reconnects_total", "WebSocketに再接続した回数", ("url",))
+CONNECTED = Gauge("p2pquake_connected", "WebSocketに接続しているか(1=接続中)", ("url",))
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds", "イベントループが予定より遅れて動いた秒数"
+)
+LOOP_BLOCKED = Counter(
+    "bot_event_loop_blocked_total", "イベントループがしきい値以上止まった回数"
+)
+GATEWAY_LATENCY = Gauge(
+    "discord_gateway_latency_seconds", "Discord Gatewayのレイテンシ"
+)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class MetricsServer:
+    """
+    Prometheus形式でメトリクスを公開するHTTPサーバー
+    Botと同じイベントループで動く
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100):
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger("metrics")
+        self.runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=render().encode(),
+            content_type="text/plain; version=0.0.4",
+            charset="utf-8",
+        )
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.logger.info(f"Metrics server listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,219 @@
+import asyncio
+import linecache
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+
+from utils import metrics
+
+
+class LoopMonitor:
+    """
+    イベントループの遅れを定期的に計測する
+    `threshold`秒以上止まっている間は別スレッドからループのスタックを取得してログに出す
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self.logger = logging.getLogger("loop_monitor")
+        self.loop_thread: int | None = None
+        # 最後にループが動いた時刻（time.monotonic()）
+        self.heartbeat = time.monotonic()
+        # スタックを出した止まり（heartbeat）を覚えて同じ止まりを何度も出さない
+        self.reported: float | None = None
+        self.stopping = threading.Event()
+        self.task = None
+        self.watchdog = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self) -> None:
+        if not self.enabled or self.task is not None:
+            return
+
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopping.clear()
+        self.task = asyncio.create_task(self.run())
+        self.watchdog = threading.Thread(
+            target=self.watch, name="loop-watchdog", daemon=True
+        )
+        self.watchdog.start()
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        self.stopping.set()
+        await asyncio.to_thread(self.watchdog.join)
+        self.watchdog = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+
+            blocked_since, self.heartbeat = self.heartbeat, time.monotonic()
+            if lag >= self.threshold:
+                metrics.LOOP_BLOCKED.inc()
+                # 止まっている間のスタックはwatchdogが出している
+                stack_note = " (stack logged)" if self.reported == blocked_since else ""
+                self.logger.warning(
+                    f"Event loop was blocked for {lag * 1000:.0f}ms{stack_note}"
+                )
+
+    def watch(self) -> None:
+        while not self.stopping.wait(self.interval):
+            heartbeat = self.heartbeat
+            if heartbeat == self.reported:
+                continue
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold:
+                continue
+
+            self.reported = heartbeat
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            self.logger.warning(
+                f"Event loop has been blocked for {blocked * 1000:.0f}ms:\n{stack}"
+            )
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(os.getcwd() + os.sep):
+        filename = os.path.relpath(filename)
+    else:
+        filename = os.sep.join(filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(
+    thread_id: int, seconds: float, interval: float = 0.005
+) -> Counter[tuple[str, ...]]:
+    """
+    指定したスレッドのスタックを一定間隔で取得する（別スレッドから呼ぶ）
+    :param thread_id: 計測するスレッド（イベントループのスレッド）
+    :param seconds: 計測する秒数
+    :param interval: 取得する間隔（秒）
+    :return: 根元から先端までの関数名 → 回数
+    """
+
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame_label(frame))
+            frame = frame.f_back
+        if stack:
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def is_idle(stack: tuple[str, ...]) -> bool:
+    # 受信待ち（selectorsのselect）で止まっている
+    return stack[-1].startswith("select (") and "selectors.py" in stack[-1]
+
+
+def format_profile(
+    stacks: Counter[tuple[str, ...]], seconds: float, limit: int = 30
+) -> tuple[str, str]:
+    """
+    取得したスタックを集計する
+    :param stacks:
+    :param seconds: 計測した秒数
+    :param limit: 表示する関数の数
+    :return: (関数ごとの集計, flamegraph.pl・speedscope向けのfolded形式)
+    """
+
+    total = sum(stacks.values())
+    idle = sum(count for stack, count in stacks.items() if is_idle(stack))
+    own = Counter()
+    cumulative = Counter()
+    for stack, count in stacks.items():
+        if is_idle(stack):
+            continue
+        own[stack[-1]] += count
+        # 再帰している関数は1回だけ数える
+        for label in set(stack):
+            cumulative[label] += count
+
+    busy = total - idle
+    lines = [
+        f"Sampled {total} stacks in {seconds:.1f}s",
+        f"Idle: {idle / total * 100 if total else 0:.1f}%"
+        f"  Busy: {busy / total * 100 if total else 0:.1f}%",
+        "",
+        "[self]",
+    ]
+    for label, count in own.most_common(limit):
+        lines.append(f"{count:8d} {count / busy * 100:6.1f}%  {label}")
+    lines.extend(("", "[cumulative]"))
+    for label, count in cumulative.most_common(limit):
+        lines.append(f"{count:8d} {count / busy * 100:6.1f}%  {label}")
+
+    folded = "\n".join(
+        f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()
+    )
+    return "\n".join(lines) + "\n", folded + "\n"
+
+
+def format_memory(
+    snapshot: tracemalloc.Snapshot, limit: int = 25, title: str = ""
+) -> str:
+    """
+    確保したまま残っているメモリを行ごとに集計する
+    :param snapshot:
+    :param limit: 表示する行数
+    :param title: 先頭に付ける説明
+    :return:
+    """
+
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+    )
+    stats = snapshot.statistics("lineno")
+    total = sum(stat.size for stat in stats)
+
+    lines = [title, f"Total: {total / 1024:.1f} KiB in {len(stats)} lines", ""]
+    for i, stat in enumerate(stats[:limit], 1):
+        frame = stat.traceback[0]
+        lines.append(
+            f"#{i} {frame.filename}:{frame.lineno}"
+            f" {stat.size / 1024:.1f} KiB ({stat.count} blocks)"
+        )
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        if source:
+            lines.append(f"    {source}")
+
+    rest = stats[limit:]
+    if rest:
+        lines.append(
+            f"\n{len(rest)} other: {sum(stat.size for stat in rest) / 1024:.1f} KiB"
+        )
+    return "\n".join(lines) + "\n"
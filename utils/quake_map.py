@@ -0,0 +1,360 @@
+import asyncio
+import io
+import json
+import logging
+import math
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # 描画プロセスではdiscord.pyなどを読み込まない
+    from utils.events import QuakeEvent, TunamiEvent
+
+try:
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    AVAILABLE = True
+except ImportError:  # pragma: no cover
+    AVAILABLE = False
+
+# 都道府県の境界（経度, 緯度の多角形、tools/build_prefectures.pyで作る）
+SHAPES_PATH = os.path.join(os.path.dirname(__file__), "prefectures.json")
+
+
+def load_shapes() -> dict[str, list[list[float]]]:
+    with open(SHAPES_PATH, encoding="utf-8") as f:
+        return json.load(f)["prefectures"]
+
+
+PREFECTURES = load_shapes()
+PREFECTURE_INDEX = {name: i for i, name in enumerate(PREFECTURES)}
+
+# 都道府県名を含まない津波予報区 → 都道府県
+TUNAMI_AREA_PREFECTURES = {
+    "オホーツク海沿岸": "北海道",
+    "陸奥湾": "青森県",
+    "佐渡": "新潟県",
+    "東京湾内湾": "東京都",
+    "伊豆諸島": "東京都",
+    "小笠原諸島": "東京都",
+    "相模湾・三浦半島": "神奈川県",
+    "伊勢・三河湾": "愛知県",
+    "淡路島南部": "兵庫県",
+    "隠岐": "島根県",
+    "壱岐・対馬": "長崎県",
+    "有明・八代海": "熊本県",
+    "種子島・屋久島地方": "鹿児島県",
+    "奄美群島・トカラ列島": "鹿児島県",
+    "沖縄本島地方": "沖縄県",
+    "大東島地方": "沖縄県",
+    "宮古島・八重山地方": "沖縄県",
+}
+
+# 震度 → 色
+SCALE_COLORS = {
+    10: (242, 242, 255),
+    20: (0, 170, 255),
+    30: (0, 65, 255),
+    40: (250, 230, 150),
+    45: (255, 230, 0),
+    46: (255, 230, 0),
+    50: (255, 153, 0),
+    55: (255, 40, 0),
+    60: (165, 0, 33),
+    70: (180, 0, 104),
+}
+SCALE_LABELS = {
+    10: "1",
+    20: "2",
+    30: "3",
+    40: "4",
+    45: "5-",
+    50: "5+",
+    55: "6-",
+    60: "6+",
+    70: "7",
+}
+
+# 津波予報の種類 → (大きさの順位, 色)
+TUNAMI_GRADES = {
+    "Unknown": (1, (160, 160, 160)),
+    "Watch": (2, (250, 245, 0)),
+    "Warning": (3, (255, 40, 0)),
+    "MajorWarning": (4, (200, 0, 255)),
+}
+TUNAMI_LABELS = {2: "Watch", 3: "Warning", 4: "Major"}
+
+# 描画範囲（経度・緯度）と画像の大きさ
+BOUNDS = (127.0, 146.5, 25.5, 46.0)
+WIDTH = 640
+BACKGROUND = (24, 28, 40)
+LAND = (70, 76, 90)
+BORDER = (130, 136, 150)
+
+# ワーカープロセスごとに一度だけ読み込む
+_labels = None
+_borders = None
+
+
+def aspect() -> float:
+    west, east, south, north = BOUNDS
+    # 中心の緯度で経度方向を縮める（正距円筒図法）
+    return (north - south) / ((east - west) * math.cos(math.radians(35)))
+
+
+def height() -> int:
+    return int(WIDTH * aspect())
+
+
+def project(lat: float, lon: float) -> tuple[float, float]:
+    west, east, south, north = BOUNDS
+    return (
+        (lon - west) / (east - west) * WIDTH,
+        (north - lat) / (north - south) * height(),
+    )
+
+
+def build_labels() -> "np.ndarray":
+    """
+    画素ごとに都道府県の番号（海は-1）を求める
+    :return:
+    """
+
+    # 番号+1で塗り、0を海として残す
+    image = Image.new("L", (WIDTH, height()), 0)
+    draw = ImageDraw.Draw(image)
+    for i, polygon in enumerate(PREFECTURES.values()):
+        draw.polygon([project(lat, lon) for lon, lat in polygon], fill=i + 1)
+    return np.asarray(image, dtype=np.int8) - 1
+
+
+def find_borders(labels: "np.ndarray") -> "np.ndarray":
+    """
+    隣の画素と都道府県が異なる画素（境界線・海岸線）
+    :param labels:
+    :return:
+    """
+
+    borders = np.zeros(labels.shape, dtype=bool)
+    borders[:, 1:] |= labels[:, 1:] != labels[:, :-1]
+    borders[1:, :] |= labels[1:, :] != labels[:-1, :]
+    return borders
+
+
+def load_labels(path: str) -> tuple["np.ndarray", "np.ndarray"]:
+    """
+    事前に計算した領域を読み込む（無いか境界より古ければ計算して保存する）
+    複数のプロセスでページを共有できるようにメモリマップで開く
+    :param path:
+    :return: (都道府県の番号, 境界)
+    """
+
+    global _labels, _borders
+    if _labels is not None:
+        return _labels, _borders
+
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(SHAPES_PATH):
+            raise ValueError("outdated")
+        labels = np.load(path, mmap_mode="r")
+        if labels.shape != (height(), WIDTH):
+            raise ValueError("shape mismatch")
+    except (FileNotFoundError, ValueError):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.npy"
+        np.save(tmp_path, build_labels())
+        os.replace(tmp_path, path)
+        labels = np.load(path, mmap_mode="r")
+
+    _labels = labels
+    _borders = find_borders(labels)
+    return _labels, _borders
+
+
+def render(
+    cache_path: str,
+    regions: list[tuple[str, int]],
+    colors: dict[int, tuple[int, int, int]],
+    legend: dict[int, str],
+    hypocenter: tuple[float, float] | None = None,
+) -> bytes:
+    """
+    都道府県ごとに色分けした地図をPNGで返す（ワーカープロセスで実行する）
+    :param cache_path: 領域のキャッシュのパス
+    :param regions: (都道府県, 値)
+    :param colors: 値 → 色
+    :param legend: 凡例に表示する値 → ラベル
+    :param hypocenter: 震源（緯度, 経度）
+    :return:
+    """
+
+    labels, borders = load_labels(cache_path)
+
+    # 都道府県ごとの最大値
+    values = np.full(len(PREFECTURES), -1, dtype=np.int16)
+    if regions:
+        indexes = np.array([PREFECTURE_INDEX[pref] for pref, _ in regions])
+        np.maximum.at(
+            values, indexes, np.array([value for _, value in regions], dtype=np.int16)
+        )
+
+    # 都道府県の番号 → 色 の表を作り、画素ごとに引く
+    palette = np.empty((len(PREFECTURES) + 1, 3), dtype=np.uint8)
+    palette[:] = LAND
+    for i, value in enumerate(values):
+        if value in colors:
+            palette[i] = colors[value]
+    palette[-1] = BACKGROUND  # labels == -1
+    pixels = palette[labels]
+    pixels[borders] = BORDER
+    image = Image.fromarray(pixels, "RGB")
+
+    draw = ImageDraw.Draw(image)
+    if hypocenter is not None:
+        x, y = map(round, project(*hypocenter))
+        draw.line((x - 8, y - 8, x + 8, y + 8), fill=(255, 255, 255), width=4)
+        draw.line((x - 8, y + 8, x + 8, y - 8), fill=(255, 255, 255), width=4)
+
+    # 凡例
+    for i, (value, label) in enumerate(legend.items()):
+        top = 10 + i * 20
+        draw.rectangle((10, top, 26, top + 16), fill=colors[value])
+        draw.text((32, top + 2), label, fill=(255, 255, 255))
+
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", optimize=False)
+    return buffer.getvalue()
+
+
+def tunami_area_prefecture(name: str) -> str | None:
+    """
+    津波予報区の都道府県
+    :param name:
+    :return:
+    """
+
+    pref = TUNAMI_AREA_PREFECTURES.get(name)
+    if pref is not None:
+        return pref
+    for pref in PREFECTURES:
+        # 「青森県日本海沿岸」「北海道太平洋沿岸東部」など
+        if name.startswith(pref) or name.startswith(pref[:-1]):
+            return pref
+    return None
+
+
+def quake_regions(event: "QuakeEvent") -> tuple[list[tuple[str, int]], tuple | None]:
+    regions = [
+        (pref, scale)
+        for pref, _, scale in event.points
+        if pref in PREFECTURE_INDEX and scale in SCALE_COLORS
+    ]
+    hypocenter = event.hypocenter
+    return regions, (
+        (hypocenter.latitude, hypocenter.longitude) if hypocenter.located else None
+    )
+
+
+def tunami_regions(event: "TunamiEvent") -> list[tuple[str, int]]:
+    regions = []
+    for area in event.areas:
+        pref = tunami_area_prefecture(area.name)
+        grade = TUNAMI_GRADES.get(area.grade)
+        if pref is not None and grade is not None:
+            regions.append((pref, grade[0]))
+    return regions
+
+
+def _warm_up(cache_path: str) -> None:
+    load_labels(cache_path)
+
+
+class MapRenderer:
+    """
+    震度分布・津波予報の地図を別プロセスで描画する
+    描画中もイベントループ（緊急地震速報の配信）を止めない
+    """
+
+    def __init__(
+        self,
+        cache_path: str = "data/map_labels.npy",
+        workers: int = 1,
+        timeout: float = 5.0,
+    ):
+        self.cache_path = cache_path
+        self.workers = workers
+        self.timeout = timeout
+        self.logger = logging.getLogger("quake_map")
+        self.executor: ProcessPoolExecutor | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.executor is not None
+
+    def start(self) -> None:
+        if self.workers <= 0:
+            return
+        if not AVAILABLE:
+            self.logger.warning("numpy or Pillow is not installed. Map is disabled.")
+            return
+
+        # Botのスレッドやソケットを引き継がないようにforkではなくspawnで起動する
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up,
+            initargs=(self.cache_path,),
+        )
+        # プロセスは最初の描画まで起動されないので、最初の地図が遅れないように先に起動しておく
+        for _ in range(self.workers):
+            self.executor.submit(_warm_up, self.cache_path).add_done_callback(
+                self.on_warm_up
+            )
+
+    def on_warm_up(self, future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error(f"Failed to start map worker: {future.exception()!r}")
+
+    async def close(self) -> None:
+        if self.executor is not None:
+            await asyncio.to_thread(self.executor.shutdown, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, *args) -> bytes | None:
+        if self.executor is None:
+            return None
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(
+                    self.executor, render, self.cache_path, *args
+                ),
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Map rendering timed out ({self.timeout}s)")
+        except Exception:
+            self.logger.error("Failed to render map:")
+            self.logger.error(traceback.format_exc())
+        return None
+
+    async def render_quake(self, event: "QuakeEvent") -> bytes | None:
+        regions, hypocenter = quake_regions(event)
+        if not regions:
+            return None
+        return await self.run(regions, SCALE_COLORS, SCALE_LABELS, hypocenter)
+
+    async def render_tunami(self, event: "TunamiEvent") -> bytes | None:
+        regions = tunami_regions(event)
+        if not regions:
+            return None
+        return await self.run(
+            regions,
+            {rank: color for rank, color in TUNAMI_GRADES.values()},
+            TUNAMI_LABELS,
+        )
@@ -0,0 +1,80 @@
+import asyncio
+import heapq
+import itertools
+from contextvars import ContextVar
+
+# 送信中のタスクが急ぎ（緊急地震速報など）かどうか
+# TextChannelと同じ呼び出し方のWebhook送信まで引数を通さずに伝える
+urgent_delivery: ContextVar[bool] = ContextVar("urgent_delivery", default=False)
+
+
+class RouteBucket:
+    """
+    Discordのルート(チャンネル)単位のレートリミットを追跡する
+    メッセージ送信は1チャンネルあたり5秒に5回まで
+    待っている送信は急ぎのものから順に、同じ優先度なら来た順に送る
+    """
+
+    def __init__(self, limit: int = 5, per: float = 5.0):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+        # (優先度, 順番, 送信を待つFuture)
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+        self.timer: asyncio.TimerHandle | None = None
+
+    def take(self) -> bool:
+        now = asyncio.get_running_loop().time()
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+    def wake(self) -> None:
+        """
+        送信できる分だけ待っている送信を優先度順に進める
+        :return:
+        """
+
+        self.timer = None
+        while self.waiters:
+            if self.waiters[0][2].done():
+                # 待っている間にキャンセルされた
+                heapq.heappop(self.waiters)
+                continue
+            if not self.take():
+                break
+            heapq.heappop(self.waiters)[2].set_result(None)
+
+        if self.waiters and self.timer is None:
+            self.timer = asyncio.get_running_loop().call_at(self.reset_at, self.wake)
+
+    async def acquire(self, urgent: bool | None = None) -> None:
+        """
+        送信できるまで待つ
+        :param urgent: 先に待っている急ぎでない送信を追い越す（省略時は`urgent_delivery`）
+        :return:
+        """
+
+        if urgent is None:
+            urgent = urgent_delivery.get()
+        if not self.waiters and self.take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (0 if urgent else 1, next(self.counter), future))
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_at(self.reset_at, self.wake)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 順番が来た直後にキャンセルされた → 次の送信に回す
+                self.remaining = min(self.limit, self.remaining + 1)
+                self.wake()
+            raise
@@ -0,0 +1,129 @@
+import asyncio
+import itertools
+import logging
+import traceback
+from collections import deque
+from collections.abc import Awaitable, Callable
+
+from utils import metrics
+from utils.events import EEWEvent, Event, TunamiEvent
+
+# 値が小さいほど優先して配信する
+PRIORITY_URGENT = 0  # 緊急地震速報・大津波警報
+PRIORITY_HIGH = 1  # 津波予報
+PRIORITY_NORMAL = 2  # 地震情報
+
+# メトリクスのラベル
+HANDLER_NAMES = {551: "quake", 552: "tunami", 556: "eew"}
+
+
+def get_priority(event: Event) -> int:
+    """
+    受信した情報の配信優先度を決める
+    :param event:
+    :return:
+    """
+
+    match event:
+        case EEWEvent():
+            return PRIORITY_URGENT
+        case TunamiEvent():
+            if any(area.grade == "MajorWarning" for area in event.areas):
+                return PRIORITY_URGENT
+            return PRIORITY_HIGH
+        case _:
+            return PRIORITY_NORMAL
+
+
+class PriorityScheduler:
+    """
+    受信ループと配信処理を切り離し、優先度の高い情報から配信する
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Event], Awaitable[None]],
+        workers: int = 4,
+        latency_history: int = 100,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.logger = logging.getLogger("scheduler")
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.counter = itertools.count()
+        self.tasks: list[asyncio.Task] = []
+        # code → 直近の enqueue→送信完了 までの秒数
+        self.latencies: dict[int, deque[float]] = {}
+        self.latency_history = latency_history
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            self.tasks.append(asyncio.create_task(self.worker()))
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+
+    async def shutdown(self, timeout: float = 10.0) -> list[tuple[Event, float]]:
+        """
+        配信中の情報が終わるまで待って止め、まだ配信していない情報を返す
+        :param timeout: 配信中の情報を待つ最大の秒数
+        :return: (event, 受信した時刻) の優先度順の一覧
+        """
+
+        remaining = []
+        while not self.queue.empty():
+            _, _, received_at, event = self.queue.get_nowait()
+            self.queue.task_done()
+            remaining.append((event, received_at))
+
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Delivery did not finish within {timeout}s")
+        await self.stop()
+        return remaining
+
+    def enqueue(self, event: Event, received_at: float | None = None) -> None:
+        """
+        配信待ちに追加する
+        :param event:
+        :param received_at: 受信した時刻（loop.time()、省略時は現在時刻）
+        :return:
+        """
+
+        if received_at is None:
+            received_at = asyncio.get_running_loop().time()
+        # 同じ優先度の中では到着順に配信する
+        self.queue.put_nowait(
+            (get_priority(event), next(self.counter), received_at, event)
+        )
+
+    def record_latency(self, code: int, latency: float) -> None:
+        history = self.latencies.get(code)
+        if history is None:
+            history = self.latencies[code] = deque(maxlen=self.latency_history)
+        history.append(latency)
+        metrics.DELIVERY_SECONDS.observe(
+            latency, handler=HANDLER_NAMES.get(code, str(code))
+        )
+
+    async def worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, enqueued_at, event = await self.queue.get()
+            try:
+                await self.handler(event)
+            except Exception:
+                self.logger.error("Failed to deliver message:")
+                self.logger.error(traceback.format_exc())
+            finally:
+                self.queue.task_done()
+
+            latency = loop.time() - enqueued_at
+            self.record_latency(event.code, latency)
+            self.logger.info(
+                f"Delivered code {event.code} (priority {priority}) in {latency * 1000:.1f}ms"
+            )
@@ -0,0 +1,211 @@
+import os
+from bisect import bisect_right
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+# 地方名 → 都道府県
+REGIONS = {
+    "北海道": ("北海道",),
+    "東北": ("青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県"),
+    "関東": ("茨城県", "栃木県", "群馬県", "埼玉県", "千葉県", "東京都", "神奈川県"),
+    "中部": (
+        "新潟県",
+        "富山県",
+        "石川県",
+        "福井県",
+        "山梨県",
+        "長野県",
+        "岐阜県",
+        "静岡県",
+        "愛知県",
+    ),
+    "近畿": ("三重県", "滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県"),
+    "中国": ("鳥取県", "島根県", "岡山県", "広島県", "山口県"),
+    "四国": ("徳島県", "香川県", "愛媛県", "高知県"),
+    "九州": (
+        "福岡県",
+        "佐賀県",
+        "長崎県",
+        "熊本県",
+        "大分県",
+        "宮崎県",
+        "鹿児島県",
+        "沖縄県",
+    ),
+}
+
+
+def expand_regions(names: Iterable[str]) -> frozenset[str]:
+    """
+    地方名を都道府県に展開する（都道府県名・観測点名・予報区名はそのまま）
+    :param names:
+    :return:
+    """
+
+    expanded = set()
+    for name in names:
+        name = name.strip()
+        if name:
+            expanded.update(REGIONS.get(name, (name,)))
+    return frozenset(expanded)
+
+
+@dataclass(frozen=True)
+class Subscription:
+    """
+    通知先のチャンネルとメンションするロール
+    """
+
+    guild_id: int | None
+    channel_id: int
+    role_id: int | None = None
+    # この震度以上の場合のみ通知する（Noneは全て）
+    min_scale: int | None = None
+    # 都道府県・観測点・予報区のいずれかで観測された場合のみ通知する（空は全国）
+    regions: frozenset[str] = field(default_factory=frozenset)
+    # 指定した場合はチャンネルではなくWebhookで送信する
+    webhook_url: str | None = None
+    # 緊急地震速報で予想震度・S波の到達までの秒数を求める地点
+    latitude: float | None = None
+    longitude: float | None = None
+
+    @property
+    def mention(self) -> str | None:
+        return f"<@&{self.role_id}>" if self.role_id else None
+
+    def to_dict(self) -> dict:
+        return {
+            "guild_id": self.guild_id,
+            "channel_id": self.channel_id,
+            "role_id": self.role_id,
+            "min_scale": self.min_scale,
+            "regions": sorted(self.regions),
+            "webhook_url": self.webhook_url,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Subscription":
+        return cls(
+            guild_id=data.get("guild_id"),
+            channel_id=int(data["channel_id"]),
+            role_id=data.get("role_id"),
+            min_scale=data.get("min_scale"),
+            regions=expand_regions(data.get("regions") or ()),
+            webhook_url=data.get("webhook_url"),
+            latitude=data.get("latitude"),
+            longitude=data.get("longitude"),
+        )
+
+
+class SubscriptionIndex:
+    """
+    地域 → 通知先の転置索引
+    1つの情報あたり O(観測点数 + 一致した通知先数) で通知先を決める
+    """
+
+    def __init__(self, subscriptions: Iterable[Subscription]):
+        self.subscriptions = list(subscriptions)
+        # 震度の下限の昇順に並べ、観測された最大震度以下の範囲だけを取り出す
+        self.nationwide: list[tuple[int, int, Subscription]] = []
+        self.by_region: dict[str, list[tuple[int, int, Subscription]]] = {}
+
+        for i, subscription in enumerate(self.subscriptions):
+            entry = (
+                subscription.min_scale if subscription.min_scale is not None else -1,
+                i,
+                subscription,
+            )
+            if subscription.regions:
+                for region in subscription.regions:
+                    self.by_region.setdefault(region, []).append(entry)
+            else:
+                self.nationwide.append(entry)
+
+        self.nationwide.sort()
+        self.nationwide_scales = [entry[0] for entry in self.nationwide]
+        for entries in self.by_region.values():
+            entries.sort()
+        self.region_scales = {
+            region: [entry[0] for entry in entries]
+            for region, entries in self.by_region.items()
+        }
+        # 絞り込みの無い通知先しか無い場合は観測点を見る必要が無い
+        self.unfiltered = not self.by_region and all(
+            entry[0] == -1 for entry in self.nationwide
+        )
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+    def match(
+        self, max_scale: int, points: Iterable[tuple[str, str, int]] = ()
+    ) -> list[Subscription]:
+        """
+        通知する通知先を返す
+        :param max_scale: 最大震度
+        :param points: (都道府県, 観測点名・予報区名, 震度)
+        :return:
+        """
+
+        if self.unfiltered:
+            return self.subscriptions
+
+        matched = {
+            entry[1]: entry[2]
+            for entry in self.nationwide[
+                : bisect_right(self.nationwide_scales, max_scale)
+            ]
+        }
+
+        if self.by_region:
+            # 地域ごとの最大震度を一度の走査で求める
+            region_max: dict[str, int] = {}
+            for pref, name, scale in points:
+                for region in (pref, name):
+                    if region in self.by_region and scale > region_max.get(region, -2):
+                        region_max[region] = scale
+
+            for region, scale in region_max.items():
+                entries = self.by_region[region]
+                for entry in entries[: bisect_right(self.region_scales[region], scale)]:
+                    matched[entry[1]] = entry[2]
+
+        return list(matched.values())
+
+
+def _split_ids(value: str | None) -> list[int]:
+    if not value:
+        return []
+
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def load_env_subscriptions(prefix: str) -> list[Subscription]:
+    """
+    環境変数から通知先を読み込む
+    `{prefix}_CHANNEL_ID`と`{prefix}_ROLE_ID`、`{prefix}_MIN_SCALE`はカンマ区切りで複数指定でき、同じ順番で対応させる
+    `{prefix}_REGIONS`は通知先ごとに`;`で区切り、1つの通知先の中ではカンマで区切る（例: `関東;石川県,富山県`）
+    :param prefix: QUAKE_NOTICE, TUNAMI_NOTICE, EEW_NOTICE のいずれか
+    :return:
+    """
+
+    guild_id = os.environ.get("GUILD_ID")
+    channel_ids = _split_ids(os.environ.get(f"{prefix}_CHANNEL_ID"))
+    role_ids = _split_ids(os.environ.get(f"{prefix}_ROLE_ID"))
+    min_scales = _split_ids(os.environ.get(f"{prefix}_MIN_SCALE"))
+    regions = os.environ.get(f"{prefix}_REGIONS", "").split(";")
+
+    return [
+        Subscription(
+            guild_id=int(guild_id) if guild_id else None,
+            channel_id=channel_id,
+            role_id=role_ids[i] if i < len(role_ids) else None,
+            min_scale=min_scales[i] if i < len(min_scales) else None,
+            regions=expand_regions(regions[i].split(","))
+            if i < len(regions)
+            else frozenset(),
+        )
+        for i, channel_id in enumerate(channel_ids)
+    ]
@@ -0,0 +1,277 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import traceback
+from collections.abc import Callable
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windowsでは複数プロセスで動かさない
+    fcntl = None
+
+from utils.subscription import (
+    Subscription,
+    SubscriptionIndex,
+    load_env_subscriptions,
+)
+
+# 種類 → 初回起動時に引き継ぐ環境変数のプレフィックス
+KINDS = {
+    "quake": "QUAKE_NOTICE",
+    "tunami": "TUNAMI_NOTICE",
+    "eew": "EEW_NOTICE",
+}
+
+
+class SubscriptionStore:
+    """
+    通知先の設定
+    起動時に一度だけ読み込んで索引としてメモリ上に持ち、変更はJSONファイルに保存する
+    ファイルが外部（他のプロセス）から書き換えられた場合は再読み込みする
+    変更はファイルをロックして読み直した内容に加えるので、他のプロセスの変更を上書きしない
+    """
+
+    def __init__(self, path: str, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.logger = logging.getLogger("subscriptions")
+        # 配信処理からは索引を読むだけで、更新時は索引ごと差し替える
+        self.indexes: dict[str, SubscriptionIndex] = {
+            kind: SubscriptionIndex(()) for kind in KINDS
+        }
+        self.lock = asyncio.Lock()
+        self.mtime: int | None = None
+        self.task = None
+        # 索引を差し替えた直後に呼ぶ処理（通知先から作る配列などを配信前に作り直す）
+        self.listeners: list[Callable[[], None]] = []
+
+    @property
+    def quake(self) -> SubscriptionIndex:
+        return self.indexes["quake"]
+
+    @property
+    def tunami(self) -> SubscriptionIndex:
+        return self.indexes["tunami"]
+
+    @property
+    def eew(self) -> SubscriptionIndex:
+        return self.indexes["eew"]
+
+    def _stat(self) -> int | None:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read(self) -> tuple[dict[str, list[Subscription]], int] | None:
+        mtime = self._stat()
+        if mtime is None:
+            return None
+
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        return {
+            kind: [Subscription.from_dict(item) for item in data.get(kind, ())]
+            for kind in KINDS
+        }, mtime
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # シャードのプロセス間で読み込み〜書き込みを1つずつ行う
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write(self, subscriptions: dict[str, list[Subscription]]) -> int:
+        # 書き込み途中のファイルを読み込まないように置き換える
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    kind: [subscription.to_dict() for subscription in items]
+                    for kind, items in subscriptions.items()
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp_path, self.path)
+        return os.stat(self.path).st_mtime_ns
+
+    def apply(self, subscriptions: dict[str, list[Subscription]]) -> None:
+        self.indexes = {
+            kind: SubscriptionIndex(subscriptions.get(kind, ())) for kind in KINDS
+        }
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception:
+                self.logger.error(traceback.format_exc())
+
+    def _read_or_create(self) -> tuple[dict[str, list[Subscription]], int]:
+        with self._file_lock():
+            loaded = self._read()
+            if loaded is not None:
+                return loaded
+
+            # 初回起動時は環境変数の設定を引き継ぐ（先に起動したプロセスだけが書き込む）
+            subscriptions = {
+                kind: load_env_subscriptions(prefix) for kind, prefix in KINDS.items()
+            }
+            mtime = self._write(subscriptions)
+            self.logger.info(f"Created {self.path} from environment variables")
+            return subscriptions, mtime
+
+    def _modify(
+        self, change: Callable[[dict[str, list[Subscription]]], bool]
+    ) -> tuple[dict[str, list[Subscription]], int, bool]:
+        with self._file_lock():
+            # 他のプロセスが書き込んだ最新の内容に変更を加える
+            loaded = self._read()
+            if loaded is None:
+                subscriptions, mtime = {kind: [] for kind in KINDS}, None
+            else:
+                subscriptions, mtime = loaded
+            changed = change(subscriptions)
+            if changed:
+                mtime = self._write(subscriptions)
+            return subscriptions, mtime, changed
+
+    async def load(self) -> None:
+        async with self.lock:
+            subscriptions, self.mtime = await asyncio.to_thread(self._read_or_create)
+            self.apply(subscriptions)
+
+        self.logger.info(
+            "Loaded subscriptions: "
+            + ", ".join(f"{kind}={len(index)}" for kind, index in self.indexes.items())
+        )
+
+    def start(self) -> None:
+        if self.reload_interval > 0:
+            self.task = asyncio.create_task(self.watch())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            mtime = await asyncio.to_thread(self._stat)
+            if mtime in (self.mtime, None):
+                continue
+
+            try:
+                async with self.lock:
+                    loaded = await asyncio.to_thread(self._read)
+                    if loaded is None:
+                        continue
+                    subscriptions, self.mtime = loaded
+                    self.apply(subscriptions)
+                self.logger.info(f"Reloaded {self.path}")
+
+            except Exception:
+                # 読み込めない場合は次に書き換えられるまで今の設定のまま動かす
+                self.mtime = mtime
+                self.logger.error(f"Failed to reload {self.path}:")
+                self.logger.error(traceback.format_exc())
+
+    async def modify(
+        self, change: Callable[[dict[str, list[Subscription]]], bool]
+    ) -> bool:
+        """
+        ファイルの最新の内容に変更を加えて保存する
+        :param change: 種類 → 通知先の一覧 を書き換え、変更したかを返す
+        :return: 変更したか
+        """
+
+        async with self.lock:
+            subscriptions, mtime, changed = await asyncio.to_thread(
+                self._modify, change
+            )
+            if mtime is not None:
+                self.mtime = mtime
+            self.apply(subscriptions)
+            return changed
+
+    async def add(self, kind: str, subscription: Subscription) -> Subscription | None:
+        """
+        通知先を追加する（同じチャンネルが登録されている場合は置き換える）
+        :param kind: quake, tunami, eew のいずれか
+        :param subscription:
+        :return: 置き換えた通知先
+        """
+
+        replaced = None
+
+        def change(subscriptions: dict[str, list[Subscription]]) -> bool:
+            nonlocal replaced
+            items = []
+            for item in subscriptions[kind]:
+                if item.channel_id == subscription.channel_id:
+                    replaced = item
+                else:
+                    items.append(item)
+            items.append(subscription)
+            subscriptions[kind] = items
+            return True
+
+        await self.modify(change)
+        return replaced
+
+    async def remove(self, kind: str, channel_id: int) -> Subscription | None:
+        """
+        通知先を削除する
+        :param kind: quake, tunami, eew のいずれか
+        :param channel_id:
+        :return: 削除した通知先（登録されていなければNone）
+        """
+
+        removed = None
+
+        def change(subscriptions: dict[str, list[Subscription]]) -> bool:
+            nonlocal removed
+            items = []
+            for item in subscriptions[kind]:
+                if item.channel_id == channel_id:
+                    removed = item
+                else:
+                    items.append(item)
+            subscriptions[kind] = items
+            return removed is not None
+
+        await self.modify(change)
+        return removed
+
+    def uses_webhook(self, webhook_url: str) -> bool:
+        """
+        いずれかの通知先がこのWebhookで送信しているか
+        :param webhook_url:
+        :return:
+        """
+
+        return any(
+            item.webhook_url == webhook_url
+            for index in self.indexes.values()
+            for item in index.subscriptions
+        )
+
+    def find(self, guild_id: int) -> dict[str, list[Subscription]]:
+        return {
+            kind: [item for item in index.subscriptions if item.guild_id == guild_id]
+            for kind, index in self.indexes.items()
+        }
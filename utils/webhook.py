@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import os
+import traceback
+
+import aiohttp
+import discord
+
+from utils import metrics
+from utils.backoff import Backoff
+from utils.ratelimit import RouteBucket
+
+API_BASE = "https://discord.com/api/v10"
+
+
+class WebhookError(discord.HTTPException):
+    """
+    Discordへ届かなかった、または応答を読めなかった
+    送信側では他の送信失敗と同じく`discord.HTTPException`として扱う
+    """
+
+    def __init__(self, error: Exception, status: int = 0, reason: str = ""):
+        self.response = None
+        self.status = status
+        self.code = 0
+        self.text = f"{type(error).__name__}: {error}"
+        self.original = error
+        Exception.__init__(self, f"{status} {reason or 'Transport error'}: {self.text}")
+
+
+class WebhookBucket(RouteBucket):
+    """
+    Webhook単位のレートリミット
+    残り回数とリセットまでの秒数はレスポンスヘッダーから更新する
+    ヘッダーで分かるまでは既定の制限で数える
+    """
+
+    def __init__(self, limit: int = 5, per: float = 2.0):
+        super().__init__(limit, per)
+
+    def update(self, headers) -> None:
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            # 送信中の他のリクエストの分は既に差し引いている
+            self.remaining = min(self.remaining, int(remaining))
+        if reset_after is not None:
+            self.reset_at = asyncio.get_running_loop().time() + float(reset_after)
+
+
+class WebhookMessage:
+    """
+    Webhookで送信したメッセージ（編集・削除のみ）
+    """
+
+    __slots__ = ("client", "url", "id")
+
+    def __init__(self, client: "WebhookClient", url: str, message_id: int):
+        self.client = client
+        self.url = url
+        self.id = message_id
+
+    async def edit(
+        self, content=None, embeds=None, attachments=None
+    ) -> "WebhookMessage":
+        # attachmentsを渡した場合は既存の添付ファイルを置き換える
+        await self.client.request(
+            "PATCH",
+            self.url,
+            f"/messages/{self.id}",
+            self.client.payload(content, embeds, attachments),
+            files=attachments,
+        )
+        return self
+
+    async def delete(self) -> None:
+        await self.client.request("DELETE", self.url, f"/messages/{self.id}")
+
+
+class WebhookTarget:
+    """
+    Webhookで送信する通知先
+    `TextChannel`と同じように`send`で送信したメッセージを編集・削除できる
+    """
+
+    __slots__ = ("client", "url")
+
+    def __init__(self, client: "WebhookClient", url: str):
+        self.client = client
+        self.url = url
+
+    async def send(self, content=None, embeds=None, files=None) -> WebhookMessage:
+        data = await self.client.request(
+            "POST",
+            self.url,
+            "",
+            self.client.payload(content, embeds, files),
+            params={"wait": "true"},
+            files=files,
+        )
+        return WebhookMessage(self.client, self.url, int(data["id"]))
+
+
+class WebhookClient:
+    """
+    Webhookへ直接送信するHTTPクライアント
+    専用の接続プールで接続を保ち続け、警報の送信時にTLSハンドシェイクを待たないようにする
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        keepalive_interval: float = 30.0,
+        max_retries: int = 3,
+    ):
+        self.limit = limit
+        self.keepalive_interval = keepalive_interval
+        self.max_retries = max_retries
+        self.logger = logging.getLogger("webhook")
+        self.session: aiohttp.ClientSession | None = None
+        self.buckets: dict[str, WebhookBucket] = {}
+        self.task = None
+
+    async def start(self) -> None:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit,
+            ttl_dns_cache=300,
+            # keep-aliveの間隔より長く接続を保持する
+            keepalive_timeout=self.keepalive_interval * 3,
+            enable_cleanup_closed=True,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=15),
+            json_serialize=json.dumps,
+        )
+        if self.keepalive_interval > 0:
+            self.task = asyncio.create_task(self.keepalive_loop())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def keepalive(self) -> None:
+        """
+        認証の要らないエンドポイントへリクエストし、接続を温めておく
+        :return:
+        """
+
+        try:
+            async with self.session.get(
+                f"{API_BASE}/gateway", proxy=os.environ.get("PROXY_URL")
+            ) as response:
+                await response.read()
+        except Exception:
+            self.logger.warning("Webhook keep-alive failed:")
+            self.logger.warning(traceback.format_exc())
+
+    async def keepalive_loop(self) -> None:
+        # 起動直後に接続しておき、最初の送信でTLSハンドシェイクを待たないようにする
+        while True:
+            await self.keepalive()
+            await asyncio.sleep(self.keepalive_interval)
+
+    def target(self, url: str) -> WebhookTarget:
+        return WebhookTarget(self, url)
+
+    def get_bucket(self, url: str) -> WebhookBucket:
+        bucket = self.buckets.get(url)
+        if bucket is None:
+            bucket = self.buckets[url] = WebhookBucket()
+        return bucket
+
+    @staticmethod
+    def payload(content, embeds, files=None) -> dict:
+        payload = {
+            "content": content,
+            "embeds": [embed.to_dict() for embed in embeds or ()],
+            "allowed_mentions": {"parse": ["roles"]},
+        }
+        if files is not None:
+            payload["attachments"] = [
+                {"id": i, "filename": file.filename} for i, file in enumerate(files)
+            ]
+        return payload
+
+    @staticmethod
+    def form(payload: dict, files: list[tuple[str, bytes]]) -> aiohttp.FormData:
+        """
+        添付ファイル付きのリクエストをmultipartで組み立てる
+        再送のたびに組み立て直す（FormDataは一度しか送信できない）
+        :param payload:
+        :param files: (ファイル名, 内容)
+        :return:
+        """
+
+        form = aiohttp.FormData()
+        form.add_field(
+            "payload_json", json.dumps(payload), content_type="application/json"
+        )
+        for i, (filename, content) in enumerate(files):
+            form.add_field(f"files[{i}]", content, filename=filename)
+        return form
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        path: str,
+        payload: dict | None = None,
+        params: dict | None = None,
+        files: list[discord.File] | None = None,
+    ) -> dict | None:
+        """
+        Webhookへリクエストする
+        レートリミットに達した場合は指定された秒数待って再送する
+        :param method:
+        :param url: Webhook URL
+        :param path: Webhook URLに続くパス
+        :param payload:
+        :param params:
+        :param files: 添付ファイル
+        :return:
+        """
+
+        contents = [(file.filename, file.fp.read()) for file in files or ()]
+        bucket = self.get_bucket(url)
+        backoff = Backoff(0.5, 5)
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            try:
+                async with self.session.request(
+                    method,
+                    url + path,
+                    json=None if contents else payload,
+                    data=self.form(payload, contents) if contents else None,
+                    params=params,
+                    proxy=os.environ.get("PROXY_URL"),
+                ) as response:
+                    bucket.update(response.headers)
+                    if response.status == 204:
+                        return None
+                    text = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # 送信済みかどうか分からないので再送はしない（同じ通知が2回届かないように）
+                raise WebhookError(e) from e
+
+            try:
+                data = json.loads(text)
+            except ValueError as e:
+                if response.status < 400:
+                    raise WebhookError(e, response.status, response.reason) from e
+                # 5xxではHTMLのエラーページが返ることがある
+                data = text[:200]
+
+            if response.status == 429:
+                metrics.WEBHOOK_RATE_LIMITED.inc()
+                retry_after = (
+                    float(data.get("retry_after", 1)) if isinstance(data, dict) else 1.0
+                )
+                self.logger.warning(
+                    f"Webhook rate limited. Retrying in {retry_after:.2f} seconds..."
+                )
+                await asyncio.sleep(retry_after)
+                continue
+            if response.status >= 500 and attempt < self.max_retries:
+                wait_time = backoff.next_delay()
+                self.logger.warning(
+                    f"Webhook returned {response.status}. Retrying in {wait_time:.2f} seconds..."
+                )
+                await asyncio.sleep(wait_time)
+                continue
+            if response.status == 404:
+                raise discord.NotFound(response, data)
+            if response.status == 403:
+                raise discord.Forbidden(response, data)
+            if response.status >= 400:
+                raise discord.HTTPException(response, data)
+            return data
+
+        raise discord.HTTPException(response, data)